@@ -14,7 +14,10 @@ from statsmodels.tsa.stattools import adfuller
 from statsmodels.tsa.seasonal import STL
 import os
 import scipy
-from typing import List, Tuple
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'sdstools'))
+from timeseries_storage import read_merged_transect_time_series_file
+from linear_trends import linregress_columns
 import datetime
 import warnings
 warnings.filterwarnings("ignore")
@@ -81,32 +84,17 @@ def adf_test(timeseries):
     return stationary_bool
 
 
-def get_linear_trend(df):
+def get_linear_trends(df):
     """
-    LLS on single transect timeseries
+    LLS on every transect timeseries at once
     inputs:
-    df (pandas DataFrame): two columns, dates and cross-shore positions
-    trend_plot_path (str): path to save plot to
+    df (pandas DataFrame): datetime index, one column of cross-shore positions per transect
     outputs:
-    lls_result: all the lls results (slope, intercept, stderr, intercept_stderr, rvalue)
-    x: datetimes in years
+    slope, intercept, rvalue, pvalue, stderr, intercept_stderr (np.ndarray): one value per column
     """
-    
-    datetimes = np.array(df.index)
-    shore_pos = np.array(df.values)
-    datetimes_seconds = [None]*len(datetimes)
-    initial_time = datetimes[0]
-    for i in range(len(df)):
-        t = df.index[i]
-        dt = t-initial_time
-        dt_sec = dt.total_seconds()
-        datetimes_seconds[i] = dt_sec
-    datetimes_seconds = np.array(datetimes_seconds)
-    datetimes_years = datetimes_seconds/(60*60*24*365)
-    x = datetimes_years
-    y = shore_pos
-    lls_result = scipy.stats.linregress(x,y)
-    return lls_result.slope, lls_result.intercept,lls_result.rvalue, lls_result.pvalue, lls_result.stderr, lls_result.intercept_stderr #, x
+    datetimes_seconds = (df.index - df.index[0]).total_seconds().values
+    x = datetimes_seconds/(60*60*24*365)
+    return linregress_columns(x, df.values)
 
 
 def compute_approximate_entropy(U, m, r):
@@ -126,38 +114,6 @@ def compute_approximate_entropy(U, m, r):
     return abs(_phi(m+1) - _phi(m))
 
 
-def read_merged_transect_time_series_file(transect_time_series_file: str) -> Tuple[np.ndarray, pd.Series, List[str]]:
-    """
-    Read and parse a CoastSeg/CoastSat output file in stacked column wise date and transects format.
-
-    This function reads a CSV file, removes unnamed columns, and transforms the data into a matrix.
-    It also extracts a vector of dates and a vector of transects from the data.
-
-    Parameters:
-    transect_time_series_file (str): The path to the CSV file to be read.
-
-    Returns:
-    Tuple[np.ndarray, pd.Series, List[str]]: A tuple containing the shoreline positions along the transects as a matrix (numpy array), 
-    shoreline positions along the transects as a vector (pandas Series), and the transects vector (list of strings).
-    """
-    merged_transect_time_series = pd.read_csv(transect_time_series_file, index_col=False)
-    merged_transect_time_series.reset_index(drop=True, inplace=True)
-
-    # Removing unnamed columns using drop function
-    merged_transect_time_series.drop(merged_transect_time_series.columns[merged_transect_time_series.columns.str.contains(
-        'unnamed', case=False)], axis=1, inplace=True)
-    
-    # Extracting the shoreline positions along the transects for each date
-    data_matrix = merged_transect_time_series.T.iloc[1:]
-    data_matrix = np.array(data_matrix.values).astype('float')
-
-    dates_vector = pd.to_datetime(merged_transect_time_series.dates)
-    # get the transect IDs as a vector
-    transects_vector = [t for t in merged_transect_time_series.T.index[1:] if 'date' not in t]
-
-    return data_matrix, dates_vector, transects_vector
-
-
 def detrend_shoreline_rel_mean(input_matrix):
     "subtract a stable (N-average) initial position from shoreline time-series"
     shore_change = (input_matrix - input_matrix.mean(axis=0)).T
@@ -262,12 +218,8 @@ def main():
     autocorr_mins = []
     lag_mins = []
     entropy = []
-    linear_trend_slopes = []
-    linear_trend_intercepts = []
-    linear_trend_rvalues = []
-    linear_trend_pvalues = []
-    linear_trend_stderr = []
-    linear_trend_intercept_stderr = []
+    (linear_trend_slopes, linear_trend_intercepts, linear_trend_rvalues,
+     linear_trend_pvalues, linear_trend_stderr, linear_trend_intercept_stderr) = get_linear_trends(df_resampled)
 
     trend_mat = []
     season_mat = []
@@ -278,14 +230,6 @@ def main():
         stationary_bool = adf_test(df_resampled[k])
         stationarity.append(stationary_bool)
 
-        sl, intercept, rvalue, pvalue, stderr, int_stderr = get_linear_trend(df_resampled[k])
-        linear_trend_slopes.append(sl)
-        linear_trend_intercepts.append(intercept)
-        linear_trend_rvalues.append(rvalue)
-        linear_trend_pvalues.append(pvalue)
-        linear_trend_stderr.append(stderr)
-        linear_trend_intercept_stderr.append(int_stderr)
-
         autocorr_min, lag_min, autocorr, lags = compute_autocorrelation(df_resampled[k])
         approx_entropy = compute_approximate_entropy(df_demean[k].values,2,np.std(df_demean[k].values))
 
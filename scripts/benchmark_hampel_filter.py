@@ -0,0 +1,102 @@
+
+
+## Benchmarks the streaming rolling median/MAD engine against the sliding window implementation of the Hampel filter
+## written for the SDStools HampelFilter module used by filter_outliers_hampel_spacetime.py
+
+## Example usage, from cmd:
+## python benchmark_hampel_filter.py
+## python benchmark_hampel_filter.py -n 10000 -t 20 -w 5 51 101 251 501
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'sdstools'))
+from HampelFilter import HampelFilter
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parse command-line arguments for the Hampel filter benchmark script.
+    Arguments and their defaults are defined within the function.
+    Returns:
+    - argparse.Namespace: A namespace containing the script's command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Script to benchmark the streaming and sliding window Hampel filter engines")
+
+    parser.add_argument(
+        "-N",
+        "-n",
+        dest="num_samples",
+        type=int,
+        required=False,
+        default=10000,
+        help="Set the number of samples per timeseries.",
+    )
+
+    parser.add_argument(
+        "-T",
+        "-t",
+        dest="num_transects",
+        type=int,
+        required=False,
+        default=10,
+        help="Set the number of timeseries (transects).",
+    )
+
+    parser.add_argument(
+        "-W",
+        "-w",
+        dest="window_sizes",
+        type=int,
+        nargs="+",
+        required=False,
+        default=[5, 51, 101, 251, 501],
+        help="Set the odd window sizes to benchmark.",
+    )
+
+    return parser.parse_args()
+
+
+def time_engine(cs_data_matrix, window_size, engine):
+    """
+    Time one pass of the Hampel filter over every row of the matrix with the given engine
+
+    inputs:
+    cs_data_matrix (np.ndarray): transects x time matrix
+    window_size (int): odd window size
+    engine (str): 'window' or 'streaming'
+    outputs:
+    elapsed (float): seconds taken
+    mask (np.ndarray): boolean outlier mask
+    """
+    start = time.perf_counter()
+    mask = HampelFilter(window_size=window_size, n_sigma=3, engine=engine).apply_matrix(cs_data_matrix, axis=1).get_mask()
+    return time.perf_counter() - start, mask
+
+
+##==========================================
+def main():
+    args = parse_arguments()
+
+    rng = np.random.default_rng(0)
+    cs_data_matrix = np.cumsum(rng.normal(size=(args.num_transects, args.num_samples)), axis=1)
+    spikes = rng.random(cs_data_matrix.shape) < 0.01
+    cs_data_matrix[spikes] += rng.normal(scale=50, size=np.count_nonzero(spikes))
+
+    print(f"Matrix: {args.num_transects} transects x {args.num_samples} samples")
+    print(f"{'window':>8} {'window engine (s)':>18} {'streaming engine (s)':>21} {'speedup':>8} {'window temp (MB)':>17} {'same outliers':>14}")
+    for window_size in args.window_sizes:
+        window_time, window_mask = time_engine(cs_data_matrix, window_size, 'window')
+        streaming_time, streaming_mask = time_engine(cs_data_matrix, window_size, 'streaming')
+        # the window engine holds an n x w array of absolute deviations while computing the MAD
+        temp_mb = cs_data_matrix.size * window_size * 8 / 1e6
+        print(f"{window_size:>8} {window_time:>18.3f} {streaming_time:>21.3f} {window_time/streaming_time:>8.2f} "
+              f"{temp_mb:>17.1f} {str(np.array_equal(window_mask, streaming_mask)):>14}")
+
+
+if __name__ == "__main__":
+    main()
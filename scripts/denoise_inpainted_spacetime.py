@@ -11,7 +11,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from functools import partial
-from typing import List, Tuple
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'sdstools'))
+from timeseries_storage import read_merged_transect_time_series_file
 from skimage.restoration import calibrate_denoiser, denoise_wavelet
 # rescale_sigma=True required to silence deprecation warnings
 _denoise_wavelet = partial(denoise_wavelet, rescale_sigma=True)
@@ -54,37 +56,6 @@ def filter_wavelet_auto(cs_matrix_inpaint):
     cs_inpaint_denoised = calibrated_denoiser(cs_matrix_inpaint)
     return cs_inpaint_denoised
 
-def read_merged_transect_time_series_file(transect_time_series_file: str) -> Tuple[np.ndarray, pd.Series, List[str]]:
-    """
-    Read and parse a CoastSeg/CoastSat output file in stacked column wise date and transects format.
-
-    This function reads a CSV file, removes unnamed columns, and transforms the data into a matrix.
-    It also extracts a vector of dates and a vector of transects from the data.
-
-    Parameters:
-    transect_time_series_file (str): The path to the CSV file to be read.
-
-    Returns:
-    Tuple[np.ndarray, pd.Series, List[str]]: A tuple containing the shoreline positions along the transects as a matrix (numpy array), 
-    shoreline positions along the transects as a vector (pandas Series), and the transects vector (list of strings).
-    """
-    merged_transect_time_series = pd.read_csv(transect_time_series_file, index_col=False)
-    merged_transect_time_series.reset_index(drop=True, inplace=True)
-
-    # Removing unnamed columns using drop function
-    merged_transect_time_series.drop(merged_transect_time_series.columns[merged_transect_time_series.columns.str.contains(
-        'unnamed', case=False)], axis=1, inplace=True)
-    
-    # Extracting the shoreline positions along the transects for each date
-    data_matrix = merged_transect_time_series.T.iloc[1:]
-    data_matrix = np.array(data_matrix.values).astype('float')
-
-    dates_vector = pd.to_datetime(merged_transect_time_series.dates)
-    # get the transect IDs as a vector
-    transects_vector = [t for t in merged_transect_time_series.T.index[1:] if 'date' not in t]
-
-    return data_matrix, dates_vector, transects_vector
-
 def parse_arguments() -> argparse.Namespace:
     """
     Parse command-line arguments to filter a SDS data matrix script.
@@ -1,7 +1,149 @@
 import numpy as np
 from numpy.lib.stride_tricks import sliding_window_view
+from bisect import bisect_left, insort
+import warnings
 import pandas as pd
-from typing import Union, List, Tuple
+from typing import Optional, Union, List, Tuple
+
+# above this window size the 'auto' engine switches from sliding_window_view to the streaming sorted window
+STREAMING_WINDOW_SIZE = 100
+
+
+class SortedWindow:
+    """
+    Sliding window of samples kept in sorted order, for streaming rolling medians.
+    Each add/remove is a binary search plus a memmove of the window, the median is an index lookup and the
+    median absolute deviation is a binary search over the two sorted halves, so memory stays linear in the window.
+    """
+
+    def __init__(self):
+        self._values = []
+        self.num_nans = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, value: float):
+        if value != value:
+            self.num_nans += 1
+        else:
+            insort(self._values, value)
+
+    def remove(self, value: float):
+        if value != value:
+            self.num_nans -= 1
+        else:
+            del self._values[bisect_left(self._values, value)]
+
+    def median(self) -> float:
+        """ Median of the valid samples in the window, NaN if there are none.
+        """
+        values = self._values
+        n = len(values)
+        if n == 0:
+            return np.nan
+        if n % 2 == 1:
+            return values[n // 2]
+        return (values[n // 2 - 1] + values[n // 2]) / 2
+
+    def _kth_deviation(self, median: float, split: int, k: int) -> float:
+        # k-th smallest |value - median|, merging the deviations below the median (read right to left)
+        # with the deviations above it (read left to right), both already sorted
+        values = self._values
+        num_below = split
+        num_above = len(values) - split
+        lo = max(0, k + 1 - num_above)
+        hi = min(k + 1, num_below)
+        while lo < hi:
+            i = (lo + hi) // 2
+            j = k + 1 - i
+            if median - values[split - 1 - i] < values[split + j - 1] - median:
+                lo = i + 1
+            else:
+                hi = i
+        j = k + 1 - lo
+        candidates = []
+        if lo > 0:
+            candidates.append(median - values[split - lo])
+        if j > 0:
+            candidates.append(values[split + j - 1] - median)
+        return max(candidates)
+
+    def mad(self, median: float) -> float:
+        """ Median absolute deviation of the valid samples in the window from the given median.
+        """
+        n = len(self._values)
+        if n == 0:
+            return np.nan
+        split = bisect_left(self._values, median)
+        if n % 2 == 1:
+            return self._kth_deviation(median, split, n // 2)
+        return (self._kth_deviation(median, split, n // 2 - 1) + self._kth_deviation(median, split, n // 2)) / 2
+
+
+def _rolling_windows(values: List[float], window_size: int, min_valid: Optional[int]):
+    """ Yield (start index, SortedWindow) for every full window of values that can be tested.
+    """
+    window = SortedWindow()
+    for i, value in enumerate(values):
+        window.add(value)
+        if i >= window_size:
+            window.remove(values[i - window_size])
+        if i < window_size - 1:
+            continue
+        if min_valid is None:
+            if window.num_nans > 0:
+                continue
+        elif len(window) < min_valid:
+            continue
+        yield i - window_size + 1, window
+
+
+def rolling_median_mad(x: np.ndarray, window_size: int, min_valid: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ Streaming rolling median and (unscaled) median absolute deviation over every full window of x.
+
+    Runs in O(n log w) comparisons with O(w) extra memory per series, instead of materialising an n x w
+    array of deviations like the sliding_window_view approach.
+
+    :param x: 1D or 2D array of timeseries values, windows run along the last axis
+    :param window_size: length of the sliding window
+    :param min_valid: if given, NaNs are ignored and windows with fewer valid samples are NaN.
+        default is None, where any NaN in a window makes that window NaN.
+    :return: a tuple of the rolling median and rolling MAD, each `window_size - 1` shorter than x along the last axis
+    """
+    x = np.asarray(x, dtype=float)
+    series = x.reshape(-1, x.shape[-1])
+    out_shape = x.shape[:-1] + (max(x.shape[-1] - window_size + 1, 0),)
+    medians = np.full((series.shape[0], out_shape[-1]), np.nan)
+    mads = np.full((series.shape[0], out_shape[-1]), np.nan)
+
+    for row in range(series.shape[0]):
+        for start, window in _rolling_windows(series[row].tolist(), window_size, min_valid):
+            median = window.median()
+            medians[row, start] = median
+            mads[row, start] = window.mad(median)
+
+    return medians.reshape(out_shape), mads.reshape(out_shape)
+
+
+def rolling_median(x: np.ndarray, window_size: int, min_valid: Optional[int] = None) -> np.ndarray:
+    """ Streaming rolling median over every full window of x, see rolling_median_mad.
+
+    :param x: 1D or 2D array of timeseries values, windows run along the last axis
+    :param window_size: length of the sliding window
+    :param min_valid: if given, NaNs are ignored and windows with fewer valid samples are NaN.
+    :return: the rolling median, `window_size - 1` shorter than x along the last axis
+    """
+    x = np.asarray(x, dtype=float)
+    series = x.reshape(-1, x.shape[-1])
+    out_shape = x.shape[:-1] + (max(x.shape[-1] - window_size + 1, 0),)
+    medians = np.full((series.shape[0], out_shape[-1]), np.nan)
+
+    for row in range(series.shape[0]):
+        for start, window in _rolling_windows(series[row].tolist(), window_size, min_valid):
+            medians[row, start] = window.median()
+
+    return medians.reshape(out_shape)
 
 
 class HampelFilter:
@@ -9,13 +151,19 @@ class HampelFilter:
     HampelFilter class for providing additional functionality such as checking the upper/lower boundaries for paramter tuning.
     """
 
-    def __init__(self, window_size: int = 5, n_sigma: int = 3, c: float = 1.4826):
+    def __init__(self, window_size: int = 5, n_sigma: int = 3, c: float = 1.4826, min_valid: Optional[int] = None,
+                 engine: str = 'auto'):
         """ Initialize HampelFilter object. Rolling median and rolling sigma are calculated here.
 
         :param window_size: length of the sliding window, a positive odd integer.
             (`window_size` - 1) // 2 adjacent samples on each side of the current sample are used for calculating median.
         :param n_sigma: threshold for outlier detection, a real scalar greater than or equal to 0. default is 3.
         :param c: consistency constant. default is 1.4826, supposing the given timeseries values are normally distributed.
+        :param min_valid: if given, NaNs are ignored (nan-median/nan-MAD) and only windows with at least
+            `min_valid` non-NaN samples are tested. default is None, where any NaN in a window disables that window.
+        :param engine: how rolling statistics are computed. 'window' uses sliding_window_view (fast for short windows),
+            'streaming' uses rolling_median_mad (linear memory, better for long windows), 'auto' (default) picks
+            'streaming' when window_size is greater than STREAMING_WINDOW_SIZE.
         :return: the outlier indices
         """
 
@@ -25,15 +173,49 @@ class HampelFilter:
         if not (type(n_sigma) == int and n_sigma >= 0):
             raise ValueError("n_sigma must be a positive integer greater than or equal to 0.")
 
+        if not (min_valid is None or (type(min_valid) == int and 0 < min_valid <= window_size)):
+            raise ValueError("min_valid must be None or a positive integer no greater than window_size.")
+
+        if engine not in ('auto', 'window', 'streaming'):
+            raise ValueError("engine must be one of 'auto', 'window' or 'streaming'.")
+
         self.window_size = window_size
         self.n_sigma = n_sigma
         self.c = c
+        self.min_valid = min_valid
+        if engine == 'auto':
+            engine = 'streaming' if window_size > STREAMING_WINDOW_SIZE else 'window'
+        self.engine = engine
 
         # These values will be set after executing apply()
         self._outlier_indices = None
+        self._outlier_mask = None
         self._upper_bound = None
         self._lower_bound = None
 
+    def _rolling_median_sigma(self, series: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ Rolling median and scaled MAD along the last axis of series. Windows that can't be tested are NaN.
+        """
+        if self.engine == 'streaming':
+            rolling_median, rolling_mad = rolling_median_mad(series, self.window_size, min_valid=self.min_valid)
+            return rolling_median, self.c * rolling_mad
+
+        x_window_view = sliding_window_view(series, window_shape=self.window_size, axis=-1)
+        if self.min_valid is None:
+            rolling_median = np.median(x_window_view, axis=-1)
+            rolling_sigma = self.c * np.median(np.abs(x_window_view - rolling_median[..., np.newaxis]), axis=-1)
+            return rolling_median, rolling_sigma
+
+        with warnings.catch_warnings():
+            # all-NaN windows are expected in gappy series, they are masked below
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            rolling_median = np.nanmedian(x_window_view, axis=-1)
+            rolling_sigma = self.c * np.nanmedian(np.abs(x_window_view - rolling_median[..., np.newaxis]), axis=-1)
+        too_few = np.count_nonzero(~np.isnan(x_window_view), axis=-1) < self.min_valid
+        rolling_median[too_few] = np.nan
+        rolling_sigma[too_few] = np.nan
+        return rolling_median, rolling_sigma
+
     def apply(self, x: Union[List, pd.Series, np.ndarray]):
         """ Return the indices of the detected outliers by the filter.
 
@@ -46,9 +228,7 @@ class HampelFilter:
             raise ValueError("x must be either of type List, numpy.ndarray, or pandas.Series.")
 
         # calculate rolling_median and rolling_sigma using the given parameters.
-        x_window_view = sliding_window_view(np.array(x), window_shape=self.window_size)
-        rolling_median = np.median(x_window_view, axis=1)
-        rolling_sigma = self.c * np.median(np.abs(x_window_view - rolling_median.reshape(-1, 1)), axis=1)
+        rolling_median, rolling_sigma = self._rolling_median_sigma(np.array(x))
 
         self._upper_bound = rolling_median + (self.n_sigma * rolling_sigma)
         self._lower_bound = rolling_median - (self.n_sigma * rolling_sigma)
@@ -69,6 +249,46 @@ class HampelFilter:
 
         return self
 
+    def apply_matrix(self, x: np.ndarray, axis: int = -1):
+        """ Detect outliers in every series of a 2D array at once, e.g. a (transects x time) matrix.
+
+        :param x: 2D array of timeseries values
+        :param axis: the time axis of x. default is -1.
+
+        :return: self, with a boolean outlier mask the shape of x
+        """
+        x = np.asarray(x, dtype=float)
+        if x.ndim != 2:
+            raise ValueError("x must be a 2D array.")
+
+        # put time last so each row is one series
+        series = np.moveaxis(x, axis, -1)
+        half_window = (self.window_size - 1) // 2
+        outlier_mask = np.zeros(series.shape, dtype=bool)
+
+        if series.shape[-1] >= self.window_size:
+            rolling_median, rolling_sigma = self._rolling_median_sigma(series)
+
+            self._upper_bound = np.moveaxis(rolling_median + (self.n_sigma * rolling_sigma), -1, axis)
+            self._lower_bound = np.moveaxis(rolling_median - (self.n_sigma * rolling_sigma), -1, axis)
+
+            outlier_mask[:, half_window:series.shape[-1] - half_window] = (
+                np.abs(series[:, half_window:series.shape[-1] - half_window] - rolling_median)
+                >= (self.n_sigma * rolling_sigma)
+            )
+
+        self._outlier_mask = np.moveaxis(outlier_mask, -1, axis)
+        return self
+
+    def get_mask(self) -> np.ndarray:
+        """ Returns the boolean outlier mask set by apply_matrix().
+
+        :return: boolean array the shape of the given matrix, True where a sample is an outlier
+        """
+        if self._outlier_mask is None:
+            raise AttributeError("Outlier mask has not been set. Execute hampel_filter_object.apply_matrix(x) first.")
+        return self._outlier_mask
+
     def get_indices(self) -> Union[List, pd.Series, np.ndarray]:
         """
         """
@@ -87,8 +307,8 @@ class HampelFilter:
         return self._lower_bound, self._upper_bound
 
 
-def hampel_filter(x: Union[List, pd.Series, np.ndarray], window_size: int = 5, n_sigma: int = 3, c: float = 1.4826) \
-        -> Union[List, pd.Series, np.ndarray]:
+def hampel_filter(x: Union[List, pd.Series, np.ndarray], window_size: int = 5, n_sigma: int = 3, c: float = 1.4826,
+                  min_valid: Optional[int] = None) -> Union[List, pd.Series, np.ndarray]:
     """ Outlier detection using the Hampel identifier
 
     :param x: timeseries values of type List, numpy.ndarray, or pandas.Series
@@ -96,7 +316,25 @@ def hampel_filter(x: Union[List, pd.Series, np.ndarray], window_size: int = 5, n
         (`window_size` - 1) // 2 adjacent samples on each side of the current sample are used for calculating median.
     :param n_sigma: threshold for outlier detection, a real scalar greater than or equal to 0. default is 3.
     :param c: consistency constant. default is 1.4826, supposing the given timeseries values are normally distributed.
+    :param min_valid: if given, ignore NaNs and only test windows with at least this many valid samples.
     :return: the outlier indices
     """
 
-    return HampelFilter(window_size=window_size, n_sigma=n_sigma, c=c).apply(x).get_indices()
+    return HampelFilter(window_size=window_size, n_sigma=n_sigma, c=c, min_valid=min_valid).apply(x).get_indices()
+
+
+def hampel_filter_matrix(x: np.ndarray, window_size: int = 5, n_sigma: int = 3, c: float = 1.4826, axis: int = -1,
+                         min_valid: Optional[int] = None) -> np.ndarray:
+    """ Outlier detection using the Hampel identifier, on every series of a 2D array in one vectorized pass
+
+    :param x: 2D array of timeseries values, e.g. a (transects x time) matrix
+    :param window_size: length of the sliding window, a positive odd integer.
+        (`window_size` - 1) // 2 adjacent samples on each side of the current sample are used for calculating median.
+    :param n_sigma: threshold for outlier detection, a real scalar greater than or equal to 0. default is 3.
+    :param c: consistency constant. default is 1.4826, supposing the given timeseries values are normally distributed.
+    :param axis: the time axis of x. default is -1.
+    :param min_valid: if given, ignore NaNs and only test windows with at least this many valid samples.
+    :return: boolean outlier mask the shape of x
+    """
+
+    return HampelFilter(window_size=window_size, n_sigma=n_sigma, c=c, min_valid=min_valid).apply_matrix(x, axis=axis).get_mask()
@@ -11,9 +11,14 @@ import scipy
 from scipy import stats, signal
 import pandas as pd
 from statsmodels.tsa.stattools import adfuller
-import HampelFilter.hampel_filter as hampel_filter
+from HampelFilter import hampel_filter, rolling_median
+from linear_trends import linregress, years_since
 import os
 import csv
+
+# median_filter uses scipy.signal.medfilt (C) up to this window size and the streaming
+# rolling median above it, where medfilt's per-window cost grows with the window on older scipy
+STREAMING_MEDIAN_WINDOW_SIZE = 1001
     
 
 def adf_test(timeseries):
@@ -66,8 +71,12 @@ def median_filter(df, window):
     returns
     df (pandas DataFrame): contains trace with median filter applied
     """
-    vals = df['position']
-    vals_median_filter = scipy.signal.medfilt(vals, window)
+    vals = df['position'].values.astype(float)
+    if window <= STREAMING_MEDIAN_WINDOW_SIZE:
+        vals_median_filter = scipy.signal.medfilt(vals, window)
+    else:
+        # zero pad the ends like scipy.signal.medfilt, then use the streaming rolling median
+        vals_median_filter = rolling_median(np.pad(vals, (window-1)//2), window)
     new_df = pd.DataFrame({'position':vals_median_filter},
                           index=df.index
                           )
@@ -84,20 +93,9 @@ def get_linear_trend(df):
     x: datetimes in years
     """
     
-    datetimes = np.array(df.index)
-    shore_pos = np.array(df['position'])
-    datetimes_seconds = [None]*len(datetimes)
-    initial_time = datetimes[0]
-    for i in range(len(df)):
-        t = df.index[i]
-        dt = t-initial_time
-        dt_sec = dt.total_seconds()
-        datetimes_seconds[i] = dt_sec
-    datetimes_seconds = np.array(datetimes_seconds)
-    datetimes_years = datetimes_seconds/(60*60*24*365)
-    x = datetimes_years
-    y = shore_pos
-    lls_result = stats.linregress(x,y)
+    x = years_since(df.index)
+    y = np.array(df['position'])
+    lls_result = linregress(x,y)
     return lls_result, x
 
 def de_trend_timeseries(df, lls_result, x):
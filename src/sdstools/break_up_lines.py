@@ -13,6 +13,8 @@ import warnings
 import rasterio
 import rioxarray
 from scipy import stats
+import line_smoothing
+from line_smoothing import smooth_geometries
 warnings.filterwarnings("ignore")
 
 def wgs84_to_utm_df(geo_df):
@@ -71,24 +73,16 @@ def arr_to_LineString(coords):
 
 def chaikins_corner_cutting(coords, refinements=3):
     """
-    Smooths out lines or polygons with Chaikin's method
+    Smooths out lines or polygons with Chaikin's method,
+    keeps this module's default of 3 refinements (line_smoothing defaults to 5)
     inputs:
     coords (list of tuples): [(x1,y1), (x..,y..), (xn,yn)]
+    refinements (int): number of refinements
     outputs:
-    coords (list of tuples): [(x1,y1), (x..,y..), (xn,yn)],
-                              this is the smooth line
+    coords (np.ndarray): [(x1,y1), (x..,y..), (xn,yn)],
+                         this is the smooth line
     """
-    i=0
-    for _ in range(refinements):
-        L = coords.repeat(2, axis=0)
-        R = np.empty_like(L)
-        R[0] = L[0]
-        R[2::2] = L[1:-1:2]
-        R[1:-1:2] = L[2::2]
-        R[-1] = L[-1]
-        coords = L * 0.75 + R * 0.25
-        i=i+1
-    return coords
+    return line_smoothing.chaikins_corner_cutting(coords, refinements=refinements)
 
 def smooth_lines(lines,refinements=2):
     """
@@ -102,18 +96,9 @@ def smooth_lines(lines,refinements=2):
     new_lines (gdf): gdf of smooth lines in UTM
     """
     lines = wgs84_to_utm_df(lines)
-    lines['geometry'] = lines['geometry']
-    new_geometries = [None]*len(lines)
     new_lines = lines.copy()
-    for i in range(len(new_lines)):
-        simplify_param = new_lines['simplify_param'].iloc[i]
-        line = new_lines.iloc[i]['geometry']
-        line = line.simplify(simplify_param)
-        coords = LineString_to_arr(line)
-        refined = chaikins_corner_cutting(coords, refinements=refinements)
-        refined_geom = arr_to_LineString(refined)
-        new_geometries[i] = refined_geom
-    new_lines['geometry'] = new_geometries
+    simplified = shapely.simplify(new_lines['geometry'].values, tolerance=new_lines['simplify_param'].values)
+    new_lines['geometry'] = smooth_geometries(simplified, refinements=refinements)
     return new_lines
 
 def explode_multilinestrings(gdf):
@@ -145,6 +130,49 @@ def explode_multilinestrings(gdf):
 
     return final_gdf
 
+##distance threshold (m) to break lines at and simplify tolerance (m) for each satellite
+SPLIT_PARAMS = {'L5':(45, np.sqrt(30**2 + 30**2 + 30**2)/2),
+                'L7':(45, np.sqrt(30**2 + 30**2 + 30**2)/2),
+                'L8':(45, np.sqrt(30**2 + 30**2 + 30**2)/2),
+                'L9':(45, np.sqrt(30**2 + 30**2 + 30**2)/2),
+                'S2':(15, np.sqrt(10**2 + 10**2 + 10**2)/2),
+                'PS':(8, np.sqrt(5**2 + 5**2 + 5**2)/2)}
+
+def split_geometries(geometries, dist_thresholds, linestrings_or_multi_points='LineString'):
+    """
+    Breaks every line up wherever the distance between consecutive vertices is above its threshold,
+    all of the lines' vertices are handled together as one coordinate array
+    inputs:
+    geometries (np.ndarray): LineStrings or MultiPoints in a planar crs
+    dist_thresholds (np.ndarray): break distance for each geometry
+    linestrings_or_multi_points (str): 'LineString' to make LineStrings, 'MultiPoint' to make MultiPoints
+    outputs:
+    parts (np.ndarray): the broken up geometries, parts with a single vertex are dropped
+    source_rows (np.ndarray): position in geometries of the geometry each part came from
+    """
+    coords, line_index = shapely.get_coordinates(geometries, return_index=True)
+
+    ##a new part starts at each line's first vertex and after every gap above the line's threshold
+    new_part = np.ones(len(coords), dtype=bool)
+    gaps = np.hypot(*np.diff(coords, axis=0).T)
+    new_part[1:] = (line_index[1:] != line_index[:-1]) | (gaps > dist_thresholds[line_index[1:]])
+    part_starts = np.flatnonzero(new_part)
+    part_sizes = np.diff(np.append(part_starts, len(coords)))
+
+    ##drop single points
+    keep_parts = part_sizes > 1
+    part_index = np.repeat(np.cumsum(keep_parts) - 1, part_sizes)
+    keep_vertices = np.repeat(keep_parts, part_sizes)
+    source_rows = line_index[part_starts[keep_parts]]
+    if not keep_parts.any():
+        return np.empty(0, dtype=object), source_rows
+
+    if linestrings_or_multi_points == 'LineString':
+        parts = shapely.linestrings(coords[keep_vertices], indices=part_index[keep_vertices])
+    elif linestrings_or_multi_points == 'MultiPoint':
+        parts = shapely.multipoints(coords[keep_vertices], indices=part_index[keep_vertices])
+    return parts, source_rows
+
 def split_line(input_lines_or_multipoints_path,
                output_path,
                linestrings_or_multi_points,
@@ -170,69 +198,23 @@ def split_line(input_lines_or_multipoints_path,
     # Break any MultiLineStrings into individual LineStrings
     input_lines_or_multipoints = explode_multilinestrings(input_lines_or_multipoints)
 
-    ##these lists are gonna hold the broken up lines and their simplified tolerance
-    simplify_params = []
-    all_lines = []
-    print('splitting lines')
-    for idx,row in input_lines_or_multipoints.iterrows():
-        line = input_lines_or_multipoints[input_lines_or_multipoints.index==idx].reset_index(drop=True)
-
-        ##setting distance threshold and simplify tolerance based on satellite
-        satname = line['satname'].iloc[0]
-        if (satname == 'L5') or (satname == 'L7') or (satname == 'L8') or (satname == 'L9'):
-            dist_threshold = 45
-            simplify_param = np.sqrt(30**2 + 30**2 + 30**2)/2
-        elif (satname=='S2'):
-            dist_threshold = 15
-            simplify_param = np.sqrt(10**2 + 10**2 + 10**2)/2
-        elif (satname=='PS'):
-            dist_threshold = 8
-            simplify_param = np.sqrt(5**2 + 5**2 + 5**2)/2
-
-        column_names = list(line.columns)
-        column_names.remove('geometry')
-        points_geometry = [shapely.Point(x,y) for x,y in line['geometry'].iloc[0].coords]
-        attributes = [[line[column_name].values[0]]*len(points_geometry) for column_name in column_names]
-        input_coords_dict = dict(zip(column_names, attributes))
-        input_coords_dict['geometry'] = points_geometry
-        input_coords = gpd.GeoDataFrame(input_coords_dict, crs=source_crs)
-        
-        ##make the shifted geometries to compute point to point distance
-        input_coords_columns = input_coords.columns[:]
-        new_geometry_column = 'geom_2'
-        input_coords[new_geometry_column] = input_coords['geometry'].shift(-1)
+    ##distance threshold and simplify tolerance for each line based on satellite
+    satnames = input_lines_or_multipoints['satname'].values
+    unknown = ~np.isin(satnames, list(SPLIT_PARAMS))
+    if unknown.any():
+        raise ValueError('no split parameters for satellite(s) ' + ', '.join(map(str, np.unique(satnames[unknown]))))
+    dist_thresholds = np.array([SPLIT_PARAMS[satname][0] for satname in satnames], dtype=float)
+    simplify_params = np.array([SPLIT_PARAMS[satname][1] for satname in satnames], dtype=float)
 
-        ##compute distance
-        def my_dist(in_row):
-            return in_row['geometry'].distance(in_row['geom_2'])
-        input_coords['dist'] = input_coords.loc[:input_coords.shape[0]-2].apply(my_dist, axis=1)
-        ##break up line into multiple lines
-        input_coords['break'] = (input_coords['dist'] > dist_threshold).shift(1)
-        input_coords.loc[0,'break'] = True
-        input_coords['line_id'] = input_coords['break'].astype(int).cumsum()
-
-        ##make the lines
-        def my_line_maker(in_grp):
-            if len(in_grp) == 1:
-                return list(in_grp)[0]
-            elif linestrings_or_multi_points == 'LineString':
-                return shapely.geometry.LineString(list(in_grp))
-            elif linestrings_or_multi_points == 'MultiPoint':
-                return shapely.geometry.MultiPoint(list(in_grp))
-        new_lines_gdf = input_coords.groupby(['line_id']).agg({'geometry':my_line_maker}).reset_index()
-        
-        ##drop points and only keep linestrings
-        new_lines_gdf['geom_type'] = [type(a) for a in new_lines_gdf['geometry']]
-        new_lines_gdf = new_lines_gdf[new_lines_gdf['geom_type']!=shapely.Point].reset_index(drop=True)
-        for column in column_names:
-            new_lines_gdf[column] = [line[column].values[0]]*len(new_lines_gdf)
-        new_lines_gdf = new_lines_gdf.drop(columns=['geom_type', 'line_id'])
-        all_lines.append(new_lines_gdf)
-        simplify_params.append(simplify_param)
-
-    ##concatenate everything into one gdf, set geometry and crs
-    all_lines_gdf = pd.concat(all_lines)
-    all_lines_gdf['simplify_param'] = simplify_param
+    print('splitting lines')
+    parts, source_rows = split_geometries(input_lines_or_multipoints['geometry'].values,
+                                          dist_thresholds,
+                                          linestrings_or_multi_points)
+
+    ##every part keeps the attributes of the line it came from
+    all_lines_gdf = input_lines_or_multipoints.iloc[source_rows].reset_index(drop=True)
+    all_lines_gdf['geometry'] = parts
+    all_lines_gdf['simplify_param'] = simplify_params[source_rows]
     all_lines_gdf['date'] = pd.to_datetime(all_lines_gdf['date'], utc=True)
     all_lines_gdf['year'] = all_lines_gdf['date'].dt.year
     all_lines_gdf = all_lines_gdf.set_geometry('geometry')
@@ -1,5 +1,5 @@
 """
-Mostly vectorized version of computing shoreline intersections with transects
+Vectorized version of computing shoreline intersections with transects
 
 Mark Lundine
 """
@@ -8,10 +8,13 @@ import geopandas as gpd
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
+import shutil
 import numpy as np
 import shapely
 import datetime
 import math 
+from concurrent.futures import ProcessPoolExecutor
+from timeseries_storage import is_parquet, read_merged, read_matrix, write_merged, write_matrix, ParquetAppender
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -44,88 +47,396 @@ def cross_distance(start_x, start_y, end_x, end_y):
     dist = np.sqrt((end_x-start_x)**2 + (end_y-start_y)**2)
     return dist
 
+def most_seaward_intersections(intersections, start_x, start_y):
+    """
+    Batched selection of the most seaward intersection point for each shoreline/transect pair.
+    All intersection geometries are exploded to their coordinates at once, cross distances
+    are computed in one numpy operation and the farthest point per pair is kept with a grouped arg-max.
+    inputs:
+    intersections (array of shapely geometries): intersection of each shoreline with its transect
+    start_x (np.ndarray): x coordinate of each transect's start point
+    start_y (np.ndarray): y coordinate of each transect's start point
+    outputs:
+    intersect_x (np.ndarray): x coordinate of the most seaward intersection (nan if empty)
+    intersect_y (np.ndarray): y coordinate of the most seaward intersection (nan if empty)
+    dists (np.ndarray): cross distance of the most seaward intersection (nan if empty)
+    """
+    start_x = np.asarray(start_x, dtype=float)
+    start_y = np.asarray(start_y, dtype=float)
+    coords, pair_idx = shapely.get_coordinates(np.asarray(intersections), return_index=True)
+    point_dists = cross_distance(start_x[pair_idx], start_y[pair_idx], coords[:,0], coords[:,1])
+
+    # sort by pair then distance, the last entry of each pair is the farthest point
+    order = np.lexsort((point_dists, pair_idx))
+    sorted_idx = pair_idx[order]
+    is_last = np.ones(len(sorted_idx), dtype=bool)
+    is_last[:-1] = sorted_idx[1:] != sorted_idx[:-1]
+    keep = order[is_last]
+
+    intersect_x = np.full(len(start_x), np.nan)
+    intersect_y = np.full(len(start_x), np.nan)
+    dists = np.full(len(start_x), np.nan)
+    intersect_x[pair_idx[keep]] = coords[keep,0]
+    intersect_y[pair_idx[keep]] = coords[keep,1]
+    dists[pair_idx[keep]] = point_dists[keep]
+    return intersect_x, intersect_y, dists
+
+def load_transects(transects_path):
+    """
+    Loads transects, projects them to utm and records their start coordinates
+    inputs:
+    transects_path (str): path to file containing cross-shore transects
+    outputs:
+    transects_gdf (geopandas dataframe): transects in utm with x_start and y_start columns
+    """
+    transects_gdf = gpd.read_file(transects_path)
+    transects_gdf = wgs84_to_utm_df(transects_gdf)
+    transects_gdf = transects_gdf.reset_index(drop=True)
+    coords = transects_gdf.geometry.get_coordinates()
+    coords = coords[~coords.index.duplicated(keep='first')]
+    transects_gdf['x_start'] = coords['x']
+    transects_gdf['y_start'] = coords['y']
+    return transects_gdf
+
+def intersect_shorelines(shorelines_gdf, transects_gdf, transects_tree=None):
+    """
+    Computes the most seaward intersection of each shoreline with each transect it crosses
+    inputs:
+    shorelines_gdf (geopandas dataframe): shorelines in the same crs as transects_gdf
+    transects_gdf (geopandas dataframe): transects from load_transects
+    transects_tree (shapely.STRtree): optional prebuilt index over transects_gdf.geometry,
+                                      pass one in to reuse it across calls
+    outputs:
+    joined_df (pandas dataframe): one row per shoreline/transect intersection with columns
+                                  dates, satname, geoaccuracy, cloud_cover, transect_id,
+                                  intersect_x, intersect_y, cross_distance,
+                                  indexed by the label of the intersecting shoreline
+    """
+    if transects_tree is None:
+        transects_tree = shapely.STRtree(transects_gdf.geometry.values)
+    shoreline_geoms = np.asarray(shorelines_gdf.geometry.values)
+    shoreline_idx, transect_idx = transects_tree.query(shoreline_geoms, predicate='intersects')
+    order = np.lexsort((transect_idx, shoreline_idx))
+    shoreline_idx = shoreline_idx[order]
+    transect_idx = transect_idx[order]
+
+    # get points, keep highest cross distance point if multipoint (most seaward intersection)
+    intersections = shapely.intersection(shoreline_geoms[shoreline_idx],
+                                         np.asarray(transects_gdf.geometry.values)[transect_idx])
+    intersect_x, intersect_y, cross_dist = most_seaward_intersections(intersections,
+                                                                      transects_gdf['x_start'].values[transect_idx],
+                                                                      transects_gdf['y_start'].values[transect_idx])
+    ##clean up columns
+    shorelines_df = shorelines_gdf.rename(columns={'date':'dates'})
+    shoreline_columns = [col for col in ['dates','satname','geoaccuracy','cloud_cover'] if col in shorelines_df.columns]
+    joined_df = pd.DataFrame(shorelines_df[shoreline_columns].iloc[shoreline_idx])
+    joined_df['transect_id'] = transects_gdf['transect_id'].values[transect_idx]
+    joined_df['intersect_x'] = intersect_x
+    joined_df['intersect_y'] = intersect_y
+    joined_df['cross_distance'] = cross_dist
+    return joined_df
+
+def make_transect_tiles(transects_gdf, num_tiles):
+    """
+    Splits transects into contiguous alongshore tiles, ordering them along the
+    principal axis of their start points
+    inputs:
+    transects_gdf (geopandas dataframe): transects from load_transects
+    num_tiles (int): number of tiles to make
+    outputs:
+    tiles (list of geopandas dataframes): transects in each tile, in their original order
+    """
+    if num_tiles <= 1 or len(transects_gdf) < 2:
+        return [transects_gdf]
+    start_points = transects_gdf[['x_start','y_start']].values
+    centered = start_points - start_points.mean(axis=0)
+    eigvals, eigvecs = np.linalg.eigh(np.cov(centered.T))
+    alongshore = centered @ eigvecs[:,np.argmax(eigvals)]
+    tile_positions = np.array_split(np.argsort(alongshore, kind='stable'), num_tiles)
+    tiles = [transects_gdf.iloc[np.sort(positions)] for positions in tile_positions if len(positions) > 0]
+    return tiles
+
+def intersect_shorelines_parallel(shorelines_gdf, transects_gdf, tiles, executor):
+    """
+    Computes shoreline/transect intersections tile by tile on a process pool.
+    Each tile only receives the shorelines whose bounds overlap the tile's bounds.
+    inputs:
+    shorelines_gdf (geopandas dataframe): shorelines in the same crs as transects_gdf
+    transects_gdf (geopandas dataframe): transects from load_transects
+    tiles (list of geopandas dataframes): tiles from make_transect_tiles
+    executor (concurrent.futures.Executor): pool to run the tiles on
+    outputs:
+    joined_df (pandas dataframe): same rows, columns and order as intersect_shorelines
+    """
+    shoreline_bounds = shapely.bounds(np.asarray(shorelines_gdf.geometry.values))
+    futures = []
+    for tile_gdf in tiles:
+        minx, miny, maxx, maxy = tile_gdf.total_bounds
+        overlaps = ((shoreline_bounds[:,0] <= maxx) & (shoreline_bounds[:,2] >= minx) &
+                    (shoreline_bounds[:,1] <= maxy) & (shoreline_bounds[:,3] >= miny))
+        if overlaps.any():
+            futures.append(executor.submit(intersect_shorelines, shorelines_gdf[overlaps], tile_gdf))
+    if len(futures) == 0:
+        return intersect_shorelines(shorelines_gdf.iloc[0:0], transects_gdf)
+    joined_df = pd.concat([future.result() for future in futures])
+
+    # restore shoreline then transect order
+    transect_positions = pd.Series(np.arange(len(transects_gdf)), index=transects_gdf['transect_id'].values)
+    order = np.lexsort((transect_positions.loc[joined_df['transect_id'].values].values,
+                        shorelines_gdf.index.get_indexer(joined_df.index)))
+    return joined_df.iloc[order]
+
+def read_shoreline_chunks(shorelines_path, chunk_size, crs):
+    """
+    Reads a shorelines file in row-bounded chunks so the whole archive is never held in memory
+    inputs:
+    shorelines_path (str): path to file containing shorelines
+    chunk_size (int): number of shoreline features to read per chunk
+    crs: crs to project each chunk to
+    outputs:
+    generator of geopandas dataframes, each with at most chunk_size shorelines
+    """
+    start = 0
+    while True:
+        chunk = gpd.read_file(shorelines_path, rows=slice(start, start+chunk_size))
+        if len(chunk) == 0:
+            break
+        yield chunk.to_crs(crs)
+        start = start + chunk_size
+
+def drop_existing_dates(shorelines_gdf, existing_dates):
+    """
+    Removes shorelines whose date has already been processed
+    inputs:
+    shorelines_gdf (geopandas dataframe): shorelines with a date column
+    existing_dates (pd.DatetimeIndex): utc dates already present in the outputs
+    outputs:
+    shorelines_gdf (geopandas dataframe): shorelines with new dates only
+    """
+    dates = pd.to_datetime(shorelines_gdf['date'], utc=True)
+    return shorelines_gdf[~dates.isin(existing_dates).values]
+
+def combine_chunk_matrices(joined_mats, transect_ids):
+    """
+    Joins the dates x transects matrices of each chunk into one row per date,
+    so a date whose shorelines fall in more than one chunk gets a single row,
+    same as pivoting all of the intersections at once
+    inputs:
+    joined_mats (list of pandas dataframes): matrix of each chunk, dates as the index
+    transect_ids (pd.Index): every transect id, the columns of the output
+    outputs:
+    joined_mat (pandas dataframe): dates x transects matrix sorted by date
+    """
+    joined_mat = pd.concat(joined_mats).groupby(level=0).first()
+    joined_mat = joined_mat.reindex(columns=transect_ids)
+    joined_mat.columns.name = None
+    return joined_mat
+
+def update_transect_timeseries(shoreline_batches,
+                               compute,
+                               output_merged_path,
+                               output_mat_path):
+    """
+    Appends intersections for shorelines with dates not yet in the existing outputs.
+    The merged csv is copied to a temporary file, appended to and swapped in with os.replace,
+    the matrix is rewritten to a temporary file and swapped in first, so a crash
+    leaves either the old or the new version of each file, never a partial one.
+    inputs:
+    shoreline_batches (iterable of geopandas dataframes): shorelines in the transects' crs
+    compute (function): maps a shorelines geodataframe to its intersections dataframe
+    output_merged path (str): path to the existing merged csv file
+    output_mat_path (str): path to the existing matrix csv file
+    outputs:
+    num_new (int): number of new intersections appended
+    """
+    if is_parquet(output_merged_path) or is_parquet(output_mat_path):
+        return update_transect_timeseries_parquet(shoreline_batches, compute, output_merged_path, output_mat_path)
+    existing_merged = pd.read_csv(output_merged_path, usecols=['dates'])
+    existing_dates = pd.DatetimeIndex(pd.to_datetime(existing_merged['dates'], utc=True).unique())
+    merged_columns = pd.read_csv(output_merged_path, index_col=0, nrows=0).columns
+    num_rows = len(existing_merged)
+    num_new = 0
+
+    tmp_merged_path = output_merged_path + '.tmp'
+    shutil.copyfile(output_merged_path, tmp_merged_path)
+    new_mats = []
+    try:
+        for shorelines_gdf in shoreline_batches:
+            shorelines_gdf = drop_existing_dates(shorelines_gdf, existing_dates)
+            if len(shorelines_gdf) == 0:
+                continue
+            joined_df = compute(shorelines_gdf).reset_index(drop=True)
+            joined_df.index = joined_df.index + num_rows + num_new
+            num_new = num_new + len(joined_df)
+            joined_df.reindex(columns=merged_columns).to_csv(tmp_merged_path, mode='a', header=False)
+
+            joined_mat = joined_df.pivot(index='dates', columns='transect_id', values='cross_distance')
+            joined_mat.index = joined_mat.index.astype(str)
+            joined_mat.columns = joined_mat.columns.astype(str)
+            new_mats.append(joined_mat)
+
+        if num_new > 0:
+            ##rewrite the matrix, keeping the newest row if a date is already there
+            joined_mat = pd.concat([pd.read_csv(output_mat_path, index_col=0)] + new_mats)
+            joined_mat = joined_mat[~joined_mat.index.duplicated(keep='last')]
+            tmp_mat_path = output_mat_path + '.tmp'
+            joined_mat.to_csv(tmp_mat_path)
+            os.replace(tmp_mat_path, output_mat_path)
+            os.replace(tmp_merged_path, output_merged_path)
+    finally:
+        if os.path.exists(tmp_merged_path):
+            os.remove(tmp_merged_path)
+    return num_new
+
+def update_transect_timeseries_parquet(shoreline_batches,
+                                       compute,
+                                       output_merged_path,
+                                       output_mat_path):
+    """
+    Same as update_transect_timeseries for outputs saved as parquet,
+    the new rows are added to the existing tables and each file is rewritten and swapped in
+    inputs:
+    shoreline_batches (iterable of geopandas dataframes): shorelines in the transects' crs
+    compute (function): maps a shorelines geodataframe to its intersections dataframe
+    output_merged path (str): path to the existing merged file
+    output_mat_path (str): path to the existing matrix file
+    outputs:
+    num_new (int): number of new intersections appended
+    """
+    existing_dates = pd.DatetimeIndex(read_merged(output_merged_path, columns=['dates'])['dates'].unique())
+    new_dfs = []
+    for shorelines_gdf in shoreline_batches:
+        shorelines_gdf = drop_existing_dates(shorelines_gdf, existing_dates)
+        if len(shorelines_gdf) > 0:
+            new_dfs.append(compute(shorelines_gdf))
+    num_new = sum(len(joined_df) for joined_df in new_dfs)
+    if num_new == 0:
+        return num_new
+
+    joined_df = pd.concat(new_dfs).reset_index(drop=True)
+    joined_df['dates'] = pd.to_datetime(joined_df['dates'], utc=True)
+    joined_mat = joined_df.pivot(index='dates', columns='transect_id', values='cross_distance')
+    joined_mat.columns = joined_mat.columns.astype(str)
+
+    ##keep the newest row if a date is already in the matrix
+    existing_mat = read_matrix(output_mat_path).set_index('dates')
+    joined_mat = pd.concat([existing_mat, joined_mat])
+    joined_mat = joined_mat[~joined_mat.index.duplicated(keep='last')]
+    write_matrix(joined_mat, output_mat_path)
+    write_merged(pd.concat([read_merged(output_merged_path), joined_df]), output_merged_path)
+    return num_new
+
 def transect_timeseries(shorelines_path,
                         transects_path,
                         output_merged_path,
-                        output_mat_path):
+                        output_mat_path,
+                        chunk_size=None,
+                        workers=None,
+                        incremental=False):
     """
     Generates timeseries of shoreline cross-shore position
     given a geojson/shapefile containing shorelines and a
     geojson/shapefile containing cross-shore transects.
     Computes interesection points between shorelines
     and transects. Saves the merged transect timeseries.
-    
+
+    If chunk_size is given the shorelines are streamed from disk chunk_size features
+    at a time, each chunk is intersected against a transects STRtree built once,
+    and the results are appended to the merged csv, so peak memory is bounded by
+    chunk size and the size of the matrix rather than archive size. The matrix is
+    combined into one row per date, sorted by date like the unchunked matrix, and
+    written after the last chunk. In this mode the matrix has a column for every transect.
+
+    An empty shorelines file raises a ValueError instead of writing empty outputs.
+
+    If workers is greater than 1 the transects are split into that many alongshore
+    tiles and the intersections are computed on a process pool, each tile only
+    receiving the shorelines that overlap it.
+
+    If incremental is True and both outputs already exist, only shorelines with
+    dates not already in the merged csv are intersected, and their results are
+    appended to the existing outputs (see update_transect_timeseries).
+
+    Outputs ending in .parquet are saved as Parquet with typed dates (see timeseries_storage),
+    anything else is saved as csv.
+
     inputs:
     shoreline_path (str): path to file containing shorelines
     transect_path (str): path to file containing cross-shore transects
-    output_merged path (str): path to save the merged csv file 
-    output_mat_path (str): path to save the matrix csv file
+    output_merged path (str): path to save the merged csv or parquet file
+    output_mat_path (str): path to save the matrix csv or parquet file
+    chunk_size (int): optional, number of shorelines to process at a time
+    workers (int): optional, number of processes to compute intersections with
+    incremental (bool): only process shoreline dates missing from existing outputs
     """
     # load transects, project to utm, get start x and y coords
     print('Loading transects, computing start coordinates')
-    transects_gdf = gpd.read_file(transects_path)
-    transects_gdf = wgs84_to_utm_df(transects_gdf)
-    crs = transects_gdf.crs
-    transects_gdf = transects_gdf.reset_index(drop=True)
-    transects_gdf['geometry_saved'] = transects_gdf['geometry']
-    coords = transects_gdf['geometry_saved'].get_coordinates()
-    coords = coords[~coords.index.duplicated(keep='first')]
-    transects_gdf['x_start'] = coords['x']
-    transects_gdf['y_start'] = coords['y']
-    
-    # load shorelines, project to utm, smooth
-    shorelines_gdf = gpd.read_file(shorelines_path)
-    shorelines_gdf = wgs84_to_utm_df(shorelines_gdf)
-
-    print('computing intersections')
-    # spatial join shorelines to transects
-    joined_gdf = gpd.sjoin(shorelines_gdf, transects_gdf, predicate='intersects')
-    
-    # get points, keep highest cross distance point if multipoint (most seaward intersection)
-    joined_gdf['intersection_point'] = joined_gdf.geometry.intersection(joined_gdf['geometry_saved'])
-    for i in range(len(joined_gdf['intersection_point'])):
-        point = joined_gdf['intersection_point'].iloc[i]
-        start_x = joined_gdf['x_start'].iloc[i]
-        start_y = joined_gdf['y_start'].iloc[i]
-        if type(point) == shapely.MultiPoint:
-            points = [shapely.Point(coord) for coord in point.geoms]
-            points = gpd.GeoSeries(points, crs=crs)
-            coords = points.get_coordinates()
-            dists = [None]*len(coords)
-            for j in range(len(coords)):
-                dists[j] = cross_distance(start_x, start_y, coords['x'].iloc[j], coords['y'].iloc[j])
-            max_dist_idx = np.argmax(dists)
-            last_point = points[max_dist_idx]
-            joined_gdf['intersection_point'].iloc[i] = last_point
-    # get x's and y's for intersections
-    intersection_coords = joined_gdf['intersection_point'].get_coordinates()
-    joined_gdf['intersect_x'] = intersection_coords['x']
-    joined_gdf['intersect_y'] = intersection_coords['y']
-    
-    # get cross distance
-    joined_gdf['cross_distance'] = cross_distance(joined_gdf['x_start'], 
-                                                  joined_gdf['y_start'], 
-                                                  joined_gdf['intersect_x'], 
-                                                  joined_gdf['intersect_y'])
-    ##clean up columns
-    joined_gdf = joined_gdf.rename(columns={'date':'dates'})
-    keep_columns = ['dates','satname','geoaccuracy','cloud_cover','transect_id',
-                    'intersect_x','intersect_y','cross_distance']
-    joined_gdf = joined_gdf.rename(columns={'date':'dates'}).reset_index(drop=True)
-
-    for col in joined_gdf.columns:
-        if col not in keep_columns:
-            joined_gdf = joined_gdf.drop(columns=[col])
-
-    joined_df = joined_gdf.reset_index(drop=True)
-    
-    ##pivot to make the matrix
-    joined_mat = joined_df.pivot(index='dates', columns='transect_id', values='cross_distance')
-    joined_mat.columns.name = None
-    joined_mat.to_csv(output_mat_path)
-    
-    ##save file
-    joined_df.to_csv(output_merged_path)
-    print('intersections computed')
+    transects_gdf = load_transects(transects_path)
+    transects_tree = shapely.STRtree(transects_gdf.geometry.values)
+
+    executor = None
+    if workers is not None and workers > 1:
+        tiles = make_transect_tiles(transects_gdf, workers)
+        executor = ProcessPoolExecutor(max_workers=workers)
 
+    def compute(shorelines_gdf):
+        if executor is None:
+            return intersect_shorelines(shorelines_gdf, transects_gdf, transects_tree)
+        return intersect_shorelines_parallel(shorelines_gdf, transects_gdf, tiles, executor)
 
+    # load shorelines, project to utm
+    if chunk_size is None:
+        shoreline_batches = [gpd.read_file(shorelines_path).to_crs(transects_gdf.crs)]
+    else:
+        shoreline_batches = read_shoreline_chunks(shorelines_path, chunk_size, transects_gdf.crs)
+
+    try:
+        if incremental and os.path.exists(output_merged_path) and os.path.exists(output_mat_path):
+            print('computing intersections for new shoreline dates')
+            num_new = update_transect_timeseries(shoreline_batches, compute, output_merged_path, output_mat_path)
+            print('new intersections: '+str(num_new))
+        elif chunk_size is None:
+            if len(shoreline_batches[0]) == 0:
+                raise ValueError('no shorelines in ' + shorelines_path)
+            print('computing intersections')
+            joined_df = compute(shoreline_batches[0]).reset_index(drop=True)
+
+            ##pivot to make the matrix
+            joined_mat = joined_df.pivot(index='dates', columns='transect_id', values='cross_distance')
+            joined_mat.columns.name = None
+            write_matrix(joined_mat, output_mat_path)
+
+            ##save file
+            write_merged(joined_df, output_merged_path)
+        elif is_parquet(output_merged_path) or is_parquet(output_mat_path):
+            print('computing intersections in chunks of '+str(chunk_size)+' shorelines')
+            transect_ids = pd.Index(transects_gdf['transect_id']).sort_values()
+            joined_mats = []
+            with ParquetAppender(output_merged_path, kind='merged') as merged_writer:
+                for shorelines_gdf in shoreline_batches:
+                    joined_df = compute(shorelines_gdf).reset_index(drop=True)
+                    merged_writer.write(joined_df)
+                    joined_mats.append(joined_df.pivot(index='dates', columns='transect_id', values='cross_distance'))
+                if len(joined_mats) == 0:
+                    raise ValueError('no shorelines in ' + shorelines_path)
+            write_matrix(combine_chunk_matrices(joined_mats, transect_ids), output_mat_path)
+        else:
+            print('computing intersections in chunks of '+str(chunk_size)+' shorelines')
+            transect_ids = pd.Index(transects_gdf['transect_id']).sort_values()
+            num_rows = 0
+            joined_mats = []
+            for i, shorelines_gdf in enumerate(shoreline_batches):
+                joined_df = compute(shorelines_gdf).reset_index(drop=True)
+                joined_df.index = joined_df.index + num_rows
+                num_rows = num_rows + len(joined_df)
+
+                mode = 'w' if i == 0 else 'a'
+                joined_df.to_csv(output_merged_path, mode=mode, header=(i == 0))
+                joined_mats.append(joined_df.pivot(index='dates', columns='transect_id', values='cross_distance'))
+            if len(joined_mats) == 0:
+                raise ValueError('no shorelines in ' + shorelines_path)
+            write_matrix(combine_chunk_matrices(joined_mats, transect_ids), output_mat_path)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print('intersections computed')
@@ -24,6 +24,9 @@ import glob
 from scipy.signal import argrelextrema
 from kneed import KneeLocator
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from line_smoothing import smooth_geometries
 
 
 plt.rcParams["figure.figsize"] = (12,12)
@@ -56,50 +59,49 @@ def get_immediate_subdirectories(a_dir):
             if os.path.isdir(os.path.join(a_dir, name))]
 
 
-def make_profile_plot(csv_file, NO_DATA, res=2, clip_land=0, vertical_datum='WGS84 Ellipsoid'):
+def analyze_profile(distance, elevation, x_coords=None, y_coords=None, NO_DATA=None, res=2, clip_land=0, return_profile=False):
+    """
+    Finds the crest, inflection and toe points and the slopes of a single elevation profile
+    No files are read or written, so this can be run on any number of profiles
+    inputs:
+    distance (np.ndarray): cross-shore distance of each sample
+    elevation (np.ndarray): elevation of each sample
+    x_coords (np.ndarray): optional, x coordinate of each sample, points are nan without them
+    y_coords (np.ndarray): optional, y coordinate of each sample
+    NO_DATA (float): raster no data value, these samples are dropped
+    res (float): resolution the profile was sampled at in meters
+    clip_land (int): number of samples to offset the distances by
+    return_profile (bool): also return the smoothed profile for plotting
+    outputs:
+    output_dict (dict): max, mean and median slopes and tan(beta)s, coordinates of the
+                        inflection point, three crest points and toe point
+    profile (dict): only if return_profile, the smoothed profile x, z, diffs and the point indices
+    """
     smooth = int(10/res)
-    df = pd.read_csv(csv_file)
+    if x_coords is None:
+        x_coords = np.full(len(distance), np.nan)
+    if y_coords is None:
+        y_coords = np.full(len(distance), np.nan)
+    df = pd.DataFrame({'distance':distance,
+                       'elevation':elevation,
+                       'x':x_coords,
+                       'y':y_coords})
     filter_df = df[df['elevation']!=NO_DATA]
-    filter_df = filter_df.fillna(method='ffill').fillna(method='bfill')
+    filter_df = filter_df.ffill().bfill()
 
     ##Clip a bunch of land points since the transects started pretty far inland
     #filter_df = filter_df.iloc[clip_land:].reset_index()
 
-    ##Clip sea removes offshore points that were heavilly interpolated
-    ##The profiles reach a minimum value and then flatten out
-    try:
-        clip_sea = len(filter_df)
-    except:
-        print('no elevation values along transect')
-        max_slope = np.nan
-        max_tan_beta = np.nan
-        avg_slope = np.nan
-        avg_tan_beta = np.nan
-        median_slope = np.nan
-        median_tan_beta = np.nan
-        ip_x = np.nan
-        ip_y = np.nan
-        crest_x = np.nan
-        crest_y = np.nan
-        crest2_x = np.nan
-        crest2_y = np.nan
-        crest3_x = np.nan
-        crest3_y = np.nan
-        toe_x = np.nan
-        toe_y = np.nan
-
-        return slope, tan_beta, ip_x, ip_y, crest_x, crest_y, toe_x, toe_y
-    
-    filter_df = filter_df.iloc[:clip_sea].reset_index()
+    filter_df = filter_df.reset_index()
 
     ##Getting distances and elevations and instantaneous differences
     ##Smooth out to remove some of the noise so the algorithm works 
     x = filter_df['distance']-(clip_land*res)
     z = filter_df['elevation'].rolling(window=smooth).mean()
-    z = z.fillna(method='ffill').fillna(method='bfill')
+    z = z.ffill().bfill()
     diffs = z.diff()/res
     diffs = diffs.rolling(window=smooth).mean()
-    diffs = diffs.fillna(method='ffill').fillna(method='bfill')
+    diffs = diffs.ffill().bfill()
 
     ##Get crest point
     ##also get the coordinates of this point
@@ -197,14 +199,68 @@ def make_profile_plot(csv_file, NO_DATA, res=2, clip_land=0, vertical_datum='WGS
         median_slope = np.nan
         median_tan_beta = np.nan
 
+    output_dict = {'max_slope':max_slope,
+                   'max_tan_beta':max_tan_beta,
+                   'avg_slope':avg_slope,
+                   'avg_tan_beta':avg_tan_beta,
+                   'median_slope':median_slope,
+                   'median_tan_beta':median_tan_beta,
+                   'ip_x':ip_x,
+                   'ip_y':ip_y,
+                   'crest_x':crest_x,
+                   'crest_y':crest_y,
+                   'crest2_x':crest2_x,
+                   'crest2_y':crest2_y,
+                   'crest3_x':crest3_x,
+                   'crest3_y':crest3_y,
+                   'toe_x':toe_x,
+                   'toe_y':toe_y
+                   }
+
+    profile = {'x':x,
+               'z':z,
+               'diffs':diffs,
+               'inflection_point':inflection_point,
+               'crest':crest,
+               'crest2':crest2,
+               'crest3':crest3,
+               'toe':toe
+               }
+    if return_profile:
+        return output_dict, profile
+    return output_dict
+
+def plot_profile(profile, output_dict, save_path, vertical_datum='WGS84 Ellipsoid'):
+    """
+    Plots an analyzed elevation profile with its extracted points and slopes
+    inputs:
+    profile (dict): smoothed profile from analyze_profile(..., return_profile=True)
+    output_dict (dict): slopes and points from analyze_profile
+    save_path (str): path to save the png to
+    vertical_datum (str): string for plotting defining the vertical datum
+    """
+    x = profile['x']
+    z = profile['z']
+    diffs = profile['diffs']
+    inflection_point = profile['inflection_point']
+    crest = profile['crest']
+    crest2 = profile['crest2']
+    crest3 = profile['crest3']
+    toe = profile['toe']
+    max_slope = output_dict['max_slope']
+    max_tan_beta = output_dict['max_tan_beta']
+    avg_slope = output_dict['avg_slope']
+    avg_tan_beta = output_dict['avg_tan_beta']
+    median_slope = output_dict['median_slope']
+    median_tan_beta = output_dict['median_tan_beta']
 
     ##plotting everything (profile, points extracted on profile, computed slope)
     lab = ('Elevation Profile')
-    
+
     plt.subplot(2,1,1)
     plt.plot(x, z, label=lab, color='k')
     plt.fill_between(x, z, -100, color='tan')
-    
+
     # these are matplotlib.patch.Patch properties
     props = dict(boxstyle='round', facecolor='blue', alpha=0.1)
 
@@ -235,7 +291,7 @@ def make_profile_plot(csv_file, NO_DATA, res=2, clip_land=0, vertical_datum='WGS
         plt.scatter(x.iloc[toe], z.iloc[toe], label = 'Toe', color='red')
     except:
         pass
-    
+
     plt.xlabel('Cross-Shore Distance (m)')
     plt.ylabel('Elevation\n(m, '+ vertical_datum + ')')
     try:
@@ -264,30 +320,230 @@ def make_profile_plot(csv_file, NO_DATA, res=2, clip_land=0, vertical_datum='WGS
     plt.ylabel('Slope')
     plt.legend(loc='best')
     plt.tight_layout()
-    plt.savefig(os.path.splitext(csv_file)[0]+'_profile.png', dpi=300)
+    plt.savefig(save_path, dpi=300)
     plt.close()
 
-    output_dict = {'max_slope':max_slope,
-                   'max_tan_beta':max_tan_beta,
-                   'avg_slope':avg_slope,
-                   'avg_tan_beta':avg_tan_beta,
-                   'median_slope':median_slope,
-                   'median_tan_beta':median_tan_beta,
-                   'ip_x':ip_x,
-                   'ip_y':ip_y,
-                   'crest_x':crest_x,
-                   'crest_y':crest_y,
-                   'crest2_x':crest2_x,
-                   'crest2_y':crest2_y,
-                   'crest3_x':crest3_x,
-                   'crest3_y':crest3_y,
-                   'toe_x':toe_x,
-                   'toe_y':toe_y
-                   }
-
+def make_profile_plot(csv_file, NO_DATA, res=2, clip_land=0, vertical_datum='WGS84 Ellipsoid', profile_df=None, plot=True):
+    """
+    Analyzes an elevation profile and optionally saves a figure of it next to the csv
+    inputs:
+    csv_file (str): path to the profile csv (distance, elevation, x, y), figure is saved as csv_file with _profile.png
+    NO_DATA (float): raster no data value
+    res (float): resolution the profile was sampled at in meters
+    clip_land (int): number of samples to offset the distances by
+    vertical_datum (str): string for plotting defining the vertical datum
+    profile_df (pandas DataFrame): optional, the profile already in memory, csv_file is not read if given
+    plot (bool): save the figure or not
+    outputs:
+    output_dict (dict): slopes and points from analyze_profile
+    """
+    if profile_df is None:
+        profile_df = pd.read_csv(csv_file)
+    output_dict, profile = analyze_profile(profile_df['distance'].values,
+                                           profile_df['elevation'].values,
+                                           x_coords=profile_df['x'].values,
+                                           y_coords=profile_df['y'].values,
+                                           NO_DATA=NO_DATA,
+                                           res=res,
+                                           clip_land=clip_land,
+                                           return_profile=True)
+    if plot:
+        plot_profile(profile, output_dict, os.path.splitext(csv_file)[0]+'_profile.png', vertical_datum=vertical_datum)
     return output_dict
 
 
+def resample_profiles(distances, elevations, x_coords, y_coords, res, NO_DATA=None):
+    """
+    Resamples many elevation profiles onto one distance grid and stacks them
+    no data samples are dropped and the gaps they leave are linearly interpolated
+    inputs:
+    distances (list of np.ndarray): cross-shore distance of each sample, one array per profile
+    elevations (list of np.ndarray): elevation of each sample
+    x_coords (list of np.ndarray): x coordinate of each sample
+    y_coords (list of np.ndarray): y coordinate of each sample
+    res (float): grid spacing in meters
+    NO_DATA (float): raster no data value
+    outputs:
+    grid (np.ndarray): distances of the grid, shape (samples,)
+    z (np.ndarray): elevations, shape (transects, samples), nan outside each profile
+    x (np.ndarray): x coordinates, shape (transects, samples)
+    y (np.ndarray): y coordinates, shape (transects, samples)
+    """
+    max_distance = max([np.max(distance) for distance in distances if len(distance) > 0], default=0)
+    grid = np.arange(int(max_distance/res) + 1)*res
+    z = np.full((len(distances), len(grid)), np.nan)
+    x = np.full_like(z, np.nan)
+    y = np.full_like(z, np.nan)
+    for i in range(len(distances)):
+        distance = np.asarray(distances[i], dtype=float)
+        elevation = np.asarray(elevations[i], dtype=float)
+        valid = (elevation != NO_DATA) & ~np.isnan(elevation)
+        if not valid.any():
+            continue
+        in_profile = (grid >= distance[valid][0]) & (grid <= distance[valid][-1])
+        z[i, in_profile] = np.interp(grid[in_profile], distance[valid], elevation[valid])
+        x[i, in_profile] = np.interp(grid[in_profile], distance, x_coords[i])
+        y[i, in_profile] = np.interp(grid[in_profile], distance, y_coords[i])
+    return grid, z, x, y
+
+def _fill_rows(arr, in_profile):
+    """
+    Forward then backward fills nans along each row, only within each profile
+    """
+    rows = np.arange(arr.shape[0])[:,None]
+    cols = np.arange(arr.shape[1])
+    idx = np.where(np.isnan(arr), 0, cols)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    arr = arr[rows, idx]
+    idx = np.where(np.isnan(arr), arr.shape[1]-1, cols)
+    idx = np.minimum.accumulate(idx[:,::-1], axis=1)[:,::-1]
+    arr = arr[rows, idx]
+    arr[~in_profile] = np.nan
+    return arr
+
+def _rolling_mean_rows(arr, window):
+    """
+    Trailing rolling mean along each row, nan unless the whole window is valid,
+    run on all rows at once with the same pandas rolling().mean() as analyze_profile
+    """
+    return pd.DataFrame(arr.T).rolling(window=window).mean().values.T
+
+def _knee(z_search, curve):
+    """
+    Kneedle point of a decreasing profile section, nan if there isn't one
+    """
+    try:
+        knee = KneeLocator(list(range(len(z_search))),
+                           list(z_search),
+                           online=True,
+                           curve=curve,
+                           direction='decreasing',
+                           interp_method='polynomial'
+                           ).knee
+    except:
+        knee = None
+    if knee is None:
+        return np.nan
+    return knee
+
+def analyze_profile_matrix(z, x_coords, y_coords, res=2):
+    """
+    Vectorized version of analyze_profile for a stack of profiles on a common grid
+    The smoothing, gradients, crest, inflection point and slopes are computed for all
+    profiles at once, only the Kneedle crest3 and toe points are found profile by profile
+    inputs:
+    z (np.ndarray): elevations, shape (transects, samples), nan outside each profile
+    x_coords (np.ndarray): x coordinates, shape (transects, samples)
+    y_coords (np.ndarray): y coordinates, shape (transects, samples)
+    res (float): grid spacing in meters
+    outputs:
+    slopes_df (pandas DataFrame): one row per profile with the same columns as analyze_profile's output_dict
+    """
+    smooth = int(10/res)
+    num_profiles, num_samples = z.shape
+    rows = np.arange(num_profiles)
+    in_profile = ~np.isnan(z)
+    end = num_samples - np.argmax(in_profile[:,::-1], axis=1)
+
+    ##Smooth out to remove some of the noise so the algorithm works
+    z = _fill_rows(_rolling_mean_rows(z, smooth), in_profile)
+    diffs = np.full_like(z, np.nan)
+    diffs[:,1:] = np.diff(z, axis=1)/res
+    diffs = _fill_rows(_rolling_mean_rows(diffs, smooth), in_profile)
+    ok = in_profile.any(axis=1) & ~np.isnan(diffs).all(axis=1)
+
+    ##crest points and inflection point, maximum negative slope after the crest
+    cols = np.arange(num_samples)
+    crest = np.argmax(np.where(in_profile, z-diffs, -np.inf), axis=1)
+    crest2 = np.argmax(np.where(in_profile, z, -np.inf), axis=1)
+    after_crest = in_profile & (cols >= crest[:,None])
+    inflection_point = np.argmin(np.where(after_crest, diffs, np.inf), axis=1)
+
+    ##Kneedle crest3 and toe, only look for the toe after the crest
+    crest3 = np.full(num_profiles, np.nan)
+    toe = np.full(num_profiles, np.nan)
+    for i in np.flatnonzero(ok):
+        crest3[i] = _knee(z[i, crest2[i]:end[i]], 'concave') + crest2[i]
+        toe[i] = _knee(z[i, crest[i]:end[i]], 'convex') + crest[i]
+    ok = ok & ~np.isnan(crest3)
+    ##if the toe is at the crest or before the inflection point, make it the last value in the profile
+    toe_reset = ok & ((toe == crest) | (toe < inflection_point))
+    toe[toe_reset] = end[toe_reset] - 1
+    toe[~ok] = np.nan
+
+    def coords_at(idx):
+        has_idx = ~np.isnan(idx)
+        safe = np.where(has_idx, idx, 0).astype(int)
+        return (np.where(has_idx, x_coords[rows, safe], np.nan),
+                np.where(has_idx, y_coords[rows, safe], np.nan))
+    crest = np.where(ok, crest, np.nan)
+    crest2 = np.where(ok, crest2, np.nan)
+    inflection_point = np.where(ok, inflection_point, np.nan)
+    ip_x, ip_y = coords_at(inflection_point)
+    crest_x, crest_y = coords_at(crest)
+    crest2_x, crest2_y = coords_at(crest2)
+    crest3_x, crest3_y = coords_at(crest3)
+    toe_x, toe_y = coords_at(toe)
+
+    ##points at or past the toe are dropped, a reset toe drops all the crests
+    has_toe = ~np.isnan(toe)
+    for points in [crest, crest2, crest3]:
+        points[toe_reset | (has_toe & (points >= toe))] = np.nan
+
+    ##slopes between the outermost points
+    has_slope = ~np.isnan(crest) & ~np.isnan(inflection_point)
+    points = np.stack([crest, crest2, crest3, inflection_point, toe], axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        min_points = np.nanmin(points, axis=1)
+        max_points = np.nanmax(points, axis=1)
+        between = (cols >= min_points[:,None]) & (cols < max_points[:,None])
+        diffs_slope = np.where(between, diffs, np.nan)
+        max_slope = np.abs(diffs[rows, np.where(has_slope, inflection_point, 0).astype(int)])
+        avg_slope = np.abs(np.nanmean(diffs_slope, axis=1))
+        median_slope = np.abs(np.nanmedian(diffs_slope, axis=1))
+    max_slope[~has_slope] = np.nan
+    avg_slope[~has_slope] = np.nan
+    median_slope[~has_slope] = np.nan
+
+    slopes_df = pd.DataFrame({'max_slope':max_slope,
+                              'max_tan_beta':np.tan(max_slope),
+                              'avg_slope':avg_slope,
+                              'avg_tan_beta':np.tan(avg_slope),
+                              'median_slope':median_slope,
+                              'median_tan_beta':np.tan(median_slope),
+                              'ip_x':ip_x,
+                              'ip_y':ip_y,
+                              'crest_x':crest_x,
+                              'crest_y':crest_y,
+                              'crest2_x':crest2_x,
+                              'crest2_y':crest2_y,
+                              'crest3_x':crest3_x,
+                              'crest3_y':crest3_y,
+                              'toe_x':toe_x,
+                              'toe_y':toe_y
+                              })
+    return slopes_df
+
+def analyze_profiles(distances, elevations, x_coords, y_coords, NO_DATA=None, res=2):
+    """
+    Batched analyze_profile, resamples all profiles to a common distance grid
+    and analyzes them as one (transects x samples) matrix
+    Results are the same as analyze_profile for profiles sampled every res meters without no data gaps,
+    no data samples inside a profile are linearly interpolated here where analyze_profile drops them
+    inputs:
+    distances (list of np.ndarray): cross-shore distance of each sample, one array per profile
+    elevations (list of np.ndarray): elevation of each sample
+    x_coords (list of np.ndarray): x coordinate of each sample
+    y_coords (list of np.ndarray): y coordinate of each sample
+    NO_DATA (float): raster no data value
+    res (float): resolution to resample at in meters
+    outputs:
+    slopes_df (pandas DataFrame): one row per profile with the same columns as analyze_profile's output_dict
+    """
+    grid, z, x, y = resample_profiles(distances, elevations, x_coords, y_coords, res, NO_DATA=NO_DATA)
+    return analyze_profile_matrix(z, x, y, res=res)
+
 def get_elevation(x_coord, y_coord, raster, bands, gt, NO_DATA):
     """
     get the elevation value of each pixel under
@@ -319,6 +575,179 @@ def get_elevation(x_coord, y_coord, raster, bands, gt, NO_DATA):
     return elevation
 
 
+def profile_points(shapely_line, res):
+    """
+    Generates all of the sample points along a profile line in one call
+    inputs:
+    shapely_line (shapely LineString): profile line
+    res (float): spacing between samples in meters
+    outputs:
+    distance (np.ndarray): distance of each sample along the line
+    x (np.ndarray): x coordinate of each sample
+    y (np.ndarray): y coordinate of each sample
+    """
+    distance = np.arange(0, int(shapely_line.length), res)
+    points = shapely.line_interpolate_point(shapely_line, distance)
+    coords = shapely.get_coordinates(points)
+    return distance, coords[:,0], coords[:,1]
+
+def get_elevations(x_coords, y_coords, raster, gt, NO_DATA, band_number=1, max_window_pixels=2**24):
+    """
+    get the elevation values of the pixels under many
+    locations x, y by reading the bounding window of the points once
+    and gathering the pixel values with numpy indexing
+    long diagonal lines are split into consecutive runs of points
+    so no single window is larger than max_window_pixels
+    inputs:
+    x_coords (np.ndarray): x coordinates
+    y_coords (np.ndarray): y coordinates
+    raster: gdal raster open object
+    gt: raster limits
+    NO_DATA (float): value given to points off the raster
+    band_number (int): band to sample
+    max_window_pixels (int): largest window to read at once
+
+    returns:
+    elevations (np.ndarray): value of raster at each point x,y
+    """
+    band = raster.GetRasterBand(band_number)
+    px = np.trunc((np.asarray(x_coords) - gt[0]) / gt[1]).astype(int)
+    py = np.trunc((np.asarray(y_coords) - gt[3]) / gt[5]).astype(int)
+    elevations = np.full(len(px), NO_DATA, dtype=float)
+    on_raster = (px >= 0) & (px < raster.RasterXSize) & (py >= 0) & (py < raster.RasterYSize)
+    idx = np.flatnonzero(on_raster)
+    if len(idx) == 0:
+        return elevations
+    window_pixels = (np.ptp(px[idx]) + 1) * (np.ptp(py[idx]) + 1)
+    num_runs = min(len(idx), int(np.ceil(np.sqrt(window_pixels / max_window_pixels))))
+    for run in np.array_split(idx, max(num_runs, 1)):
+        xoff, yoff = px[run].min(), py[run].min()
+        window = band.ReadAsArray(int(xoff), int(yoff),
+                                  int(px[run].max() - xoff + 1), int(py[run].max() - yoff + 1))
+        elevations[run] = window[py[run] - yoff, px[run] - xoff]
+    return elevations
+
+class TiledRasterSampler:
+    """
+    Samples a raster, or a vrt mosaic of many tiles, at many points by reading each
+    underlying tile's native blocks at most once and keeping them in an LRU cache
+    Points are snapped to pixels of the whole raster the same way get_elevations does,
+    then each pixel centre is looked up in the tiles, so tiled and untiled sampling agree.
+    Tiles cover [left, right) and (bottom, top], a point on the edge of one tile is answered by its neighbour.
+    Where vrt tiles overlap the last tile in the vrt with a valid (not nodata) value wins, same as gdal
+    """
+
+    def __init__(self, in_raster, band_number=1, cache_mb=256):
+        """
+        inputs:
+        in_raster (str): path to raster dem or vrt
+        band_number (int): band to sample
+        cache_mb (float): memory budget for cached blocks in megabytes
+        """
+        raster = gdal.Open(in_raster, gdalconst.GA_ReadOnly)
+        if raster is None:
+            raise IOError('Could not open image ' + in_raster)
+        if raster.GetDriver().ShortName == 'VRT':
+            tile_paths = raster.GetFileList()[1:]
+        else:
+            tile_paths = [in_raster]
+        self.transform = raster.GetGeoTransform()
+        self.raster_size = (raster.RasterXSize, raster.RasterYSize)
+        self.band_number = band_number
+        self.cache_bytes = cache_mb*2**20
+        self.cached_bytes = 0
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.tiles = [gdal.Open(tile_path, gdalconst.GA_ReadOnly) for tile_path in tile_paths]
+        self.transforms = [tile.GetGeoTransform() for tile in self.tiles]
+        self.block_sizes = [tile.GetRasterBand(band_number).GetBlockSize() for tile in self.tiles]
+        self.nodata_values = [tile.GetRasterBand(band_number).GetNoDataValue() for tile in self.tiles]
+        tile_bounds = []
+        for tile, gt in zip(self.tiles, self.transforms):
+            xs = [gt[0], gt[0] + tile.RasterXSize*gt[1]]
+            ys = [gt[3], gt[3] + tile.RasterYSize*gt[5]]
+            tile_bounds.append([min(xs), min(ys), max(xs), max(ys)])
+        self.tile_tree = shapely.STRtree(shapely.box(*np.array(tile_bounds).T))
+
+    def get_block(self, tile_idx, block_x, block_y):
+        """
+        Returns one native block of a tile, from the cache if it has already been read
+        """
+        key = (tile_idx, block_x, block_y)
+        if key in self.cache:
+            self.hits = self.hits + 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses = self.misses + 1
+        tile = self.tiles[tile_idx]
+        block_width, block_height = self.block_sizes[tile_idx]
+        xoff = block_x*block_width
+        yoff = block_y*block_height
+        block = tile.GetRasterBand(self.band_number).ReadAsArray(xoff, yoff,
+                                                                 min(block_width, tile.RasterXSize - xoff),
+                                                                 min(block_height, tile.RasterYSize - yoff))
+        self.cache[key] = block
+        self.cached_bytes = self.cached_bytes + block.nbytes
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            old_key, old_block = self.cache.popitem(last=False)
+            self.cached_bytes = self.cached_bytes - old_block.nbytes
+        return block
+
+    def sample(self, x_coords, y_coords, NO_DATA):
+        """
+        Gets the raster value under each point, points are grouped by tile and block
+        so every block they touch is read once
+        inputs:
+        x_coords (np.ndarray): x coordinates
+        y_coords (np.ndarray): y coordinates
+        NO_DATA (float): value given to points off the raster
+        outputs:
+        elevations (np.ndarray): value of raster at each point x,y
+        """
+        elevations = np.full(len(x_coords), NO_DATA, dtype=float)
+        ##same pixel as get_elevations on the whole raster, then its centre is found in the tiles
+        gt = self.transform
+        px = np.trunc((np.asarray(x_coords, dtype=float) - gt[0]) / gt[1]).astype(int)
+        py = np.trunc((np.asarray(y_coords, dtype=float) - gt[3]) / gt[5]).astype(int)
+        on_raster = np.flatnonzero((px >= 0) & (px < self.raster_size[0]) & (py >= 0) & (py < self.raster_size[1]))
+        if len(on_raster) == 0:
+            return elevations
+        centre_x = gt[0] + (px[on_raster] + 0.5)*gt[1]
+        centre_y = gt[3] + (py[on_raster] + 0.5)*gt[5]
+        point_idx, tile_idx = self.tile_tree.query(shapely.points(centre_x, centre_y), predicate='intersects')
+        ##a value is only replaced by a later tile's valid value, like the vrt
+        sampled = np.zeros(len(x_coords), dtype=bool)
+        for tile in np.unique(tile_idx):
+            in_tile = point_idx[tile_idx == tile]
+            idx = on_raster[in_tile]
+            tile_gt = self.transforms[tile]
+            tile_px = np.floor((centre_x[in_tile] - tile_gt[0]) / tile_gt[1]).astype(int)
+            tile_py = np.floor((centre_y[in_tile] - tile_gt[3]) / tile_gt[5]).astype(int)
+            on_tile = ((tile_px >= 0) & (tile_px < self.tiles[tile].RasterXSize) &
+                       (tile_py >= 0) & (tile_py < self.tiles[tile].RasterYSize))
+            idx, tile_px, tile_py = idx[on_tile], tile_px[on_tile], tile_py[on_tile]
+            if len(idx) == 0:
+                continue
+            values = np.empty(len(idx), dtype=float)
+            block_width, block_height = self.block_sizes[tile]
+            block_keys, block_inverse = np.unique(np.stack([tile_px//block_width, tile_py//block_height], axis=1),
+                                                  axis=0, return_inverse=True)
+            block_inverse = block_inverse.ravel()
+            for k in range(len(block_keys)):
+                in_block = block_inverse == k
+                block_x, block_y = block_keys[k]
+                block = self.get_block(tile, block_x, block_y)
+                values[in_block] = block[tile_py[in_block] - block_y*block_height,
+                                         tile_px[in_block] - block_x*block_width]
+            valid = ~np.isnan(values)
+            if self.nodata_values[tile] is not None:
+                valid = valid & (values != self.nodata_values[tile])
+            write = valid | ~sampled[idx]
+            elevations[idx[write]] = values[write]
+            sampled[idx] = True
+        return elevations
+
 def write_to_csv(csv_out,result_profile_x_z):
     # check if output file exists on disk if yes delete it
     if os.path.isfile(csv_out):
@@ -333,7 +762,7 @@ def write_to_csv(csv_out,result_profile_x_z):
             outfile.write(str(round(dist, 2)) + ',' + str(round(z, 2)) + ',' + str(x) + ',' + str(y) + '\n')
            
 
-def main(in_raster, in_line, csv_file, res, NO_DATA, batch=False, vertical_datum = 'WGS84 Ellipsoid'):
+def main(in_raster, in_line, csv_file, res, NO_DATA, batch=False, vertical_datum = 'WGS84 Ellipsoid', make_outputs=True):
     """
     Extracts elevation profile given an input raster dem and an input shapefile line
     inputs:
@@ -343,6 +772,7 @@ def main(in_raster, in_line, csv_file, res, NO_DATA, batch=False, vertical_datum
     res: resolution to sample at in meters
     N0_DATA: raster no data value
     batch (optional): this should stay as False if just one profile is taken, use batch_main function for multiple profiles
+    make_outputs (optional): write the profile csv and figure or only return the slopes
     """
     # open the image
     ds = gdal.Open(in_raster, gdalconst.GA_ReadOnly)
@@ -371,30 +801,124 @@ def main(in_raster, in_line, csv_file, res, NO_DATA, batch=False, vertical_datum
         shapely_line = LineString(wkt.loads(line_geom))
         # length in meters of profile line
         length_m = shapely_line.length
-    # lists of coords and elevations
-    x = []
-    y = []
-    z = []
-    # distance of the topographic profile
-    distance = []
-    for currentdistance in range(0, int(length_m), res):
-        # creation of the point on the line
-        point = shapely_line.interpolate(currentdistance)
-        xp, yp = point.x, point.y
-        x.append(xp)
-        y.append(yp)
-        # extraction of the elevation value from the MNT
-        z.append(get_elevation(xp, yp, ds, bands, transform, NO_DATA)[0])
-        distance.append(currentdistance)  
-   
-    # combine distance and elevation vales as pairs
-    profile_x_z = zip(distance,z, x, y)
+    # all of the points on the line and their elevations from the MNT
+    distance, x, y = profile_points(shapely_line, res)
+    z = get_elevations(x, y, ds, transform, NO_DATA)
    
-    # output final csv data
-    write_to_csv(csv_file, profile_x_z)
-    output_dict = make_profile_plot(csv_file, NO_DATA, res=res, vertical_datum=vertical_datum)
+    if make_outputs:
+        # combine distance and elevation vales as pairs
+        profile_x_z = zip(distance,z, x, y)
+       
+        # output final csv data
+        write_to_csv(csv_file, profile_x_z)
+    ##same rounding as the csv so results match profiles read back from disk
+    output_dict, profile = analyze_profile(np.round(distance, 2), np.round(z, 2), x_coords=x, y_coords=y,
+                                           NO_DATA=NO_DATA, res=res, return_profile=True)
+    if make_outputs:
+        plot_profile(profile, output_dict, os.path.splitext(csv_file)[0]+'_profile.png', vertical_datum=vertical_datum)
     return output_dict
 
+_worker_sampler = None
+
+def init_profile_worker(in_raster, cache_mb=256):
+    """
+    Opens the raster dem (and its tiles if it is a vrt) once for the life of a worker process
+    inputs:
+    in_raster (str): path to raster dem
+    cache_mb (float): memory budget for this worker's block cache in megabytes
+    """
+    global _worker_sampler
+    _worker_sampler = TiledRasterSampler(in_raster, cache_mb=cache_mb)
+
+def profile_transect(line_wkb, csv_path, res, NO_DATA, vertical_datum='WGS84 Ellipsoid', make_outputs=True):
+    """
+    Extracts one elevation profile with the worker's raster sampler
+    and computes its slopes without re-reading the profile from disk
+    inputs:
+    line_wkb (bytes): profile line as well-known binary
+    csv_path (str): path to save the profile csv to, the figure is saved next to it
+    res (float): resolution to sample at in meters
+    NO_DATA (float): raster no data value
+    vertical_datum (str): string for plotting defining the vertical datum
+    make_outputs (bool): write the profile csv and figure or not
+    outputs:
+    output_dict (dict): slopes and crest, inflection and toe points from analyze_profile
+    """
+    shapely_line = shapely.from_wkb(line_wkb)
+    distance, x, y = profile_points(shapely_line, res)
+    z = _worker_sampler.sample(x, y, NO_DATA)
+    if make_outputs:
+        write_to_csv(csv_path, zip(distance, z, x, y))
+    ##same rounding as the csv so results match profiles read back from disk
+    output_dict, profile = analyze_profile(np.round(distance, 2), np.round(z, 2), x_coords=x, y_coords=y,
+                                           NO_DATA=NO_DATA, res=res, return_profile=True)
+    if make_outputs:
+        plot_profile(profile, output_dict, os.path.splitext(csv_path)[0]+'_profile.png', vertical_datum=vertical_datum)
+    return output_dict
+
+def batch_profiles(in_raster, lines, transect_ids, out_folder, res, NO_DATA,
+                   vertical_datum='WGS84 Ellipsoid', workers=None, make_outputs=True, batched=False, cache_mb=256):
+    """
+    Takes elevation profiles and slopes for many lines, optionally on a process pool
+    where every worker keeps its own TiledRasterSampler on the raster dem
+    inputs:
+    in_raster (str): path to raster dem
+    lines (GeoSeries): profile lines in the raster's crs
+    transect_ids (list): id for each line, used to name the csvs and figures
+    out_folder (str): path to folder to save csvs and png figures to
+    res (float): resolution to sample at in meters
+    NO_DATA (float): raster no data value
+    vertical_datum (str): string for plotting defining the vertical datum
+    workers (int): optional, number of processes to profile with, runs in this process if None or 1
+    make_outputs (bool): write the profile csvs and figures or not
+    batched (bool): sample every profile in this process and analyze them all at once with analyze_profiles,
+                    only the profile csvs are written in this mode
+    cache_mb (float): block cache budget in megabytes, per worker
+    outputs:
+    df (pandas DataFrame): one row of slopes and points per transect, same columns as the _slopes.csv
+    """
+    num_lines = len(transect_ids)
+    if batched:
+        init_profile_worker(in_raster, cache_mb=cache_mb)
+        distances, elevations, x_coords, y_coords = [], [], [], []
+        for line, transect_id in zip(lines, transect_ids):
+            distance, x, y = profile_points(line, res)
+            z = _worker_sampler.sample(x, y, NO_DATA)
+            if make_outputs:
+                write_to_csv(os.path.join(out_folder, transect_id + '.csv'), zip(distance, z, x, y))
+            distances.append(np.round(distance, 2))
+            elevations.append(np.round(z, 2))
+            x_coords.append(x)
+            y_coords.append(y)
+        df = analyze_profiles(distances, elevations, x_coords, y_coords, NO_DATA=NO_DATA, res=res)
+        df = df.rename(columns={'ip_x':'inflection_x', 'ip_y':'inflection_y'})
+        df.insert(0, 'transect_id', list(transect_ids))
+        return df
+
+    jobs = (shapely.to_wkb(np.asarray(lines)),
+            [os.path.join(out_folder, transect_id + '.csv') for transect_id in transect_ids],
+            [res]*num_lines,
+            [NO_DATA]*num_lines,
+            [vertical_datum]*num_lines,
+            [make_outputs]*num_lines)
+    if workers is not None and workers > 1 and num_lines > 0:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_profile_worker,
+                                 initargs=(in_raster, cache_mb)) as executor:
+            output_dicts = list(executor.map(profile_transect, *jobs,
+                                             chunksize=max(1, num_lines//(4*workers))))
+    else:
+        init_profile_worker(in_raster, cache_mb=cache_mb)
+        output_dicts = list(map(profile_transect, *jobs))
+
+    df = pd.DataFrame(output_dicts, columns=['max_slope', 'max_tan_beta', 'avg_slope', 'avg_tan_beta',
+                                             'median_slope', 'median_tan_beta', 'ip_x', 'ip_y',
+                                             'crest_x', 'crest_y', 'crest2_x', 'crest2_y',
+                                             'crest3_x', 'crest3_y', 'toe_x', 'toe_y'])
+    df = df.rename(columns={'ip_x':'inflection_x', 'ip_y':'inflection_y'})
+    df.insert(0, 'transect_id', list(transect_ids))
+    return df
+
 def get_no_data_value(in_raster):
     """
     gets no data value from raster
@@ -408,7 +932,8 @@ def get_no_data_value(in_raster):
 
     return no_data_value
 
-def batch_main(in_raster, in_lines_path, out_folder, res, section_string, v, crs=6393, vertical_datum='WGS84 Ellipsoid'):
+def batch_main(in_raster, in_lines_path, out_folder, res, section_string, v, crs=6393, vertical_datum='WGS84 Ellipsoid',
+               workers=None, make_outputs=True, batched=False, cache_mb=256):
     """
     Repeatedly take elevation profiles from a raster dem with an input shapefile containing all of the lines
     inputs:
@@ -420,86 +945,28 @@ def batch_main(in_raster, in_lines_path, out_folder, res, section_string, v, crs
     v (str): transect version
     crs (int): epsg code
     vertical_datum (str): string for plotting defining the vertical datum
+    workers (int): optional, number of processes to profile with
+    make_outputs (bool): write the profile csvs and figures or not
+    batched (bool): analyze all of the profiles at once as one matrix, no figures are made
+    cache_mb (float): raster block cache budget in megabytes, per worker
     """
     try:
         os.mkdir(out_folder)
     except:
         pass
     NO_DATA = get_no_data_value(in_raster)
-    shp_folder = os.path.join(os.path.dirname(in_lines_path), 'transects_shapefile')
     in_lines = gpd.read_file(in_lines_path)
     in_lines = in_lines.to_crs(epsg=crs)
-    in_lines_shp = geojson_to_shapefile(in_lines, in_lines_path, shp_folder)
-    line_file = ogr.Open(in_lines_shp)
-    layer = line_file.GetLayer(0)
-    max_slopes = [None]*len(layer)
-    max_tan_betas = [None]*len(layer)
-    avg_slopes = [None]*len(layer)
-    avg_tan_betas = [None]*len(layer)
-    median_slopes = [None]*len(layer)
-    median_tan_betas = [None]*len(layer)
-    ip_xs = [None]*len(layer)
-    ip_ys = [None]*len(layer)
-    crest_xs = [None]*len(layer)
-    crest_ys = [None]*len(layer)
-    crest2_xs = [None]*len(layer)
-    crest2_ys = [None]*len(layer)
-    crest3_xs = [None]*len(layer)
-    crest3_ys = [None]*len(layer)
-    toe_xs = [None]*len(layer)
-    toe_ys = [None]*len(layer)
-    transect_ids = [None]*len(layer)
-    i=0
-    for feature in layer:
-        print(i/len(layer)*100)
-        transect_id = section_string+v+str(i*50).zfill(6)
-        csv_path = os.path.join(out_folder, transect_id + '.csv')
-        output_dict = main(in_raster, feature, csv_path, res, NO_DATA, batch=True, vertical_datum=vertical_datum)
-        transect_ids[i] = transect_id
-        max_slopes[i] = output_dict['max_slope']
-        max_tan_betas[i] = output_dict['max_tan_beta']
-        avg_slopes[i] = output_dict['avg_slope']
-        avg_tan_betas[i] = output_dict['avg_tan_beta']
-        median_slopes[i] = output_dict['median_slope']
-        median_tan_betas[i] = output_dict['median_tan_beta']
-        ip_xs[i] = output_dict['ip_x']
-        ip_ys[i] = output_dict['ip_y']
-        crest_xs[i] = output_dict['crest_x']
-        crest_ys[i] = output_dict['crest_y']
-        crest2_xs[i] = output_dict['crest2_x']
-        crest2_ys[i] = output_dict['crest2_y']
-        crest3_xs[i] = output_dict['crest3_x']
-        crest3_ys[i] = output_dict['crest3_y']
-        toe_xs[i] = output_dict['toe_x']
-        toe_ys[i] = output_dict['toe_y']
-        i=i+1
-    df_dict = {'transect_id':transect_ids,
-               'max_slope':max_slopes,
-               'max_tan_beta':max_tan_betas,
-               'avg_slope':avg_slopes,
-               'avg_tan_beta':avg_tan_betas,
-               'median_slope':median_slopes,
-               'median_tan_beta':median_tan_betas,
-               'inflection_x':ip_xs,
-               'inflection_y':ip_ys,
-               'crest_x':crest_xs,
-               'crest_y':crest_ys,
-               'crest2_x':crest2_xs,
-               'crest2_y':crest2_ys,
-               'crest3_x':crest3_xs,
-               'crest3_y':crest3_ys,
-               'toe_x':toe_xs,
-               'toe_y':toe_ys,
-               }
-    df = pd.DataFrame(df_dict)
+    transect_ids = [section_string+v+str(i*50).zfill(6) for i in range(len(in_lines))]
+    df = batch_profiles(in_raster, in_lines.geometry, transect_ids, out_folder, res, NO_DATA,
+                        vertical_datum=vertical_datum, workers=workers, make_outputs=make_outputs, batched=batched,
+                        cache_mb=cache_mb)
     df.to_csv(os.path.join(os.path.dirname(out_folder), section_string+'_slopes.csv'))
-
-    ##remove temporary shapefile
-    os.rmtree(shp_folder)
     
     return df
 
-def batch_main_custom(site, in_raster, in_lines_path, out_folder, res, crs=6393, vertical_datum='WGS84 Ellipsoid'):
+def batch_main_custom(site, in_raster, in_lines_path, out_folder, res, crs=6393, vertical_datum='WGS84 Ellipsoid',
+                      workers=None, make_outputs=True, batched=False, cache_mb=256):
     """
     Repeatedly take elevation profiles from a raster dem with an input shapefile containing all of the lines
     inputs:
@@ -510,101 +977,26 @@ def batch_main_custom(site, in_raster, in_lines_path, out_folder, res, crs=6393,
     res (float): resolution to sample at in meters
     crs (int): epsg code
     vertical_datum (str): string for plotting defining the vertical datum
+    workers (int): optional, number of processes to profile with
+    make_outputs (bool): write the profile csvs and figures or not
+    batched (bool): analyze all of the profiles at once as one matrix, no figures are made
+    cache_mb (float): raster block cache budget in megabytes, per worker
     """
     try:
         os.mkdir(out_folder)
     except:
         pass
     NO_DATA = get_no_data_value(in_raster)
-    shp_folder = os.path.join(os.path.dirname(in_lines_path), 'transects_shapefile')
     in_lines = gpd.read_file(in_lines_path)
     in_lines = in_lines.to_crs(epsg=crs)
-    in_lines_shp = geojson_to_shapefile(in_lines, in_lines_path, shp_folder)
-    line_file = ogr.Open(in_lines_shp)
-    layer = line_file.GetLayer(0)
-    max_slopes = [None]*len(layer)
-    max_tan_betas = [None]*len(layer)
-    avg_slopes = [None]*len(layer)
-    avg_tan_betas = [None]*len(layer)
-    median_slopes = [None]*len(layer)
-    median_tan_betas = [None]*len(layer)
-    ip_xs = [None]*len(layer)
-    ip_ys = [None]*len(layer)
-    crest_xs = [None]*len(layer)
-    crest_ys = [None]*len(layer)
-    crest2_xs = [None]*len(layer)
-    crest2_ys = [None]*len(layer)
-    crest3_xs = [None]*len(layer)
-    crest3_ys = [None]*len(layer)
-    toe_xs = [None]*len(layer)
-    toe_ys = [None]*len(layer)
-    transect_ids = [None]*len(layer)
-    i=0
-    for feature in layer:
-        print(i/len(layer)*100)
-        transect_id = str(i)
-        csv_path = os.path.join(out_folder, transect_id + '.csv')
-        output_dict = main(in_raster, feature, csv_path, res, NO_DATA, batch=True, vertical_datum=vertical_datum)
-        transect_ids[i] = transect_id
-        max_slopes[i] = output_dict['max_slope']
-        max_tan_betas[i] = output_dict['max_tan_beta']
-        avg_slopes[i] = output_dict['avg_slope']
-        avg_tan_betas[i] = output_dict['avg_tan_beta']
-        median_slopes[i] = output_dict['median_slope']
-        median_tan_betas[i] = output_dict['median_tan_beta']
-        ip_xs[i] = output_dict['ip_x']
-        ip_ys[i] = output_dict['ip_y']
-        crest_xs[i] = output_dict['crest_x']
-        crest_ys[i] = output_dict['crest_y']
-        crest2_xs[i] = output_dict['crest2_x']
-        crest2_ys[i] = output_dict['crest2_y']
-        crest3_xs[i] = output_dict['crest3_x']
-        crest3_ys[i] = output_dict['crest3_y']
-        toe_xs[i] = output_dict['toe_x']
-        toe_ys[i] = output_dict['toe_y']
-        i=i+1
-    df_dict = {'transect_id':transect_ids,
-               'max_slope':max_slopes,
-               'max_tan_beta':max_tan_betas,
-               'avg_slope':avg_slopes,
-               'avg_tan_beta':avg_tan_betas,
-               'median_slope':median_slopes,
-               'median_tan_beta':median_tan_betas,
-               'inflection_x':ip_xs,
-               'inflection_y':ip_ys,
-               'crest_x':crest_xs,
-               'crest_y':crest_ys,
-               'crest2_x':crest2_xs,
-               'crest2_y':crest2_ys,
-               'crest3_x':crest3_xs,
-               'crest3_y':crest3_ys,
-               'toe_x':toe_xs,
-               'toe_y':toe_ys,
-               }
-    df = pd.DataFrame(df_dict)
+    transect_ids = [str(i) for i in range(len(in_lines))]
+    df = batch_profiles(in_raster, in_lines.geometry, transect_ids, out_folder, res, NO_DATA,
+                        vertical_datum=vertical_datum, workers=workers, make_outputs=make_outputs, batched=batched,
+                        cache_mb=cache_mb)
     df.to_csv(os.path.join(os.path.dirname(out_folder), site+'_slopes.csv'))
-
-    ##remove temporary shapefile
-    os.rmtree(shp_folder)
     
     return df
 
-def chaikins_corner_cutting(coords, refinements=5):
-    """
-    Smooths out lines or polygons with Chaikin's method
-    """
-    i=0
-    for _ in range(refinements):
-        L = coords.repeat(2, axis=0)
-        R = np.empty_like(L)
-        R[0] = L[0]
-        R[2::2] = L[1:-1:2]
-        R[1:-1:2] = L[2::2]
-        R[-1] = L[-1]
-        coords = L * 0.75 + R * 0.25
-        i=i+1
-    return coords
-
 def smooth_lines(shorelines):
     """
     Smooths out shorelines with Chaikin's method
@@ -620,13 +1012,7 @@ def smooth_lines(shorelines):
     lines = gpd.read_file(shorelines)
     lines = simplify_lines(lines)
     new_lines = lines.copy()
-    for i in range(len(lines)):
-        line = lines.iloc[i]
-        coords = LineString_to_arr(line['geometry'])
-        refined = chaikins_corner_cutting(coords)
-        refined_geom = arr_to_LineString(refined)
-        new_lines['geometry'][i] = refined_geom
-
+    new_lines['geometry'] = smooth_geometries(lines['geometry'].values)
     new_lines = new_lines.to_crs('epsg:4326')
     new_lines.to_file(save_path)
     return new_lines
@@ -9,6 +9,7 @@ import geopandas as gpd
 import analysis
 import datetime
 import shapely
+from line_smoothing import smooth_geometries
 import timeseries_filter
 import timeseries_resample
 
@@ -54,22 +55,6 @@ def LineString_to_arr(line):
     nparray = np.array(listarray)
     return nparray
 
-def chaikins_corner_cutting(coords, refinements=5):
-    """
-    Smooths out lines or polygons with Chaikin's method
-    """
-    i=0
-    for _ in range(refinements):
-        L = coords.repeat(2, axis=0)
-        R = np.empty_like(L)
-        R[0] = L[0]
-        R[2::2] = L[1:-1:2]
-        R[1:-1:2] = L[2::2]
-        R[-1] = L[-1]
-        coords = L * 0.75 + R * 0.25
-        i=i+1
-    return coords
-
 def smooth_lines(shorelines,refinements=5):
     """
     Smooths out shorelines with Chaikin's method
@@ -86,12 +71,7 @@ def smooth_lines(shorelines,refinements=5):
     save_path = os.path.join(dirname,os.path.splitext(os.path.basename(shorelines))[0]+'_smooth.geojson')
     lines = gpd.read_file(shorelines)
     new_lines = lines.copy()
-    for i in range(len(lines)):
-        line = lines.iloc[i]
-        coords = LineString_to_arr(line.geometry)
-        refined = chaikins_corner_cutting(coords, refinements=refinements)
-        refined_geom = arr_to_LineString(refined)
-        new_lines['geometry'][i] = refined_geom
+    new_lines['geometry'] = smooth_geometries(lines['geometry'].values, refinements=refinements)
     new_lines.to_file(save_path)
     return save_path
 
@@ -9,10 +9,10 @@ def min_max_normalize(arr):
     return (arr - min_val) / (max_val - min_val)
 
 def apply_filters(shorelines,
-                  which_filter
+                  which_filter,
                   thresh=0):
 
-    if which_filter == 'overall'
+    if which_filter == 'overall':
         weighted_overall_scores = (0.2*shorelines['kde_value']+
                               0.5*shorelines['model_scores']+
                               0.3*shorelines['model_scores_seg'])/3
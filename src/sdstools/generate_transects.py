@@ -20,6 +20,8 @@ import numpy as np
 import shapely
 import warnings
 import matplotlib.pyplot as plt
+from transect_catalog import TransectCatalog
+from line_smoothing import smooth_geometries
 warnings.filterwarnings("ignore")
 
 def get_immediate_subdirectories(a_dir):
@@ -71,22 +73,6 @@ def simplify_lines(lines, tolerance=25):
     lines['geometry'] = lines['geometry'].simplify(tolerance)
     return lines
 
-def chaikins_corner_cutting(coords, refinements=5):
-    """
-    Smooths out lines or polygons with Chaikin's method
-    """
-    i=0
-    for _ in range(refinements):
-        L = coords.repeat(2, axis=0)
-        R = np.empty_like(L)
-        R[0] = L[0]
-        R[2::2] = L[1:-1:2]
-        R[1:-1:2] = L[2::2]
-        R[-1] = L[-1]
-        coords = L * 0.75 + R * 0.25
-        i=i+1
-    return coords
-
 def smooth_lines(shorelines_path, simplify=50):
     """
     Smooths out shorelines with Chaikin's method
@@ -100,13 +86,7 @@ def smooth_lines(shorelines_path, simplify=50):
     shorelines = gpd.read_file(shorelines_path)
     shorelines = simplify_lines(shorelines, tolerance=50)
     new_lines = shorelines.copy()
-    for i in range(len(new_lines)):
-        line = new_lines.iloc[i]['geometry']
-        coords = LineString_to_arr(line)
-        refined = chaikins_corner_cutting(coords)
-        refined_geom = arr_to_LineString(refined)
-        new_lines['geometry'][i] = refined_geom
-
+    new_lines['geometry'] = smooth_geometries(shorelines['geometry'].values)
     new_lines.to_file(shorelines_path)
     return shorelines_path
 
@@ -120,13 +100,7 @@ def smooth_lines_df(shorelines_df):
     new_lines (geodataframe): smooth shorelines geodataframe
     """
     new_lines = shorelines_df.copy()
-    for i in range(len(new_lines)):
-        line = new_lines.iloc[i]['geometry']
-        coords = LineString_to_arr(line)
-        refined = chaikins_corner_cutting(coords)
-        refined_geom = arr_to_LineString(refined)
-        new_lines['geometry'][i] = refined_geom
-
+    new_lines['geometry'] = smooth_geometries(shorelines_df['geometry'].values)
     return new_lines
 
 def utm_to_wgs84_file(geojson_file):
@@ -269,14 +243,84 @@ def getPoint2(pt, bearing, dist):
     y = pt.y + dist * math.sin(bearing)
     return Point(x, y)
 
+def interpolate_along_lines(lines, line_ids, distances):
+    """
+    Points at distances along lines, for many lines and distances at once
+    Each line's vertices get a cumulative length index, the segment holding each distance is found
+    with np.searchsorted and the point is interpolated within it, so each line is only walked once
+    inputs:
+    lines (np.ndarray of shapely LineStrings): lines
+    line_ids (np.ndarray): index into lines of each point
+    distances (np.ndarray): distance of each point along its line, clamped to the line
+    outputs:
+    points (np.ndarray): x and y of each point, shape (n, 2)
+    """
+    coords, vertex_line = shapely.get_coordinates(lines, return_index=True)
+    segment_lengths = np.hypot(*np.diff(coords, axis=0).T)
+    ##no segments between the last vertex of one line and the first of the next
+    segment_lengths[vertex_line[1:] != vertex_line[:-1]] = 0
+    cumulative_lengths = np.concatenate([[0], np.cumsum(segment_lengths)])
+
+    line_numbers = np.arange(len(lines))
+    first_vertex = np.searchsorted(vertex_line, line_numbers)[line_ids]
+    last_vertex = np.searchsorted(vertex_line, line_numbers, side='right')[line_ids] - 1
+    line_start = cumulative_lengths[first_vertex]
+    targets = line_start + np.clip(distances, 0, cumulative_lengths[last_vertex] - line_start)
+    segment = np.searchsorted(cumulative_lengths, targets, side='right') - 1
+    segment = np.clip(segment, first_vertex, np.maximum(last_vertex - 1, first_vertex))
+
+    segment_length = cumulative_lengths[segment+1] - cumulative_lengths[segment]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(segment_length > 0, (targets - cumulative_lengths[segment])/segment_length, 0.0)
+    return coords[segment] + fraction[:,None]*(coords[segment+1] - coords[segment])
+
+def chainage_transects(lines, transect_spacing, transect_length):
+    """
+    Computes every transect along a set of lines at once
+    Transects are placed every transect_spacing along each line (not at its ends),
+    normal to the chord from the previous chainage point (the next one for the first point)
+    inputs:
+    lines (np.ndarray of shapely LineStrings): reference lines, each is treated separately
+    transect_spacing: distance between each transect in meters
+    transect_length: length of each transect in meters
+    outputs:
+    ticks (np.ndarray of shapely LineStrings): transects, from the left of the line to the right
+    chainages (np.ndarray): distance of each transect along its line, the last one on a line gets int(line length)
+    line_ids (np.ndarray): index of the line each transect is on
+    """
+    lengths = shapely.length(lines)
+    counts = np.maximum(np.ceil(lengths/transect_spacing).astype(int) - 1, 0)
+    ##need two chainage points on a line to get a direction
+    counts[counts < 2] = 0
+    line_ids = np.repeat(np.arange(len(lines)), counts)
+    starts = np.cumsum(counts) - counts
+    k = np.arange(counts.sum()) - np.repeat(starts, counts) + 1
+    points = interpolate_along_lines(lines, line_ids, k*float(transect_spacing))
+
+    ##chord to the previous point, or to the next point for the first point on a line
+    direction = np.empty_like(points)
+    direction[1:] = points[1:] - points[:-1]
+    first = k == 1
+    direction[first] = points[np.flatnonzero(first)+1] - points[first]
+    angle = np.arctan2(direction[:,1], direction[:,0])
+    normal = np.stack([np.cos(angle + np.pi/2), np.sin(angle + np.pi/2)], axis=1)
+    line_end_1 = points + normal*transect_length/2
+    line_end_2 = points - normal*transect_length/2
+    ticks = shapely.linestrings(np.stack([line_end_1, line_end_2], axis=1))
+
+    chainages = (k - 1)*float(transect_spacing)
+    last = np.cumsum(counts)[counts > 0] - 1
+    chainages[last] = lengths[counts > 0].astype(int)
+    return ticks, chainages, line_ids
+
 def make_transects(input_path,
                    transect_spacing,
                    transect_length):
     """
     Generates normal transects to an input line shapefile
-    (would rather this take as input a geojson but oh well for now)
+    every part of every line in the file gets its own set of transects
     inputs:
-    input_path: path to shapefile containing the input line
+    input_path: path to shapefile (or geojson) containing the input line(s)
     transect_spacing: distance between each transect in meters
     transect_length: length of each transect in meters
     outputs:
@@ -284,104 +328,21 @@ def make_transects(input_path,
     """
 
     output_path = os.path.splitext(input_path)[0]+'_transects_'+str(transect_spacing)+'m.shp'
-    ## set the driver for the data
-    driver = ogr.GetDriverByName("Esri Shapefile")
-    
-    ## open the shapefile in write mode (1)
-    ds = driver.Open(input_path)
-    shape = ds.GetLayer(0)
-    
-    ## distance between each points
-    distance = transect_spacing
-    ## the length of each tick
-    tick_length = transect_length
-
-    ## output tick line fc name
-    ds_out = driver.CreateDataSource(output_path)
-    layer_out = ds_out.CreateLayer('line',shape.GetSpatialRef(),ogr.wkbLineString)
-
-    ## list to hold all the point coords
-    list_points = []
-
-
-    ## distance/chainage attribute
-    chainage_fld = ogr.FieldDefn("CHAINAGE", ogr.OFTReal)
-    layer_out.CreateField(chainage_fld)
-    ## check the geometry is a line
-    first_feat = shape.GetFeature(0)
-
-    ln = first_feat
-    ## list to hold all the point coords
-    list_points = []
-    ## set the current distance to place the point
-    current_dist = distance
-    ## get the geometry of the line as wkt
-    line_geom = ln.geometry().ExportToWkt()
-    ## make shapely LineString object
-    shapely_line = LineString(wkt.loads(line_geom))
-    ## get the total length of the line
-    line_length = shapely_line.length
-    ## append the starting coordinate to the list
-    list_points.append(Point(list(shapely_line.coords)[0]))
-    ## https://nathanw.net/2012/08/05/generating-chainage-distance-nodes-in-qgis/
-    ## while the current cumulative distance is less than the total length of the line
-    while current_dist < line_length:
-        ## use interpolate and increase the current distance
-        list_points.append(shapely_line.interpolate(current_dist))
-        current_dist += distance
-    ## append end coordinate to the list
-    list_points.append(Point(list(shapely_line.coords)[-1]))
-    list_points = list_points[1:-1]
-
-    ## add lines to the layer
-    ## this can probably be cleaned up better
-    ## but it works and is fast!
-    for num, pt in enumerate(list_points, 1):
-        ## start chainage 0
-        if num == 1:
-            angle = getAngle(pt, list_points[num])
-            line_end_1 = getPoint1(pt, angle, tick_length/2)
-            angle = getAngle(line_end_1, pt)
-            line_end_2 = getPoint2(line_end_1, angle, tick_length)
-            tick = LineString([(line_end_1.x, line_end_1.y), (line_end_2.x, line_end_2.y)])
-            feat_dfn_ln = layer_out.GetLayerDefn()
-            feat_ln = ogr.Feature(feat_dfn_ln)
-            feat_ln.SetGeometry(ogr.CreateGeometryFromWkt(tick.wkt))
-            feat_ln.SetField("CHAINAGE", 0)
-            layer_out.CreateFeature(feat_ln)
-
-        ## everything in between
-        if num < len(list_points) - 1:
-            angle = getAngle(pt, list_points[num])
-            line_end_1 = getPoint1(list_points[num], angle, tick_length/2)
-            angle = getAngle(line_end_1, list_points[num])
-            line_end_2 = getPoint2(line_end_1, angle, tick_length)
-            tick = LineString([(line_end_1.x, line_end_1.y), (line_end_2.x, line_end_2.y)])
-            feat_dfn_ln = layer_out.GetLayerDefn()
-            feat_ln = ogr.Feature(feat_dfn_ln)
-            feat_ln.SetGeometry(ogr.CreateGeometryFromWkt(tick.wkt))
-            feat_ln.SetField("CHAINAGE", distance * num)
-            layer_out.CreateFeature(feat_ln)
-
-        ## end chainage
-        if num == len(list_points):
-            angle = getAngle(list_points[num - 2], pt)
-            line_end_1 = getPoint1(pt, angle, tick_length/2)
-            angle = getAngle(line_end_1, pt)
-            line_end_2 = getPoint2(line_end_1, angle, tick_length)
-            tick = LineString([(line_end_1.x, line_end_1.y), (line_end_2.x, line_end_2.y)])
-            feat_dfn_ln = layer_out.GetLayerDefn()
-            feat_ln = ogr.Feature(feat_dfn_ln)
-            feat_ln.SetGeometry(ogr.CreateGeometryFromWkt(tick.wkt))
-            feat_ln.SetField("CHAINAGE", int(line_length))
-            layer_out.CreateFeature(feat_ln)
-
-    del ds
+    lines = gpd.read_file(input_path)
+    parts = lines.geometry.explode(index_parts=False).reset_index(drop=True)
+    ticks, chainages, line_ids = chainage_transects(np.asarray(parts), transect_spacing, transect_length)
+    transects = gpd.GeoDataFrame({'CHAINAGE':chainages,
+                                  'LINE_ID':line_ids},
+                                 geometry=ticks,
+                                 crs=lines.crs)
+    transects.to_file(output_path)
     return output_path
 
 def clip_transects(transects_path, area_path):
     """
     Clips transects to a given area, saves to new geojson
+    the transects' index is saved next to them on the first clip (transects_catalog.parquet),
+    later clips only read the parts of it that overlap the area
     inputs:
     transects_path (str): path to the transects (geojson)
     area_path (str): path to the polygon (geojson)
@@ -389,12 +350,64 @@ def clip_transects(transects_path, area_path):
     save_path (str): path to the clipped transects
     """
     save_path = os.path.splitext(transects_path)[0]+'_clipped.geojson'
-    transects = gpd.read_file(transects_path)
     area = gpd.read_file(area_path)
-    clipped_transects = gpd.clip(transects, area)
+    catalog = TransectCatalog.load(transects_path, area=area)
+    clipped_transects = catalog.clip(area)
     clipped_transects.to_file(save_path)
     return save_path
 
+def line_segments(lines):
+    """
+    Splits lines into their straight segments
+    inputs:
+    lines (np.ndarray): shapely LineStrings
+    outputs:
+    starts (np.ndarray): first vertex of each segment, shape (n, 2)
+    ends (np.ndarray): last vertex of each segment, shape (n, 2)
+    line_ids (np.ndarray): line each segment belongs to, shape (n,)
+    """
+    coords, vertex_line = shapely.get_coordinates(lines, return_index=True)
+    same_line = vertex_line[1:] == vertex_line[:-1]
+    return coords[:-1][same_line], coords[1:][same_line], vertex_line[:-1][same_line]
+
+def crossing_distances(line, transects):
+    """
+    Distance along a line to where each transect crosses it,
+    the segments of the line go in an STRtree and each crossing is solved in numpy
+    inputs:
+    line (shapely LineString): reference line
+    transects (np.ndarray): shapely LineStrings
+    outputs:
+    distances (np.ndarray): distance along line to the crossing closest to its start,
+                            inf for transects that don't cross it
+    """
+    line_starts, line_ends, _ = line_segments(np.array([line], dtype=object))
+    line_vectors = line_ends - line_starts
+    segment_lengths = np.hypot(*line_vectors.T)
+    cumulative_lengths = np.concatenate([[0], np.cumsum(segment_lengths)])
+    tree = shapely.STRtree(shapely.linestrings(np.stack([line_starts, line_ends], axis=1)))
+
+    transect_starts, transect_ends, transect_ids = line_segments(transects)
+    transect_segments = shapely.linestrings(np.stack([transect_starts, transect_ends], axis=1))
+    distances = np.full(len(transects), np.inf)
+    ##a transect through a vertex of the line only touches the two segments there
+    for predicate in ['crosses', 'touches']:
+        unmatched = np.flatnonzero(np.isinf(distances[transect_ids]))
+        transect_seg, line_seg = tree.query(transect_segments[unmatched], predicate=predicate)
+        transect_seg = unmatched[transect_seg]
+
+        ##p + t*r = q + u*s, u is the fraction along the line segment
+        r = transect_ends[transect_seg] - transect_starts[transect_seg]
+        s = line_vectors[line_seg]
+        qp = line_starts[line_seg] - transect_starts[transect_seg]
+        denominator = r[:,0]*s[:,1] - r[:,1]*s[:,0]
+        ##parallel segments that only touch end to end have no single crossing
+        keep = denominator != 0
+        u = (qp[keep,0]*r[keep,1] - qp[keep,1]*r[keep,0])/denominator[keep]
+        crossing_distance = cumulative_lengths[line_seg[keep]] + np.clip(u, 0, 1)*segment_lengths[line_seg[keep]]
+        np.minimum.at(distances, transect_ids[transect_seg[keep]], crossing_distance)
+    return distances
+
 def re_index_with_ref_shoreline(transects_path, ref_shore_path, G, C, RR, SSS, version_name, tolerance=50, dist_int=50):
     """
     takes a set of transects with jumbled up index and uses reference shoreline
@@ -408,9 +421,7 @@ def re_index_with_ref_shoreline(transects_path, ref_shore_path, G, C, RR, SSS, v
     RR (str): sub region
     SSS (str): shoreline section
     tolerance (int, optional, default=10): tolerance for simplifying the reference shoreline, meters
-    dist_int (int, optional, default=30): when to stop computing cumulative distance along ref shoreline,
-                                          basically how close to get to the transect intersection before
-                                          finishing computing the cumulative distance, using the transect spacing works well
+    dist_int (int, optional): no longer used, transects are located exactly where they cross the reference shoreline
     outputs:
     new_transects_path (str): path to the new transects
     """
@@ -426,31 +437,15 @@ def re_index_with_ref_shoreline(transects_path, ref_shore_path, G, C, RR, SSS, v
 
     ##if there are multiple ref shorelines, we merge into one
     ref_shore = ref_shore.sort_values('OBJECTID',ascending=True).reset_index()
-    points = []
-    for shore in ref_shore['geometry']:
-        for point in shore.coords:
-            points.append(point)
-    ref_shore_real = shapely.LineString(points)
-
-    ##loop over transects
-    intersections = [None]*len(transects)
-    distances = [None]*len(transects)
-    for i in range(len(transects)):
-        t = transects.iloc[i]
-        ##find the intersection point with the reference shoreline
-        intersect = ref_shore_real.intersection(t['geometry'])
-        cumulative_distance = 0
-        j=0
-        for j in range(1, len(ref_shore_real.coords)):
-            start_point = shapely.Point(ref_shore_real.coords[j-1])
-            end_point = shapely.Point(ref_shore_real.coords[j])
-            distance = end_point.distance(start_point)
-            distance_int = intersect.distance(end_point)
-            if distance_int <=dist_int:
-                break
-            else:
-                cumulative_distance = cumulative_distance + distance
-        distances[i] = cumulative_distance
+    ref_shore_real = shapely.LineString(shapely.get_coordinates(ref_shore['geometry'].values))
+
+    ##distance along the reference shoreline to each transect's crossing,
+    ##the closest to the start if a transect crosses it more than once,
+    ##transects that miss it are located by their centroid
+    distances = crossing_distances(ref_shore_real, transects['geometry'].values)
+    missing = np.isinf(distances)
+    distances[missing] = shapely.line_locate_point(ref_shore_real,
+                                                   shapely.centroid(transects['geometry'].values[missing]))
     if np.any(np.isnan(distances))==True:
         return
 
@@ -3,32 +3,96 @@ Profiling tool with xarrays I guess?
 """
 
 import rioxarray
+import xarray as xr
 import geopandas as gpd
 import pandas as pd
+import numpy as np
+import shapely
 import os
+from timeseries_storage import is_parquet
 
-def extract_along_line(xarr, line, raster_res):
+def line_sample_points(line, raster_res):
     """
-    gets profile data
+    gets every sample point along a line at once
+    inputs:
+    line (shapely LineString): profile line
+    raster_res (float): horizontal resolution of raster
+    outputs:
+    distance (np.ndarray): distance of each sample along the line
+    xs (np.ndarray): x coordinate of each sample
+    ys (np.ndarray): y coordinate of each sample
     """
-    line_length = line.length
     n_samples = int(line.length/raster_res)
-    profile = [None]*n_samples
-    for i in range(n_samples):
-        # get next point on the line
-        point = line.interpolate(i / n_samples - 1., normalized=True)
-        # access the nearest pixel in the xarray
-        value = xarr.sel(x=point.x, y=point.y, method="nearest").data
-        profile[i] = value
+    points = shapely.line_interpolate_point(line, np.arange(n_samples)/n_samples, normalized=True)
+    coords = shapely.get_coordinates(points)
+    return np.arange(n_samples)*raster_res, coords[:,0], coords[:,1]
+
+def sample_raster(xarr, xs, ys, method='nearest'):
+    """
+    samples the raster at many points with a single indexing call
+    inputs:
+    xarr (xarray DataArray): raster with x and y coordinates, can be dask backed
+    xs (np.ndarray): x coordinates
+    ys (np.ndarray): y coordinates
+    method (str): 'nearest' for the nearest pixel or 'linear' for bilinear interpolation
+    outputs:
+    values (np.ndarray): raster value at each point
+    """
+    xs = xr.DataArray(xs, dims='sample')
+    ys = xr.DataArray(ys, dims='sample')
+    if method == 'nearest':
+        values = xarr.sel(x=xs, y=ys, method='nearest')
+    else:
+        values = xarr.interp(x=xs, y=ys, method=method)
+    return np.asarray(values.data)
 
-    profile_df = pd.DataFrame({'x':range(n_samples)*raster_res,
+def extract_along_line(xarr, line, raster_res, method='nearest'):
+    """
+    gets profile data
+    inputs:
+    xarr (xarray DataArray): raster with x and y coordinates
+    line (shapely LineString): profile line
+    raster_res (float): horizontal resolution of raster
+    method (str): 'nearest' for the nearest pixel or 'linear' for bilinear interpolation
+    outputs:
+    profile_df (pandas DataFrame): x (distance along the line) and z (raster value)
+    """
+    distance, xs, ys = line_sample_points(line, raster_res)
+    profile = sample_raster(xarr, xs, ys, method=method)
+    profile_df = pd.DataFrame({'x':distance,
                                'z':profile})
     return profile_df
 
+def extract_along_lines(xarr, lines, raster_res, method='nearest'):
+    """
+    gets profile data for many lines with one raster read,
+    so a dask backed raster is only computed once
+    inputs:
+    xarr (xarray DataArray): raster with x and y coordinates
+    lines (GeoSeries): profile lines
+    raster_res (float): horizontal resolution of raster
+    method (str): 'nearest' for the nearest pixel or 'linear' for bilinear interpolation
+    outputs:
+    profiles_df (pandas DataFrame): long format, transect (index of the line), x (distance along the line) and z (raster value)
+    """
+    samples = [line_sample_points(line, raster_res) for line in lines]
+    transect = np.repeat(np.asarray(lines.index), [len(sample[0]) for sample in samples])
+    distance = np.concatenate([sample[0] for sample in samples] + [np.zeros(0)])
+    xs = np.concatenate([sample[1] for sample in samples] + [np.zeros(0)])
+    ys = np.concatenate([sample[2] for sample in samples] + [np.zeros(0)])
+    profiles_df = pd.DataFrame({'transect':transect,
+                                'x':distance,
+                                'z':sample_raster(xarr, xs, ys, method=method)})
+    return profiles_df
+
 def get_profile_csv(raster_path,
                     raster_res,
                     transects_path,
-                    output_folder):
+                    output_folder,
+                    method='nearest',
+                    chunks=None,
+                    long_format_path=None,
+                    id_column='transect_id'):
     """
     Profiles raster with transects
     saves csv for each transect
@@ -38,24 +102,27 @@ def get_profile_csv(raster_path,
     raster_res (float): horizontal resolution of raster
     transects_path (str): path to transects
     output_folder (str): path to save profiles to
-    
+    method (str): 'nearest' for the nearest pixel or 'linear' for bilinear interpolation
+    chunks (optional): dask chunks to open the raster with, e.g. 'auto' or {'x':4096, 'y':4096},
+                       for rasters bigger than memory
+    long_format_path (str): optional, path to a .parquet or .csv to save all of the profiles to
+                            in one long format table instead of one csv per transect
+    id_column (str): column of the transects with their ids, copied into the long format table
+                     next to transect (the row of the transect) so profiles can be joined back to the transects
     """
     ##sample kde
-    raster = rioxarray.open_rasterio(raster_path).squeeze()
+    raster = rioxarray.open_rasterio(raster_path, chunks=chunks).squeeze()
     transects = gpd.read_file(transects_path)
-    profiles [None]*len(transects)
-    for idx,row in transects.iterrows():
-        transect = row['geometry']
-        profile = extract_along_line(raster, transect, raster_res)
+    profiles = extract_along_lines(raster, transects.geometry, raster_res, method=method)
+    if long_format_path is not None:
+        if id_column in transects.columns:
+            profiles.insert(1, id_column, transects[id_column].loc[profiles['transect']].values)
+        if is_parquet(long_format_path):
+            profiles.to_parquet(long_format_path, index=False)
+        else:
+            profiles.to_csv(long_format_path, index=False)
+        return long_format_path
+    for idx, profile in profiles.groupby('transect', sort=False):
+        profile = profile[['x', 'z']].reset_index(drop=True)
         profile.to_csv(os.path.join(output_folder, 'profile_'+str(idx)+'.csv'))
-
-
-
-
-
-
-
-
-
-
-        
+    return output_folder
@@ -17,7 +17,8 @@ import datetime
 import warnings
 import shapely
 from math import degrees, atan2, radians
-from scipy import stats
+from linear_trends import linregress, matrix_trends, years_since
+from timeseries_storage import read_merged
 
 warnings.filterwarnings("ignore")
 
@@ -97,20 +98,9 @@ def get_trend(filter_df,
     lls_result: all the lls results (slope, intercept, stderr, intercept_stderr, rvalue)
     """
     
-    filtered_datetimes = np.array(filter_df['dates'])
-    shore_pos = np.array(filter_df['pos'])
-    datetimes_seconds = [None]*len(filtered_datetimes)
-    initial_time = filtered_datetimes[0]
-    for i in range(len(filter_df)):
-        t = filter_df['dates'].iloc[i]
-        dt = t-initial_time
-        dt_sec = dt.total_seconds()
-        datetimes_seconds[i] = dt_sec
-    datetimes_seconds = np.array(datetimes_seconds)
-    datetimes_years = datetimes_seconds/(60*60*24*365)
-    x = datetimes_years
-    y = shore_pos
-    lls_result = stats.linregress(x,y)
+    x = years_since(filter_df['dates'])
+    y = np.array(filter_df['pos'])
+    lls_result = linregress(x,y)
     slope = lls_result.slope
     intercept = lls_result.intercept
     r_value = lls_result.rvalue**2
@@ -147,42 +137,22 @@ def get_trends(transect_timeseries_path,
     config_gdf = config_gdf_path
     transects = config_gdf[config_gdf['type']=='transect']
     
-    ##For each transect, compute LLS, make plots, make csvs
-    slopes = np.empty(len(transects))
-    slopes[:] = np.nan
-    intercepts = np.empty(len(transects))
-    intercepts[:] = np.nan
-    r_squares = np.empty(len(transects))
-    r_squares[:] = np.nan
-    slope_uncertainties = np.empty(len(transects))
-    slope_uncertainties[:] = np.nan
-    intercept_uncertainties = np.empty(len(transects))
-    intercept_uncertainties[:] = np.nan
-    for i in range(len(slopes)):
-        transect_id = transects['id'].iloc[i]
-        
-        x = timeseries_data['dates']
-        try:
-            y = timeseries_data[transect_id]
-        except:
-            i=i+1
-            continue
-        df = pd.DataFrame({'dates':x,
-                           'pos':y
-                           })
-        filter_df = df[df['dates']>t_min]
-        filter_df = df[df['dates']<t_max]
-        filter_df.reset_index()
-        filter_df = filter_df.dropna(how='any')
-        
-        lls_result = get_trend(filter_df)
-        
-        slopes[i] = lls_result.slope
-        intercepts[i] = lls_result.intercept
-        r_squares[i] = lls_result.rvalue**2
-        slope_uncertainties[i] = lls_result.stderr
-        intercept_uncertainties[i] = lls_result.intercept_stderr
-
+    ##Compute LLS on every transect at once
+    dates = timeseries_data['dates']
+    in_range = ((dates>t_min) & (dates<t_max)).values
+    present = transects['id'].isin(timeseries_data.columns).values
+    y = timeseries_data[list(transects['id'][present])].values.astype(float)[in_range]
+    lls_result = matrix_trends(dates[in_range], y)
+    slopes = np.full(len(transects), np.nan)
+    slopes[present] = lls_result.slope
+    intercepts = np.full(len(transects), np.nan)
+    intercepts[present] = lls_result.intercept
+    r_squares = np.full(len(transects), np.nan)
+    r_squares[present] = lls_result.rvalue**2
+    slope_uncertainties = np.full(len(transects), np.nan)
+    slope_uncertainties[present] = lls_result.stderr
+    intercept_uncertainties = np.full(len(transects), np.nan)
+    intercept_uncertainties[present] = lls_result.intercept_stderr
 
     ###Making the vector file with trends
     skip_idx = np.isnan(slopes)
@@ -319,18 +289,18 @@ def in_situ_comparison(home,
     ##for the datetimes, i'm chopping of the hours, minutes, and seconds so that there not duplicate sds measurements from the same day
     ##in situ
     in_situ_csv = os.path.join(data_dir, 'in_situ', 'in_situ_transect_time_series_merged.csv')
-    in_situ_df = pd.read_csv(in_situ_csv)
-    in_situ_df['dates'] = pd.to_datetime(in_situ_df['dates'], utc=True).dt.floor('d')
+    in_situ_df = read_merged(in_situ_csv)
+    in_situ_df['dates'] = in_situ_df['dates'].dt.floor('d')
 
     ##raw
     raw_csv = os.path.join(data_dir, 'raw', 'raw_transect_time_series_merged.csv')
-    df_raw = pd.read_csv(raw_csv)
-    df_raw['dates'] = pd.to_datetime(df_raw['dates'], utc=True).dt.floor('d')
+    df_raw = read_merged(raw_csv)
+    df_raw['dates'] = df_raw['dates'].dt.floor('d')
 
     ##tidally corrected
     tide_csv = os.path.join(data_dir, 'tidally_corrected', 'tidally_corrected_transect_time_series_merged.csv')
-    df_tide = pd.read_csv(tide_csv)
-    df_tide['dates'] = pd.to_datetime(df_tide['dates'], utc=True).dt.floor('d')
+    df_tide = read_merged(tide_csv)
+    df_tide['dates'] = df_tide['dates'].dt.floor('d')
 
     ##loop over unique transects in sds data
     transects = sorted(df_raw['transect_id'].unique())
@@ -0,0 +1,75 @@
+"""
+Chaikin's corner cutting for many lines at once.
+All of the lines' vertices are refined together as one flat coordinate array,
+with each vertex tagged by the line it belongs to.
+"""
+
+import numpy as np
+import shapely
+
+def chaikin_refine(coords, line_index, refinements=5):
+    """
+    Chaikin's corner cutting on a flat array of vertices from many lines
+    Every vertex k of a line becomes 0.75*v[k] + 0.25*v[k-1] and 0.75*v[k] + 0.25*v[k+1],
+    the first and last vertices of each line are kept in place
+    inputs:
+    coords (np.ndarray): vertices, shape (n, 2) or (n, 3)
+    line_index (np.ndarray): line each vertex belongs to, shape (n,), vertices of a line must be contiguous
+    refinements (int): number of refinements
+    outputs:
+    coords (np.ndarray): refined vertices, 2**refinements times as many
+    line_index (np.ndarray): line each refined vertex belongs to
+    """
+    coords = np.asarray(coords, dtype=float)
+    line_index = np.asarray(line_index)
+    for _ in range(refinements):
+        if len(coords) == 0:
+            break
+        line_start = np.ones(len(coords), dtype=bool)
+        line_start[1:] = line_index[1:] != line_index[:-1]
+        line_end = np.ones(len(coords), dtype=bool)
+        line_end[:-1] = line_start[1:]
+        prev_coords = np.roll(coords, 1, axis=0)
+        prev_coords[line_start] = coords[line_start]
+        next_coords = np.roll(coords, -1, axis=0)
+        next_coords[line_end] = coords[line_end]
+        refined = np.empty((2*len(coords), coords.shape[1]))
+        refined[0::2] = coords*0.75 + prev_coords*0.25
+        refined[1::2] = coords*0.75 + next_coords*0.25
+        coords = refined
+        line_index = line_index.repeat(2)
+    return coords, line_index
+
+def chaikins_corner_cutting(coords, refinements=5):
+    """
+    Smooths out lines or polygons with Chaikin's method
+    inputs:
+    coords (np.ndarray): [(x1,y1), (x..,y..), (xn,yn)]
+    refinements (int): number of refinements
+    outputs:
+    coords (np.ndarray): [(x1,y1), (x..,y..), (xn,yn)],
+                         this is the smooth line
+    """
+    coords = np.asarray(coords, dtype=float)
+    refined, _ = chaikin_refine(coords, np.zeros(len(coords), dtype=int), refinements=refinements)
+    return refined
+
+def smooth_geometries(geometries, refinements=5):
+    """
+    Smooths every line in an array or GeoSeries with Chaikin's method in one pass
+    Multi-part lines are joined into one line, same as smoothing their coordinate list,
+    missing and empty geometries are passed through
+    inputs:
+    geometries (np.ndarray or GeoSeries): lines
+    refinements (int): number of refinements
+    outputs:
+    smooth (np.ndarray): smooth LineStrings, same length as geometries
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    coords, line_index = shapely.get_coordinates(geometries, return_index=True)
+    coords, line_index = chaikin_refine(coords, line_index, refinements=refinements)
+    smooth = geometries.copy()
+    if len(coords) > 0:
+        lines_with_coords, compact_index = np.unique(line_index, return_inverse=True)
+        smooth[lines_with_coords] = shapely.linestrings(coords, indices=compact_index.ravel())
+    return smooth
@@ -0,0 +1,103 @@
+"""
+Closed-form ordinary least squares trends for many shoreline timeseries at once.
+One masked-sum pass over a (time x transects) matrix gives the same results as
+running scipy.stats.linregress on each transect's valid samples.
+"""
+
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from scipy import stats
+
+LinregressResult = namedtuple('LinregressResult', ['slope', 'intercept', 'rvalue', 'pvalue', 'stderr', 'intercept_stderr'])
+
+SECONDS_PER_YEAR = 60*60*24*365
+
+def years_since(dates, initial_time=None):
+    """
+    Converts datetimes to (365 day) years elapsed since initial_time
+    inputs:
+    dates (array-like of datetimes): timeseries dates, e.g. a DatetimeIndex or a datetime column
+    initial_time (datetime): optional, defaults to the first date
+    outputs:
+    datetimes_years (np.ndarray): years since initial_time
+    """
+    dates = pd.DatetimeIndex(dates)
+    if initial_time is None:
+        initial_time = dates[0]
+    datetimes_seconds = (dates - initial_time).total_seconds().values
+    datetimes_years = datetimes_seconds/SECONDS_PER_YEAR
+    return datetimes_years
+
+def linregress_columns(x, y):
+    """
+    OLS fit of every column of y against x at once, ignoring nans
+    inputs:
+    x (np.ndarray): times, shape (n,) shared by all columns or (n, m) per column
+    y (np.ndarray): values, shape (n, m), nan where missing
+    outputs:
+    lls_result (LinregressResult): arrays of shape (m,) for slope, intercept, rvalue, pvalue, stderr, intercept_stderr,
+                                   nan for columns with fewer than two valid samples
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.broadcast_to(np.asarray(x, dtype=float).reshape(y.shape[0], -1), y.shape)
+    mask = ~np.isnan(x) & ~np.isnan(y)
+    n = mask.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(mask, x, 0).sum(axis=0)/n
+        y_mean = np.where(mask, y, 0).sum(axis=0)/n
+        dx = np.where(mask, x - x_mean, 0)
+        dy = np.where(mask, y - y_mean, 0)
+        ssx = (dx*dx).sum(axis=0)
+        ssy = (dy*dy).sum(axis=0)
+        ssxy = (dx*dy).sum(axis=0)
+
+        slope = ssxy/ssx
+        intercept = y_mean - slope*x_mean
+        # constant y has no correlation, scipy gives nan
+        r = np.where(ssy == 0, np.nan, ssxy/np.sqrt(ssx*ssy))
+        r = np.clip(r, -1.0, 1.0)
+        df = n - 2
+        t = r*np.sqrt(df/((1.0 - r)*(1.0 + r)))
+        p = 2*stats.t.sf(np.abs(t), df)
+        slope_err = np.sqrt((1 - r**2)*ssy/ssx/df)
+        intercept_err = slope_err*np.sqrt(ssx/n + x_mean**2)
+
+    # two points fit exactly, same as scipy.stats.linregress
+    two_points = n == 2
+    p[two_points] = np.where(ssy[two_points] == 0, 1.0, 0.0)
+    slope_err[two_points] = 0.0
+    intercept_err[two_points] = 0.0
+    invalid = (n < 2) | (ssx == 0)
+    for arr in [slope, intercept, r, p, slope_err, intercept_err]:
+        arr[invalid] = np.nan
+    return LinregressResult(slope, intercept, r, p, slope_err, intercept_err)
+
+def linregress(x, y):
+    """
+    OLS fit of a single timeseries, ignoring nans, drop-in for scipy.stats.linregress
+    inputs:
+    x (np.ndarray): times, shape (n,)
+    y (np.ndarray): values, shape (n,)
+    outputs:
+    lls_result (LinregressResult): slope, intercept, rvalue, pvalue, stderr, intercept_stderr as floats
+    """
+    lls_result = linregress_columns(x, np.asarray(y, dtype=float).reshape(-1, 1))
+    return LinregressResult(*[float(arr[0]) for arr in lls_result])
+
+def matrix_trends(dates, y):
+    """
+    Linear trends in m/year for every transect of a (time x transects) matrix,
+    with each transect's intercept at its own first valid date
+    inputs:
+    dates (array-like of datetimes): shape (n,)
+    y (np.ndarray): cross-shore positions, shape (n, m), nan where missing
+    outputs:
+    lls_result (LinregressResult): arrays of shape (m,)
+    """
+    y = np.asarray(y, dtype=float)
+    if y.shape[0] == 0:
+        return LinregressResult(*[np.full(y.shape[1], np.nan) for field in LinregressResult._fields])
+    x = years_since(dates)
+    first_x = x[np.argmax(~np.isnan(y), axis=0)]
+    return linregress_columns(x[:,None] - first_x[None,:], y)
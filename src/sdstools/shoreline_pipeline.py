@@ -0,0 +1,233 @@
+"""
+Shoreline QA in one pass
+
+A ShorelinePipeline reads an extracted shorelines file (GeoJSON, GPKG, ...) once as a
+stream of record batches, runs a list of filter and transform stages over the batches
+and appends each processed batch to the output as it arrives, instead of reading and writing
+the whole file at every step. Only stages that need every row at once hold the whole file in memory.
+
+Example:
+pipeline = (ShorelinePipeline()
+            .month_range(6, 8)
+            .add_year()
+            .vertex_filter()
+            .to_utm()
+            .simplify(1)
+            .smooth(5)
+            .score_filter('image', 0.5)
+            .to_wgs84())
+pipeline.run('extracted_shorelines_lines.geojson', 'extracted_shorelines_lines_qa.geojson')
+"""
+
+import os
+from collections import namedtuple
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyogrio
+import shapely
+from line_smoothing import smooth_geometries
+from vertex_filter import sigma_clip_mask
+import filter_shorelines
+
+##func takes a GeoDataFrame and returns a GeoDataFrame,
+##stages that need_all_rows (e.g. statistics over the whole file) see every row at once
+Stage = namedtuple('Stage', ['name', 'func', 'needs_all_rows'])
+
+def read_batches(shorelines_path, batch_size=10000):
+    """
+    Streams a vector file as GeoDataFrames of up to batch_size rows, the file is only opened once
+    inputs:
+    shorelines_path (str): path to the shorelines
+    batch_size (int): rows per batch
+    outputs:
+    batches (generator of geopandas dataframes)
+    """
+    with pyogrio.raw.open_arrow(shorelines_path, batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        for record_batch in reader:
+            batch = gpd.GeoDataFrame.from_arrow(pa.Table.from_batches([record_batch]))
+            if batch.geometry.name != 'geometry':
+                batch = batch.rename_geometry('geometry')
+            yield batch.set_crs(meta['crs'], allow_override=True)
+
+def _split(gdf, batch_size):
+    """
+    Splits a GeoDataFrame back into batches
+    """
+    for start in range(0, len(gdf), batch_size):
+        yield gdf.iloc[start:start+batch_size]
+
+class ShorelinePipeline:
+    """
+    Ordered list of stages to run over the batches of a shorelines file
+    """
+
+    def __init__(self, stages=None, batch_size=10000):
+        """
+        inputs:
+        stages (list of Stage): optional, stages to start with
+        batch_size (int): rows per batch
+        """
+        self.stages = list(stages) if stages is not None else []
+        self.batch_size = batch_size
+
+    def add(self, name, func, needs_all_rows=False):
+        """
+        Adds a stage
+        inputs:
+        name (str): name of the stage
+        func (function): takes a geopandas dataframe and returns a geopandas dataframe,
+                         filters return a subset of the rows
+        needs_all_rows (bool): True if func needs every row at once, e.g. a filter on statistics of the whole file
+        outputs:
+        self (ShorelinePipeline): so stages can be chained
+        """
+        self.stages.append(Stage(name, func, needs_all_rows))
+        return self
+
+    def month_range(self, min_month, max_month):
+        """
+        Keeps shorelines from min_month to max_month (e.g. summer 6 to 8), same as shoreline_processing.filter_by_month_range
+        """
+        def func(batch):
+            return batch[batch['date'].dt.month.isin(range(min_month, max_month+1))]
+        return self.add('month_range', func)
+
+    def add_year(self):
+        """
+        Adds the year as a field, same as shoreline_processing.add_year_as_field
+        """
+        def func(batch):
+            batch = batch.copy()
+            batch['year'] = batch['date'].dt.year
+            return batch
+        return self.add('add_year', func)
+
+    def vertex_filter(self, n_sigma=3, statistic='vtx'):
+        """
+        Recursive n-sigma filter over all of the shorelines
+        inputs:
+        n_sigma (float): number of standard deviations
+        statistic (str): 'vtx' to filter on the number of vertices, same as shoreline_processing.vertex_filter,
+                         or 'length:vtx' to filter on length per vertex, same as vertex_filter.vertex_filter
+                         (needs a planar crs, add to_utm first)
+        """
+        def func(gdf):
+            values = shapely.get_num_coordinates(gdf['geometry'].values).astype(float)
+            if statistic == 'length:vtx':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = gdf['geometry'].length.values/values
+            keep, limits = sigma_clip_mask(values, n_sigma)
+            return gdf[keep]
+        return self.add('vertex_filter', func, needs_all_rows=True)
+
+    def simplify(self, tolerance=1):
+        """
+        Simplifies the shorelines, same as shoreline_processing.simplify_lines
+        """
+        def func(batch):
+            batch = batch.copy()
+            batch['geometry'] = batch['geometry'].simplify(tolerance)
+            return batch
+        return self.add('simplify', func)
+
+    def smooth(self, refinements=5):
+        """
+        Smooths the shorelines with Chaikin's method, same as shoreline_processing.smooth_lines
+        (needs a planar crs, add to_utm first)
+        """
+        def func(batch):
+            batch = batch.copy()
+            batch['geometry'] = smooth_geometries(batch['geometry'].values, refinements=refinements)
+            return batch
+        return self.add('smooth', func)
+
+    def score_filter(self, which_filter, thresh=0):
+        """
+        Keeps shorelines with a score at or above thresh, same as filter_shorelines.apply_filters
+        inputs:
+        which_filter (str): 'overall', 'image', 'seg' or 'kde',
+                            'overall' is normalized over all of the shorelines so it sees every row at once
+        thresh (float): lowest score to keep
+        """
+        def func(gdf):
+            return filter_shorelines.apply_filters(gdf, which_filter, thresh=thresh)
+        return self.add('score_filter', func, needs_all_rows=which_filter == 'overall')
+
+    def to_utm(self):
+        """
+        Projects to the UTM zone of the first batch, so every batch ends up in the same crs
+        """
+        utm_crs = []
+        def func(batch):
+            if not utm_crs:
+                utm_crs.append(batch.estimate_utm_crs())
+            return batch.to_crs(utm_crs[0])
+        return self.add('to_utm', func)
+
+    def to_wgs84(self):
+        """
+        Projects to wgs84
+        """
+        return self.add('to_wgs84', lambda batch: batch.to_crs('epsg:4326'))
+
+    def _apply(self, stage, batches):
+        """
+        Runs one stage lazily over a stream of batches
+        """
+        if stage.needs_all_rows:
+            batches = list(batches)
+            if not batches:
+                return
+            gdf = stage.func(pd.concat(batches))
+            yield from _split(gdf, self.batch_size)
+        else:
+            for batch in batches:
+                batch = stage.func(batch)
+                if len(batch) > 0:
+                    yield batch
+
+    def iter_batches(self, batches):
+        """
+        Chains every stage over a stream of batches, nothing runs until the output is iterated
+        inputs:
+        batches (iterable of geopandas dataframes): e.g. from read_batches
+        outputs:
+        batches (generator of geopandas dataframes): the processed batches
+        """
+        for stage in self.stages:
+            batches = self._apply(stage, batches)
+        return batches
+
+    def process(self, shorelines):
+        """
+        Runs the pipeline on shorelines already in memory
+        inputs:
+        shorelines (geopandas dataframe): shorelines
+        outputs:
+        shorelines (geopandas dataframe): processed shorelines
+        """
+        batches = list(self.iter_batches(_split(shorelines, self.batch_size)))
+        if not batches:
+            return shorelines.iloc[:0]
+        return pd.concat(batches).reset_index(drop=True)
+
+    def run(self, shorelines_path, output_path=None):
+        """
+        Reads the shorelines once, runs every stage and appends each processed batch to the output
+        inputs:
+        shorelines_path (str): path to the extracted shorelines
+        output_path (str): optional, defaults to the input name with '_qa' appended, as geojson
+        outputs:
+        output_path (str): path to the processed shorelines
+        """
+        if output_path is None:
+            output_path = os.path.splitext(shorelines_path)[0]+'_qa.geojson'
+        rows_written = 0
+        for batch in self.iter_batches(read_batches(shorelines_path, batch_size=self.batch_size)):
+            pyogrio.write_dataframe(batch.reset_index(drop=True), output_path, append=rows_written > 0)
+            rows_written += len(batch)
+        if rows_written == 0:
+            raise ValueError('no shorelines left after ' + ', '.join(stage.name for stage in self.stages))
+        return output_path
@@ -13,6 +13,8 @@ import pandas as pd
 import datetime
 from scipy import stats
 import shapely
+from line_smoothing import smooth_geometries
+from vertex_filter import sigma_clip_mask
 from shapely import geometry
 import warnings
 warnings.filterwarnings("ignore")
@@ -117,45 +119,15 @@ def vertex_filter(shorelines):
     new_path (str): path to the filtered file 
     """
     gdf = gpd.read_file(shorelines)
-    
-    count = len(gdf)
-    new_count = None
-    for index, row in gdf.iterrows():
-        gdf.at[index,'vtx'] = len(row['geometry'].coords)
-    filter_gdf = gdf.copy()
-
-    while count != new_count:
-        count = len(filter_gdf)
-        sigma = np.std(filter_gdf['vtx'])
-        mean = np.mean(filter_gdf['vtx'])
-        high_limit = mean+3*sigma
-        low_limit = mean-3*sigma
-        filter_gdf = gdf[gdf['vtx']< high_limit]
-        filter_gdf = filter_gdf[filter_gdf['vtx']> low_limit]
-        if mean < 5:
-            break
-        new_count = len(filter_gdf)
-    
+
+    gdf['vtx'] = shapely.get_num_coordinates(gdf['geometry'].values).astype(float)
+    keep, limits = sigma_clip_mask(gdf['vtx'].values, 3)
+    filter_gdf = gdf[keep]
+
     new_path = os.path.splitext(shorelines)[0]+'_vtx.geojson'
     filter_gdf.to_file(new_path)
     return new_path
 
-def chaikins_corner_cutting(coords, refinements=5):
-    """
-    Smooths out lines or polygons with Chaikin's method
-    """
-    i=0
-    for _ in range(refinements):
-        L = coords.repeat(2, axis=0)
-        R = np.empty_like(L)
-        R[0] = L[0]
-        R[2::2] = L[1:-1:2]
-        R[1:-1:2] = L[2::2]
-        R[-1] = L[-1]
-        coords = L * 0.75 + R * 0.25
-        i=i+1
-    return coords
-
 def simplify_lines(shorelines_path, tolerance=1):
     """
     Uses shapely simplify function to smooth out the extracted shorelines
@@ -188,12 +160,7 @@ def smooth_lines(shorelines,refinements=5):
     save_path = os.path.join(dirname,os.path.splitext(os.path.basename(shorelines))[0]+'_smooth.geojson')
     lines = gpd.read_file(shorelines)
     new_lines = lines.copy()
-    for i in range(len(lines)):
-        line = lines.iloc[i]
-        coords = LineString_to_arr(line.geometry)
-        refined = chaikins_corner_cutting(coords, refinements=refinements)
-        refined_geom = arr_to_LineString(refined)
-        new_lines['geometry'][i] = refined_geom
+    new_lines['geometry'] = smooth_geometries(lines['geometry'].values, refinements=refinements)
     new_lines.to_file(save_path)
     return save_path
 
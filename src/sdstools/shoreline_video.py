@@ -14,7 +14,8 @@ import cv2
 import shutil
 import pandas as pd
 from pathlib import Path
-from scipy import stats
+from linear_trends import linregress, years_since
+from timeseries_storage import read_matrix, read_shorelines
 
 
 def make_shoreline_video_frames(shorelines_path,
@@ -25,21 +26,23 @@ def make_shoreline_video_frames(shorelines_path,
     """
     This function will construct video frames displaying historical shorelines and a select timeseries
     inputs:
-    shorelines_path (str): path to the extracted_shorelines_lines.geojson file
+    shorelines_path (str): path to the extracted_shorelines_lines.geojson file (or GeoParquet)
     config_gdf_path (str): path to the config_gdf.geojson file
-    transect_timeseries_path (str): path to the transect_timeseries.csv or transect_timeseries_tidally_corrected_matrix.csv
+    transect_timeseries_path (str): path to the transect_timeseries.csv or transect_timeseries_tidally_corrected_matrix.csv (or .parquet)
     transect_id (str): which transect to show
     sitename (str): name of site
     """
     ##Load shorelines, transect, timeseries in
-    shorelines = gpd.read_file(shorelines_path)
+    shorelines = read_shorelines(shorelines_path)
     shorelines.rename({'date':'dates'},axis=1,inplace=True)
     shorelines['dates'] = pd.to_datetime(shorelines['dates'], format='%Y-%m-%dT%H:%M:%S')
+    if shorelines['dates'].dt.tz is not None:
+        shorelines['dates'] = shorelines['dates'].dt.tz_convert(None)
     config_gdf = gpd.read_file(config_gdf_path)
     transects = config_gdf[config_gdf['type']=='transect']
     transect = transects[transects['id']==transect_id]
-    timeseries = pd.read_csv(transect_timeseries_path)
-    timeseries['dates'] = pd.to_datetime(timeseries['dates'], format='%Y-%m-%d %H:%M:%S+00:00')
+    timeseries = read_matrix(transect_timeseries_path, transect_ids=[transect_id])
+    timeseries['dates'] = timeseries['dates'].dt.tz_localize(None)
 
     ##Some simple timeseries processing
     dates = timeseries['dates']
@@ -56,18 +59,9 @@ def make_shoreline_video_frames(shorelines_path,
     ##de-trending the timeseries
     filter_df = pd.DataFrame({'pos':y},
                              index=data.index)
-    datetimes_seconds = [None]*len(filter_df)
-    initial_time = filter_df.index[0]
-    for i in range(len(filter_df)):
-        t = filter_df.index[i]
-        dt = t-initial_time
-        dt_sec = dt.total_seconds()
-        datetimes_seconds[i] = dt_sec
-    datetimes_seconds = np.array(datetimes_seconds)
-    datetimes_years = datetimes_seconds/(60*60*24*365)
-    X = datetimes_years
+    X = years_since(filter_df.index)
     Y = y
-    lls_result = stats.linregress(X,Y)
+    lls_result = linregress(X,Y)
     slope = lls_result.slope
     intercept = lls_result.intercept
     fitx = np.linspace(min(X),max(X),len(X))
@@ -1,6 +1,6 @@
 import pandas as pd
 import numpy as np
-import HampelFilter.hampel_filter as hampel_filter
+from HampelFilter import HampelFilter, hampel_filter
 
 
 
@@ -21,27 +21,41 @@ def hampel_filter_df(df, hampel_window=10, hampel_sigma=2):
     df['cross_distance'] = vals
     return df
 
-def hampel_filter_loop(df, hampel_window=5, hampel_sigma=3):
+def hampel_filter_loop(df, hampel_window=5, hampel_sigma=3, min_valid=None):
     """
     Recursively applies Hampel Filter
+    The filter runs in place on a fixed-length float array, so the dataframe isn't rebuilt every pass
     inputs:
     df (pandas DataFrame): dataframe with columns 'dates' and 'cross_distance'
     hampel_window (int): odd integer, the kernel size for the filter
     hampel_sigma (float): number of stds to filter between
+    min_valid (int): optional, if given the windows stay at fixed positions with nan-median/nan-MAD
+                     and only windows with at least min_valid non-nan samples are tested
+                     (e.g. hampel_window//2+1 so outliers next to gaps are left alone),
+                     default is None, the nans are dropped and the remaining samples filtered every pass
     outputs:
     df (pandas DataFrame): filtered dataframe
     """
     df['date'] = df.index
-    num_nans = df['cross_distance'].isna().sum()
-    new_num_nans = None
+    hampel = HampelFilter(window_size=hampel_window, n_sigma=hampel_sigma, min_valid=min_valid)
+    vals = df['cross_distance'].values.astype(float)
+    num_nans = None
+    new_num_nans = np.count_nonzero(np.isnan(vals))
     h=0
-    while (num_nans != new_num_nans) and (len(df)>hampel_window):
-        num_nans = df['cross_distance'].isna().sum()
-        df = hampel_filter_df(df, hampel_window=hampel_window, hampel_sigma=hampel_sigma)
-        new_num_nans = df['cross_distance'].isna().sum()
-        df = df.dropna()
+    while (num_nans != new_num_nans) and (len(vals)-new_num_nans>hampel_window):
+        num_nans = new_num_nans
+        if min_valid is None:
+            ##same as dropping the nans and filtering what is left, the first pass sees the original gaps
+            kept = np.arange(len(vals)) if h == 0 else np.flatnonzero(~np.isnan(vals))
+            outlier_idxes = kept[hampel.apply(vals[kept]).get_indices()]
+        else:
+            outlier_idxes = hampel.apply(vals).get_indices()
+        vals[outlier_idxes] = np.nan
+        new_num_nans = np.count_nonzero(np.isnan(vals))
         h=h+1
     print('hampel iterations: '+str(h))
+    df['cross_distance'] = vals
+    df = df.dropna()
     return df
 
 def change_filter(df, q=0.75):
@@ -0,0 +1,379 @@
+"""
+Parquet/GeoParquet storage for transect timeseries and shorelines
+
+Reads and writes the merged long table (dates, transect_id, cross_distance, ...),
+the dates x transects matrix and shoreline geometries. Paths ending in .parquet are stored
+as Parquet with a typed UTC datetime 'dates' column, sorted by date so date filters only read
+the row groups they need; any other path is read and written as CSV (or GeoJSON etc. for shorelines)
+the same way as before, so CSV stays available as an export format.
+"""
+
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq', '.geoparquet')
+
+##rows per parquet row group, the unit that date/transect filters can skip
+ROW_GROUP_SIZE = 100000
+
+def is_parquet(path):
+    """
+    True if path should be stored as Parquet, from its extension
+    """
+    return os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS
+
+def _utc(date):
+    """
+    Parses a date (str or datetime) to a UTC timestamp
+    """
+    date = pd.Timestamp(date)
+    if date.tzinfo is None:
+        return date.tz_localize('UTC')
+    return date.tz_convert('UTC')
+
+def _filters(start_date=None, end_date=None, transect_ids=None, date_column='dates'):
+    """
+    pyarrow filters for a date range (inclusive) and a list of transects
+    """
+    filters = []
+    if start_date is not None:
+        filters.append((date_column, '>=', _utc(start_date)))
+    if end_date is not None:
+        filters.append((date_column, '<=', _utc(end_date)))
+    if transect_ids is not None:
+        filters.append(('transect_id', 'in', list(transect_ids)))
+    return filters if filters else None
+
+def _date_mask(dates, start_date=None, end_date=None):
+    """
+    Boolean mask of dates inside a date range (inclusive)
+    """
+    mask = np.ones(len(dates), dtype=bool)
+    if start_date is not None:
+        mask &= np.asarray(dates >= _utc(start_date))
+    if end_date is not None:
+        mask &= np.asarray(dates <= _utc(end_date))
+    return mask
+
+def _merged_table(merged_df):
+    """
+    Merged dataframe with typed UTC dates, sorted by date then transect, as an arrow table
+    """
+    merged_df = merged_df.copy()
+    merged_df['dates'] = pd.to_datetime(merged_df['dates'], utc=True)
+    merged_df = merged_df.sort_values(['dates', 'transect_id'], kind='stable')
+    return pa.Table.from_pandas(merged_df, preserve_index=False)
+
+def _matrix_table(matrix_df):
+    """
+    Matrix dataframe (dates as index or as a 'dates' column) with typed UTC dates,
+    string transect columns and sorted by date, as an arrow table
+    """
+    if 'dates' not in matrix_df.columns:
+        matrix_df = matrix_df.rename_axis('dates').reset_index()
+    matrix_df = matrix_df.copy()
+    matrix_df.columns = [str(col) for col in matrix_df.columns]
+    matrix_df['dates'] = pd.to_datetime(matrix_df['dates'], utc=True)
+    matrix_df = matrix_df.sort_values('dates', kind='stable')
+    return pa.Table.from_pandas(matrix_df, preserve_index=False)
+
+def _write_table(table, path, row_group_size=ROW_GROUP_SIZE):
+    """
+    Writes an arrow table to a temporary file then swaps it in,
+    so readers never see a partly written file
+    """
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, row_group_size=row_group_size)
+    os.replace(tmp_path, path)
+
+def write_merged(merged_df, path, row_group_size=ROW_GROUP_SIZE):
+    """
+    Saves the merged long table of transect timeseries
+    inputs:
+    merged_df (pandas DataFrame): dates, transect_id, cross_distance, ... one row per intersection
+    path (str): .parquet to save as parquet, otherwise csv
+    row_group_size (int): rows per parquet row group
+    outputs:
+    path (str): path to the saved file
+    """
+    if is_parquet(path):
+        _write_table(_merged_table(merged_df), path, row_group_size=row_group_size)
+    else:
+        merged_df.to_csv(path)
+    return path
+
+def read_merged(path, columns=None, start_date=None, end_date=None, transect_ids=None):
+    """
+    Loads the merged long table of transect timeseries
+    inputs:
+    path (str): .parquet or .csv
+    columns (list): optional, columns to load, 'dates' is always loaded
+    start_date (str or datetime): optional, first date to load (UTC if no timezone is given)
+    end_date (str or datetime): optional, last date to load
+    transect_ids (list): optional, transects to load
+    outputs:
+    merged_df (pandas DataFrame): with 'dates' as UTC datetimes
+    """
+    if columns is not None:
+        columns = ['dates'] + [col for col in columns if col != 'dates']
+    if is_parquet(path):
+        read_columns = columns
+        if columns is not None and transect_ids is not None and 'transect_id' not in columns:
+            read_columns = columns + ['transect_id']
+        merged_df = pd.read_parquet(path, engine='pyarrow', columns=read_columns,
+                                    filters=_filters(start_date, end_date, transect_ids))
+        if read_columns is not columns:
+            merged_df = merged_df[columns]
+        return merged_df
+
+    usecols = None
+    if columns is not None:
+        usecols = set(columns) | ({'transect_id'} if transect_ids is not None else set())
+    merged_df = pd.read_csv(path, usecols=usecols)
+    merged_df['dates'] = pd.to_datetime(merged_df['dates'], utc=True)
+    mask = _date_mask(merged_df['dates'], start_date, end_date)
+    if transect_ids is not None:
+        mask &= merged_df['transect_id'].astype(str).isin([str(transect_id) for transect_id in transect_ids]).values
+    merged_df = merged_df[mask].reset_index(drop=True)
+    if columns is not None:
+        merged_df = merged_df[columns]
+    return merged_df
+
+def write_matrix(matrix_df, path, row_group_size=ROW_GROUP_SIZE):
+    """
+    Saves the dates x transects matrix of cross-shore positions
+    inputs:
+    matrix_df (pandas DataFrame): dates as the index (as made by pivot) or as a 'dates' column, one column per transect
+    path (str): .parquet to save as parquet, otherwise csv
+    row_group_size (int): rows per parquet row group
+    outputs:
+    path (str): path to the saved file
+    """
+    if is_parquet(path):
+        _write_table(_matrix_table(matrix_df), path, row_group_size=row_group_size)
+    else:
+        matrix_df.to_csv(path)
+    return path
+
+def read_matrix(path, transect_ids=None, start_date=None, end_date=None):
+    """
+    Loads the dates x transects matrix of cross-shore positions
+    inputs:
+    path (str): .parquet or .csv
+    transect_ids (list): optional, transects (columns) to load
+    start_date (str or datetime): optional, first date to load (UTC if no timezone is given)
+    end_date (str or datetime): optional, last date to load
+    outputs:
+    matrix_df (pandas DataFrame): 'dates' column of UTC datetimes then one column per transect
+    """
+    columns = None
+    if transect_ids is not None:
+        columns = ['dates'] + [str(transect_id) for transect_id in transect_ids]
+    if is_parquet(path):
+        return pd.read_parquet(path, engine='pyarrow', columns=columns,
+                               filters=_filters(start_date, end_date))
+
+    matrix_df = pd.read_csv(path, usecols=columns)
+    matrix_df = matrix_df.drop(columns=[col for col in matrix_df.columns if col.startswith('Unnamed')])
+    matrix_df['dates'] = pd.to_datetime(matrix_df['dates'], utc=True)
+    matrix_df = matrix_df[_date_mask(matrix_df['dates'], start_date, end_date)].reset_index(drop=True)
+    if columns is not None:
+        matrix_df = matrix_df[columns]
+    return matrix_df
+
+def write_shorelines(shorelines_gdf, path, date_column='date', row_group_size=ROW_GROUP_SIZE):
+    """
+    Saves shorelines, as GeoParquet sorted by date for .parquet paths, otherwise with to_file (GeoJSON etc.)
+    inputs:
+    shorelines_gdf (geopandas dataframe): shorelines
+    path (str): output path
+    date_column (str): name of the date column
+    row_group_size (int): rows per parquet row group
+    outputs:
+    path (str): path to the saved file
+    """
+    if is_parquet(path):
+        shorelines_gdf = shorelines_gdf.copy()
+        shorelines_gdf[date_column] = pd.to_datetime(shorelines_gdf[date_column], utc=True)
+        shorelines_gdf = shorelines_gdf.sort_values(date_column, kind='stable')
+        tmp_path = path + '.tmp'
+        shorelines_gdf.to_parquet(tmp_path, index=False, row_group_size=row_group_size, write_covering_bbox=True)
+        os.replace(tmp_path, path)
+    else:
+        shorelines_gdf.to_file(path)
+    return path
+
+def read_shorelines(path, columns=None, start_date=None, end_date=None, bbox=None, date_column='date'):
+    """
+    Loads shorelines from GeoParquet or any file geopandas can read
+    inputs:
+    path (str): shorelines path
+    columns (list): optional, attribute columns to load, the geometry is always loaded
+    start_date (str or datetime): optional, first date to load (UTC if no timezone is given)
+    end_date (str or datetime): optional, last date to load
+    bbox (tuple): optional, (minx, miny, maxx, maxy) in the file's crs
+    date_column (str): name of the date column
+    outputs:
+    shorelines_gdf (geopandas dataframe)
+    """
+    if is_parquet(path):
+        if columns is not None:
+            columns = list(columns) + ['geometry']
+        return gpd.read_parquet(path, columns=columns, bbox=bbox,
+                                filters=_filters(start_date, end_date, date_column=date_column))
+
+    shorelines_gdf = gpd.read_file(path, columns=columns, bbox=bbox)
+    if start_date is not None or end_date is not None:
+        dates = pd.to_datetime(shorelines_gdf[date_column], utc=True)
+        shorelines_gdf = shorelines_gdf[_date_mask(dates, start_date, end_date)].reset_index(drop=True)
+    return shorelines_gdf
+
+def _matrix_cache_paths(path, orientation, dtype):
+    """
+    Paths of the cached binary matrix and its dates/transects for a matrix file
+    """
+    base = os.path.splitext(path)[0]+'_'+orientation+'_'+np.dtype(dtype).name
+    return base+'.npy', base+'_index.npz'
+
+def _load_matrix_cache(path, orientation, dtype):
+    """
+    Memory-maps a cached matrix, None if there isn't one or the source file has changed since it was made
+    """
+    data_path, index_path = _matrix_cache_paths(path, orientation, dtype)
+    if not (os.path.isfile(data_path) and os.path.isfile(index_path)):
+        return None
+    source_stat = os.stat(path)
+    with np.load(index_path) as index:
+        if tuple(index['source']) != (source_stat.st_size, source_stat.st_mtime_ns):
+            return None
+        dates = pd.Series(index['dates'], name='dates')
+        if str(index['tz']):
+            dates = dates.dt.tz_localize('UTC').dt.tz_convert(str(index['tz']))
+        transects_vector = index['transects'].tolist()
+    ##copy on write, so callers can edit the matrix without touching the cache
+    data_matrix = np.load(data_path, mmap_mode='c')
+    return data_matrix, dates, transects_vector
+
+def _save_matrix_cache(path, orientation, dtype, data_matrix, dates, transects_vector):
+    """
+    Saves a matrix and its dates/transects next to the matrix file, each written to a temporary file first
+    """
+    data_path, index_path = _matrix_cache_paths(path, orientation, dtype)
+    source_stat = os.stat(path)
+    tz = dates.dt.tz
+    with open(data_path+'.tmp', 'wb') as f:
+        np.save(f, data_matrix)
+    with open(index_path+'.tmp', 'wb') as f:
+        np.savez(f,
+                 source=np.array([source_stat.st_size, source_stat.st_mtime_ns], dtype=np.int64),
+                 dates=(dates.dt.tz_convert(None) if tz is not None else dates).to_numpy(),
+                 tz=np.array(str(tz) if tz is not None else ''),
+                 transects=np.array(transects_vector, dtype=str))
+    os.replace(data_path+'.tmp', data_path)
+    os.replace(index_path+'.tmp', index_path)
+
+def read_merged_transect_time_series_file(transect_time_series_file, orientation='transects', dtype=np.float64, cache=False):
+    """
+    Reads a dates x transects matrix file (CoastSeg/CoastSat stacked column wise date and transects format)
+    The csv is parsed with the pyarrow engine (or the parquet from write_matrix is read),
+    dates are parsed once and the values are copied once, straight into a contiguous array
+    inputs:
+    transect_time_series_file (str): path to the matrix .csv or .parquet, first column dates, one column per transect
+    orientation (str): 'transects' for a (transects x dates) matrix, 'dates' for (dates x transects)
+    dtype (numpy dtype): np.float64 or np.float32
+    cache (bool): save the parsed matrix as a .npy next to the file and memory-map it on later reads,
+                  the cache is remade when the file changes
+    outputs:
+    data_matrix (np.ndarray): shoreline positions, C-contiguous in the chosen orientation
+    dates_vector (pandas Series): dates
+    transects_vector (list of str): transect ids
+    """
+    if orientation not in ('transects', 'dates'):
+        raise ValueError("orientation must be 'transects' or 'dates', got " + repr(orientation))
+    if cache:
+        cached = _load_matrix_cache(transect_time_series_file, orientation, dtype)
+        if cached is not None:
+            return cached
+
+    if is_parquet(transect_time_series_file):
+        matrix_df = pd.read_parquet(transect_time_series_file, engine='pyarrow')
+    else:
+        matrix_df = pd.read_csv(transect_time_series_file, engine='pyarrow', dtype={'dates':str})
+    matrix_df = matrix_df.drop(columns=[col for col in matrix_df.columns if 'unnamed' in col.lower() or col == ''])
+
+    date_column = 'dates' if 'dates' in matrix_df.columns else matrix_df.columns[0]
+    dates_vector = pd.to_datetime(matrix_df[date_column])
+    transects_vector = [col for col in matrix_df.columns if col != date_column and 'date' not in col]
+
+    columns = [matrix_df[col].to_numpy(dtype=dtype, na_value=np.nan) for col in transects_vector]
+    if orientation == 'transects':
+        data_matrix = np.empty((len(columns), len(matrix_df)), dtype=dtype)
+        for i, column in enumerate(columns):
+            data_matrix[i] = column
+    else:
+        data_matrix = np.empty((len(matrix_df), len(columns)), dtype=dtype)
+        for i, column in enumerate(columns):
+            data_matrix[:,i] = column
+
+    if cache:
+        _save_matrix_cache(transect_time_series_file, orientation, dtype, data_matrix, dates_vector, transects_vector)
+    return data_matrix, dates_vector, transects_vector
+
+def export_csv(path, csv_path=None):
+    """
+    Exports a merged table or matrix saved as parquet to csv
+    inputs:
+    path (str): path to the .parquet
+    csv_path (str): optional, defaults to path with a .csv extension
+    outputs:
+    csv_path (str): path to the csv
+    """
+    if csv_path is None:
+        csv_path = os.path.splitext(path)[0]+'.csv'
+    pd.read_parquet(path, engine='pyarrow').to_csv(csv_path, index=False)
+    return csv_path
+
+class ParquetAppender:
+    """
+    Writes dataframes to one parquet file a chunk at a time, for outputs too big to hold in memory
+    The file is written to a temporary path and only swapped in when closed without an error
+    """
+
+    def __init__(self, path, kind='merged', row_group_size=ROW_GROUP_SIZE):
+        """
+        inputs:
+        path (str): .parquet to save to
+        kind (str): 'merged' for the long table or 'matrix' for the dates x transects matrix
+        row_group_size (int): rows per parquet row group
+        """
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.to_table = _merged_table if kind == 'merged' else _matrix_table
+        self.row_group_size = row_group_size
+        self.writer = None
+
+    def write(self, df):
+        """
+        Appends a chunk, each chunk is sorted by date on its own
+        """
+        table = self.to_table(df)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.tmp_path, table.schema)
+        elif table.schema != self.writer.schema:
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.writer is not None:
+            self.writer.close()
+            if exc_type is None:
+                os.replace(self.tmp_path, self.path)
+            else:
+                os.remove(self.tmp_path)
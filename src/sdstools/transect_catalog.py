@@ -0,0 +1,241 @@
+"""
+Spatially indexed transect sets
+
+The first time a transects file is loaded, a copy of it is saved next to it as GeoParquet,
+sorted along a Hilbert curve and with a bbox column per row. Later loads for an area only read
+the row groups whose bboxes overlap it, and the copy is rebuilt whenever the transects file changes.
+A TransectCatalog then builds one STRtree over the transects it loaded, so bbox/polygon queries,
+clipping and transect QA on very large transect layers don't need a full scan.
+"""
+
+import os
+import json
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+from timeseries_storage import read_shorelines
+
+##rows per row group of the saved index, the unit that area loads can skip
+INDEX_ROW_GROUP_SIZE = 10000
+
+##parquet metadata key holding the size and modification time of the transects file an index was made from
+SOURCE_KEY = b'sdstools_catalog_source'
+
+##column holding each transect's row in the transects file, so loads keep the file's order
+ROW_COLUMN = 'catalog_row'
+
+def _source(transects_path):
+    """
+    Size and modification time of a transects file
+    """
+    source_stat = os.stat(transects_path)
+    return [source_stat.st_size, source_stat.st_mtime_ns]
+
+def _to_crs(geometry, target_crs, crs=None):
+    """
+    Merges a geometry, GeoSeries or GeoDataFrame into one geometry in target_crs
+    """
+    if isinstance(geometry, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        if geometry.crs is not None and target_crs is not None:
+            geometry = geometry.to_crs(target_crs)
+        return shapely.union_all(geometry.geometry.values)
+    if crs is not None and target_crs is not None:
+        geometry = gpd.GeoSeries([geometry], crs=crs).to_crs(target_crs).iloc[0]
+    return geometry
+
+class TransectCatalog:
+    """
+    Transects plus an STRtree over their geometries
+    """
+
+    def __init__(self, transects_gdf, tree=None):
+        """
+        inputs:
+        transects_gdf (geopandas dataframe): transects
+        tree (shapely.STRtree): optional prebuilt index over transects_gdf.geometry
+        """
+        self.transects = transects_gdf.reset_index(drop=True)
+        if tree is None:
+            tree = shapely.STRtree(self.transects.geometry.values)
+        self.tree = tree
+
+    @staticmethod
+    def index_path(transects_path):
+        """
+        Path of the saved index that goes with a transects file
+        """
+        return os.path.splitext(transects_path)[0] + '_catalog.parquet'
+
+    @classmethod
+    def index_is_current(cls, transects_path):
+        """
+        True if the saved index exists and was made from the transects file as it is now
+        """
+        index_path = cls.index_path(transects_path)
+        if not os.path.isfile(index_path):
+            return False
+        metadata = pq.read_schema(index_path).metadata or {}
+        return SOURCE_KEY in metadata and json.loads(metadata[SOURCE_KEY]) == _source(transects_path)
+
+    @classmethod
+    def save_index(cls, transects_path):
+        """
+        Saves the transects as GeoParquet next to the transects file, sorted along a Hilbert curve
+        so each row group covers a small area, with a bbox column so area loads can skip row groups,
+        written to a temporary file first so a half written index is never picked up
+        inputs:
+        transects_path (str): path to the transects
+        outputs:
+        index_path (str): path to the saved index
+        """
+        index_path = cls.index_path(transects_path)
+        source = _source(transects_path)
+        transects = read_shorelines(transects_path).reset_index(drop=True)
+        transects[ROW_COLUMN] = np.arange(len(transects))
+        geoms = transects.geometry
+        has_geometry = (~(geoms.isna() | geoms.is_empty)).values
+        distances = np.full(len(transects), np.iinfo(np.int64).max, dtype=np.int64)
+        if has_geometry.any():
+            distances[has_geometry] = geoms[has_geometry].hilbert_distance().values
+        transects = transects.iloc[np.argsort(distances, kind='stable')]
+
+        tmp_path = index_path + '.tmp'
+        transects.to_parquet(tmp_path, index=False, row_group_size=INDEX_ROW_GROUP_SIZE, write_covering_bbox=True)
+        table = pq.read_table(tmp_path)
+        table = table.replace_schema_metadata({**table.schema.metadata, SOURCE_KEY:json.dumps(source).encode()})
+        pq.write_table(table, tmp_path, row_group_size=INDEX_ROW_GROUP_SIZE)
+        os.replace(tmp_path, index_path)
+        return index_path
+
+    @staticmethod
+    def index_crs(index_path):
+        """
+        Crs of a saved index, from its GeoParquet metadata
+        """
+        geo = json.loads(pq.read_schema(index_path).metadata[b'geo'])
+        crs = geo['columns'][geo['primary_column']].get('crs', 'OGC:CRS84')
+        return None if crs is None else pyproj.CRS.from_user_input(crs)
+
+    @classmethod
+    def load(cls, transects_path, area=None, crs=None, save_index=True):
+        """
+        Loads transects through their saved index, the index is made (or remade) first
+        if there isn't one yet or the transects file has changed since it was made
+        inputs:
+        transects_path (str): path to the transects
+        area (shapely geometry, GeoSeries or GeoDataFrame): optional, only transects in row groups
+                                                            overlapping its bounds are loaded
+        crs (optional): crs of a plain shapely area, defaults to the transects'
+        save_index (bool): make the index if it is missing or out of date,
+                           otherwise the whole transects file is read
+        outputs:
+        catalog (TransectCatalog)
+        """
+        if not cls.index_is_current(transects_path):
+            if not save_index:
+                return cls(read_shorelines(transects_path))
+            cls.save_index(transects_path)
+        index_path = cls.index_path(transects_path)
+        bbox = None
+        if area is not None:
+            area = _to_crs(area, cls.index_crs(index_path), crs=crs)
+            bbox = tuple(area.bounds)
+        transects = gpd.read_parquet(index_path, bbox=bbox)
+        transects = transects.sort_values(ROW_COLUMN).drop(columns=[ROW_COLUMN, 'bbox'], errors='ignore')
+        return cls(transects)
+
+    def _to_catalog_crs(self, geometry, crs=None):
+        """
+        Merges a geometry, GeoSeries or GeoDataFrame into one geometry in the catalog's crs
+        """
+        return _to_crs(geometry, self.transects.crs, crs=crs)
+
+    def query_bbox(self, minx, miny, maxx, maxy, crs=None):
+        """
+        Transects whose geometry intersects a bounding box
+        inputs:
+        minx, miny, maxx, maxy (float): box bounds
+        crs (optional): crs of the bounds, defaults to the catalog's
+        outputs:
+        transects (geopandas dataframe): matching transects, in catalog order
+        """
+        box = self._to_catalog_crs(shapely.box(minx, miny, maxx, maxy), crs=crs)
+        idx = np.sort(self.tree.query(box, predicate='intersects'))
+        return self.transects.iloc[idx]
+
+    def query_polygon(self, polygon, predicate='intersects', crs=None):
+        """
+        Transects matching a spatial predicate against a polygon
+        inputs:
+        polygon (shapely geometry, GeoSeries or GeoDataFrame): area to query
+        predicate (str): any shapely.STRtree predicate, e.g. 'intersects' or 'within'
+        crs (optional): crs of a plain shapely polygon, defaults to the catalog's
+        outputs:
+        transects (geopandas dataframe): matching transects, in catalog order
+        """
+        polygon = self._to_catalog_crs(polygon, crs=crs)
+        idx = np.sort(self.tree.query(polygon, predicate=predicate))
+        return self.transects.iloc[idx]
+
+    def clip(self, area, crs=None):
+        """
+        Clips transects to an area, only transects the index says intersect it are touched
+        inputs:
+        area (shapely geometry, GeoSeries or GeoDataFrame): area to clip to
+        crs (optional): crs of a plain shapely area, defaults to the catalog's
+        outputs:
+        clipped_transects (geopandas dataframe): transects cut to the area, in catalog order
+        """
+        area = self._to_catalog_crs(area, crs=crs)
+        clipped_transects = self.query_polygon(area).copy()
+        clipped_transects['geometry'] = shapely.intersection(clipped_transects.geometry.values, area)
+        clipped_transects = clipped_transects[~clipped_transects.geometry.is_empty]
+        return clipped_transects
+
+    def _pairs(self, predicate, **kwargs):
+        """
+        Unique (i, j) pairs of transects, i < j, that match a predicate
+        """
+        left, right = self.tree.query(self.transects.geometry.values, predicate=predicate, **kwargs)
+        keep = left < right
+        return left[keep], right[keep]
+
+    def _pairs_df(self, left, right, id_column):
+        """
+        Table of transect pairs with their ids
+        """
+        pairs_df = pd.DataFrame({'transect_a':left,
+                                 'transect_b':right})
+        if id_column in self.transects.columns:
+            pairs_df['id_a'] = self.transects[id_column].values[left]
+            pairs_df['id_b'] = self.transects[id_column].values[right]
+        return pairs_df
+
+    def duplicates(self, tolerance=0.0, id_column='transect_id'):
+        """
+        Finds transects that are the same line, in either direction, within a tolerance
+        inputs:
+        tolerance (float): largest vertex offset, in catalog units, for two transects to count as the same
+        id_column (str): column with transect ids to include in the output
+        outputs:
+        pairs_df (pandas DataFrame): row positions (transect_a, transect_b) and ids of duplicate pairs
+        """
+        left, right = self._pairs('dwithin', distance=tolerance)
+        geoms = self.transects.geometry.values
+        same = (shapely.equals_exact(geoms[left], geoms[right], tolerance=tolerance) |
+                shapely.equals_exact(geoms[left], shapely.reverse(geoms[right]), tolerance=tolerance))
+        return self._pairs_df(left[same], right[same], id_column)
+
+    def crossings(self, id_column='transect_id'):
+        """
+        Finds transects that cross each other
+        inputs:
+        id_column (str): column with transect ids to include in the output
+        outputs:
+        pairs_df (pandas DataFrame): row positions (transect_a, transect_b) and ids of crossing pairs
+        """
+        left, right = self._pairs('crosses')
+        return self._pairs_df(left, right, id_column)
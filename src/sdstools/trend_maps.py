@@ -25,8 +25,10 @@ import geopandas as gpd
 import pandas as pd
 import datetime
 import shapely
+from concurrent.futures import ProcessPoolExecutor
 from math import degrees, atan2, radians
-from scipy import stats
+from linear_trends import LinregressResult, linregress, matrix_trends, years_since
+from timeseries_storage import read_matrix
 
 def add_north_arrow(ax, north_arrow_params):
     x,y,arrow_length = north_arrow_params
@@ -53,31 +55,20 @@ def arr_to_LineString(coords):
     line = shapely.geometry.LineString(points)
     return line
 
-def get_trend(filter_df,
-              trend_plot_path):
+def plot_trend(filter_df,
+               lls_result,
+               trend_plot_path):
     """
-    LLS on single transect timeseries
+    Makes and saves a plot of a transect timeseries with its linear trend
     inputs:
     filter_df (pandas DataFrame): two columns, dates and cross-shore positions
+    lls_result: lls results for this timeseries (slope, intercept, stderr, intercept_stderr, rvalue)
     trend_plot_path (str): path to save plot to
     outputs:
-    lls_result: all the lls results (slope, intercept, stderr, intercept_stderr, rvalue)
+    nothing
     """
-    
-    filtered_datetimes = np.array(filter_df['dates'])
-    shore_pos = np.array(filter_df['pos'])
-    datetimes_seconds = [None]*len(filtered_datetimes)
-    initial_time = filtered_datetimes[0]
-    for i in range(len(filter_df)):
-        t = filter_df['dates'].iloc[i]
-        dt = t-initial_time
-        dt_sec = dt.total_seconds()
-        datetimes_seconds[i] = dt_sec
-    datetimes_seconds = np.array(datetimes_seconds)
-    datetimes_years = datetimes_seconds/(60*60*24*365)
-    x = datetimes_years
-    y = shore_pos
-    lls_result = stats.linregress(x,y)
+    x = years_since(filter_df['dates'])
+    y = np.array(filter_df['pos'])
     slope = lls_result.slope
     intercept = lls_result.intercept
     r_value = lls_result.rvalue**2
@@ -102,7 +93,20 @@ def get_trend(filter_df,
     plt.savefig(trend_plot_path,dpi=300)
     plt.close()
 
-    
+def get_trend(filter_df,
+              trend_plot_path):
+    """
+    LLS on single transect timeseries
+    inputs:
+    filter_df (pandas DataFrame): two columns, dates and cross-shore positions
+    trend_plot_path (str): path to save plot to
+    outputs:
+    lls_result: all the lls results (slope, intercept, stderr, intercept_stderr, rvalue)
+    """
+    x = years_since(filter_df['dates'])
+    y = np.array(filter_df['pos'])
+    lls_result = linregress(x,y)
+    plot_trend(filter_df, lls_result, trend_plot_path)
     return lls_result
 
 def plot_timeseries(filter_df,
@@ -129,23 +133,90 @@ def plot_timeseries(filter_df,
     plt.savefig(timeseries_plot_path,dpi=300)
     plt.close()
     
+def compute_trends(timeseries_data,
+                   transect_ids,
+                   t_min,
+                   t_max):
+    """
+    Vectorized LLS on every transect's timeseries at once
+    inputs:
+    timeseries_data (pandas DataFrame): dates column plus one column of cross-shore positions per transect
+    transect_ids (list): transect ids to compute trends for
+    t_min (str): only use dates after this, '%Y-%m-%d %H:%M:%S+00:00'
+    t_max (str): only use dates before this, '%Y-%m-%d %H:%M:%S+00:00'
+    outputs:
+    trends_df (pandas DataFrame): indexed by transect id, with slope, intercept, r_squared,
+                                  slope_unc, intercept_unc, nan where a transect has no data.
+                                  Intercepts are at each transect's first valid date, like get_trend.
+    """
+    dates = timeseries_data['dates']
+    in_range = ((dates>datetime.datetime.strptime(t_min, '%Y-%m-%d %H:%M:%S+00:00')) &
+                (dates<datetime.datetime.strptime(t_max, '%Y-%m-%d %H:%M:%S+00:00'))).values
+    present_ids = [transect_id for transect_id in transect_ids if transect_id in timeseries_data.columns]
+    if not in_range.any():
+        present_ids = []
+    y = timeseries_data[present_ids].values.astype(float)[in_range]
+    lls_result = matrix_trends(dates[in_range], y)
+
+    trends_df = pd.DataFrame({'slope':lls_result.slope,
+                              'intercept':lls_result.intercept,
+                              'r_squared':lls_result.rvalue**2,
+                              'slope_unc':lls_result.stderr,
+                              'intercept_unc':lls_result.intercept_stderr},
+                             index=present_ids)
+    trends_df = trends_df.reindex(transect_ids)
+    return trends_df
+
+def make_transect_outputs(transect_id,
+                          filter_df,
+                          trend,
+                          timeseries_csv_path,
+                          timeseries_plot_path,
+                          trend_plot_path):
+    """
+    Writes one transect's timeseries csv, timeseries plot and trend plot
+    inputs:
+    transect_id (str): transect id
+    filter_df (pandas DataFrame): two columns, dates and cross-shore positions, no nans
+    trend (pandas Series): this transect's row from compute_trends
+    timeseries_csv_path (str): path to save csv to
+    timeseries_plot_path (str): path to save timeseries figure to
+    trend_plot_path (str): path to save trend figure to
+    outputs:
+    transect_id (str): transect id
+    """
+    filter_df.to_csv(timeseries_csv_path)
+    lls_result = LinregressResult(trend['slope'], trend['intercept'], np.sqrt(trend['r_squared']),
+                                  np.nan, trend['slope_unc'], trend['intercept_unc'])
+    plot_trend(filter_df, lls_result, trend_plot_path)
+    plot_timeseries(filter_df, timeseries_plot_path)
+    return transect_id
+
 def get_trends(transect_timeseries_path,
                config_gdf_path,
                t_min,
-               t_max):
+               t_max,
+               make_outputs=True,
+               workers=None):
     """
     Computes linear trends with LLS on each transect's timeseries data
     Saves geojson linking transect id's to trend values
+    Trends for all transects are fit at once (compute_trends), the per transect csvs and figures
+    are an optional second stage that can run on a process pool
     inputs:
-    transect_timeseries (str): path to the transect_timeseries csv (or transect_timeseries_tidally_corrected_matrix.csv)
+    transect_timeseries (str): path to the transect_timeseries csv (or transect_timeseries_tidally_corrected_matrix.csv), or the same matrix as .parquet
     config_gdf_path (str): path to the config_gdf (.geojson), it's assumed these are in WGS84
+    t_min (str): only use dates after this, '%Y-%m-%d %H:%M:%S+00:00'
+    t_max (str): only use dates before this, '%Y-%m-%d %H:%M:%S+00:00'
+    make_outputs (bool): write per transect csvs and figures, default True
+    workers (int): optional, number of processes to write the csvs and figures with
     outputs:
     save_path (str): path to geojson with adjusted transects (in WGS84), trends, csv path, timeseries plot path, trend plot path
     """
 
     ##Load in data
-    timeseries_data = pd.read_csv(transect_timeseries_path)
-    timeseries_data['dates'] = pd.to_datetime(timeseries_data['dates'], format='%Y-%m-%d %H:%M:%S+00:00')
+    timeseries_data = read_matrix(transect_timeseries_path)
+    timeseries_data['dates'] = timeseries_data['dates'].dt.tz_localize(None)
     config_gdf = gpd.read_file(config_gdf_path)
     transects = config_gdf[config_gdf['type']=='transect']
 
@@ -155,59 +226,50 @@ def get_trends(transect_timeseries_path,
     timeseries_csv_dir = os.path.join(home, 'timeseries_csvs')
     timeseries_plot_dir = os.path.join(home, 'timeseries_plots')
     trend_plot_dir = os.path.join(home, 'timeseries_trends_plots')
-    dirs = [timeseries_csv_dir, timeseries_plot_dir, trend_plot_dir]
-    for d in dirs:
-        try:
-            os.mkdir(d)
-        except:
-            pass
-    
-    ##For each transect, compute LLS, make plots, make csvs
-    slopes = np.empty(len(transects))
-    slopes[:] = np.nan
-    intercepts = np.empty(len(transects))
-    intercepts[:] = np.nan
-    r_squares = np.empty(len(transects))
-    r_squares[:] = np.nan
-    slope_uncertainties = np.empty(len(transects))
-    slope_uncertainties[:] = np.nan
-    intercept_uncertainties = np.empty(len(transects))
-    intercept_uncertainties[:] = np.nan
+    if make_outputs:
+        dirs = [timeseries_csv_dir, timeseries_plot_dir, trend_plot_dir]
+        for d in dirs:
+            try:
+                os.mkdir(d)
+            except:
+                pass
+
+    ##Compute LLS for every transect at once
+    trends_df = compute_trends(timeseries_data, list(transects['id']), t_min, t_max)
+    slopes = trends_df['slope'].values
+    intercepts = trends_df['intercept'].values
+    r_squares = trends_df['r_squared'].values
+    slope_uncertainties = trends_df['slope_unc'].values
+    intercept_uncertainties = trends_df['intercept_unc'].values
+
+    ##For each transect with a trend, make csvs and plots
     timeseries_csvs = [None]*len(transects)
     timeseries_plot_paths = [None]*len(transects)
     trend_plot_paths = [None]*len(transects)
+    jobs = []
     for i in range(len(slopes)):
-        transect_id = transects['id'].iloc[i]
-        timeseries_csv_path = os.path.join(timeseries_csv_dir, transect_id+'.csv')
-        timeseries_plot_path = os.path.join(timeseries_plot_dir, transect_id+'_timeseries.png')
-        trend_plot_path = os.path.join(trend_plot_dir, transect_id+'_timeseries_trend.png')
-        
-        x = timeseries_data['dates']
-        try:
-            y = timeseries_data[transect_id]
-        except:
-            i=i+1
+        if np.isnan(slopes[i]):
             continue
-        df = pd.DataFrame({'dates':x,
-                           'pos':y
-                           })
-        filter_df = df[df['dates']>datetime.datetime.strptime(t_min, '%Y-%m-%d %H:%M:%S+00:00')]
-        filter_df = df[df['dates']<datetime.datetime.strptime(t_max, '%Y-%m-%d %H:%M:%S+00:00')]
-        filter_df.reset_index()
-        filter_df = filter_df.dropna(how='any')
-        filter_df.to_csv(timeseries_csv_path)
-        
-        lls_result = get_trend(filter_df, trend_plot_path)
-        plot_timeseries(filter_df, timeseries_plot_path)
-        
-        slopes[i] = lls_result.slope
-        intercepts[i] = lls_result.intercept
-        r_squares[i] = lls_result.rvalue**2
-        slope_uncertainties[i] = lls_result.stderr
-        intercept_uncertainties[i] = lls_result.intercept_stderr
-        timeseries_csvs[i] = timeseries_csv_path
-        timeseries_plot_paths[i] = timeseries_plot_path
-        trend_plot_paths[i] = trend_plot_path
+        transect_id = transects['id'].iloc[i]
+        if make_outputs:
+            timeseries_csvs[i] = os.path.join(timeseries_csv_dir, transect_id+'.csv')
+            timeseries_plot_paths[i] = os.path.join(timeseries_plot_dir, transect_id+'_timeseries.png')
+            trend_plot_paths[i] = os.path.join(trend_plot_dir, transect_id+'_timeseries_trend.png')
+            df = pd.DataFrame({'dates':timeseries_data['dates'],
+                               'pos':timeseries_data[transect_id]
+                               })
+            filter_df = df[(df['dates']>datetime.datetime.strptime(t_min, '%Y-%m-%d %H:%M:%S+00:00')) &
+                           (df['dates']<datetime.datetime.strptime(t_max, '%Y-%m-%d %H:%M:%S+00:00'))]
+            filter_df = filter_df.dropna(how='any')
+            jobs.append((transect_id, filter_df, trends_df.iloc[i],
+                         timeseries_csvs[i], timeseries_plot_paths[i], trend_plot_paths[i]))
+
+    if workers is not None and workers > 1 and len(jobs) > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(make_transect_outputs, *zip(*jobs)))
+    else:
+        for job in jobs:
+            make_transect_outputs(*job)
 
     ###Making the vector file with trends
     skip_idx = np.isnan(slopes)
@@ -217,9 +279,9 @@ def get_trends(transect_timeseries_path,
     r_squares = r_squares[~np.isnan(r_squares)]
     slope_uncertainties = slope_uncertainties[~np.isnan(slope_uncertainties)]
     intercept_uncertainties = intercept_uncertainties[~np.isnan(intercept_uncertainties)]
-    timeseries_csvs = [ ele for ele in timeseries_csvs if ele is not None ]
-    timeseries_plot_paths = [ ele for ele in timeseries_plot_paths if ele is not None ]
-    trend_plot_paths = [ ele for ele in trend_plot_paths if ele is not None ]
+    timeseries_csvs = [timeseries_csvs[i] for i in range(len(transects)) if not skip_idx[i]]
+    timeseries_plot_paths = [timeseries_plot_paths[i] for i in range(len(transects)) if not skip_idx[i]]
+    trend_plot_paths = [trend_plot_paths[i] for i in range(len(transects)) if not skip_idx[i]]
     max_slope = np.max(np.abs(slopes))
     scaled_slopes = (np.array(slopes)/max_slope)*100
     new_lines = [None]*len(slopes)
@@ -284,12 +346,12 @@ def plot_trend_maps(transect_trends_geojson,
     transect_trends_gdf = transect_trends_gdf.to_crs('3857')
     ax = transect_trends_gdf.plot(column='linear_trend',
                                   legend=True,
-                                  legend_kwds={'label':'Trend (m/year'}
+                                  legend_kwds={'label':'Trend (m/year'},
                                   cmap='RdBu',
                                   )
     ax.set_title(site)
     cx.add_basemap(ax,
-                   source=cx.providers.CartoDB.DarkMatter
+                   source=cx.providers.CartoDB.DarkMatter,
                    attribution=False
                    )
     add_north_arrow(ax, north_arrow_params)
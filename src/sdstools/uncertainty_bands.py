@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import geopandas as gpd
 import numpy as np
 import shapely
+from timeseries_storage import read_merged
 
 def split_list_at_none(lst):
     # Initialize variables
@@ -86,7 +87,7 @@ def merge_multiple_transect_time_series(transect_time_series_list,
     Computes uncertainty bands from list of transect_time_series_merged.csvs
 
     inputs:
-    transect_time_series_list (list): list of transect_time_series_merged.csvs
+    transect_time_series_list (list): list of transect_time_series_merged.csvs (or .parquets)
     transects_path (str): path to transects, must have col 'transect_id', these should be integers in ascending order along the shore
     mean_savepath (str): path to save the mean shorelines
     conf_savepath (str): path to save the confidence polygons
@@ -99,7 +100,7 @@ def merge_multiple_transect_time_series(transect_time_series_list,
     dfs = [None]*len(transect_time_series_list)
     i=0
     for ts in transect_time_series_list:
-        dfs[i] = pd.read_csv(ts)
+        dfs[i] = read_merged(ts)
         i=i+1
     dfList = [df.set_index(['dates', 'transect_id']) for df in dfs]
     big_df = pd.concat(dfList, axis=1)
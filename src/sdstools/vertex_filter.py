@@ -1,6 +1,7 @@
 import os
 import geopandas as gpd
 import numpy as np
+import shapely
 
 def wgs84_to_utm_df(geo_df):
     """
@@ -26,44 +27,78 @@ def utm_to_wgs84_df(geo_df):
     gdf_wgs84 = geo_df.to_crs(wgs84_crs)
     return gdf_wgs84
 
-def vertex_filter(shorelines,n_sigma):
+def sigma_clip_mask(values, n_sigma, min_mean=5):
     """
-    Recursive 3-sigma filter on vertices in shorelines
-    Will filter out shorelines that have too many or too few
-    vertices until all of the shorelines left in the file are within
-    Mean+/-3*std
-    
-    Saves output to the same directory with same name but with (_vtx) appended.
-
+    Recursive sigma clipping
+    Each pass computes Mean+/-n_sigma*std of the values that are still kept
+    and keeps every value strictly inside those limits, until the number kept stops changing
+    or the mean drops below min_mean
     inputs:
-    shorelines (str): path to the extracted shorelines geojson
+    values (np.ndarray): values to clip, nans are never kept
+    n_sigma (float): number of standard deviations
+    min_mean (float): stop once the mean of the kept values is below this
     outputs:
-    new_path (str): path to the filtered file 
+    keep (np.ndarray): boolean mask of the values that are kept
+    limits (list of tuples): (low_limit, high_limit) from each pass
     """
-    gdf = gpd.read_file(shorelines)
-    gdf = wgs84_to_utm_df(gdf)
-    
-    count = len(gdf)
+    values = np.asarray(values, dtype=float)
+    keep = ~np.isnan(values)
+    limits = []
+    count = len(values)
     new_count = None
-    for index, row in gdf.iterrows():
-        vtx = len(row['geometry'].coords)
-        length = row['geometry'].length
-        gdf.at[index,'vtx'] = vtx
-        gdf.at[index,'length'] = length
-        gdf.ad[index,'length:vtx'] = length/vtx
-    filter_gdf = gdf.copy()
-
     while count != new_count:
-        count = len(filter_gdf)
-        sigma = np.std(filter_gdf['length:vtx'])
-        mean = np.mean(filter_gdf['length:vtx'])
+        count = np.count_nonzero(keep)
+        kept_values = values[keep]
+        sigma = np.std(kept_values) if count > 0 else np.nan
+        mean = np.mean(kept_values) if count > 0 else np.nan
         high_limit = mean+n_sigma*sigma
         low_limit = mean-n_sigma*sigma
-        filter_gdf = gdf[gdf['length:vtx']< high_limit]
-        filter_gdf = filter_gdf[filter_gdf['length:vtx']> low_limit]
-        if mean < 5:
+        limits.append((float(low_limit), float(high_limit)))
+        keep = (values < high_limit) & (values > low_limit)
+        if mean < min_mean:
             break
-        new_count = len(filter_gdf)
-        
-    filter_gdf = filter_gdf.reset_index(drop=True)
+        new_count = np.count_nonzero(keep)
+    return keep, limits
+
+def vertex_filter_mask(geometries, n_sigma=3):
+    """
+    Recursive n-sigma filter on shoreline length per vertex
+    inputs:
+    geometries (GeoSeries): shorelines in a planar crs (e.g. UTM)
+    n_sigma (float): number of standard deviations
+    outputs:
+    keep (np.ndarray): boolean mask of the shorelines that pass
+    limits (list of tuples): (low_limit, high_limit) on length:vtx from each pass
+    """
+    vtx = shapely.get_num_coordinates(np.asarray(geometries, dtype=object))
+    length = np.asarray(geometries.length, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        length_vtx = length/vtx
+    return sigma_clip_mask(length_vtx, n_sigma)
+
+def vertex_filter(shorelines,n_sigma):
+    """
+    Recursive n-sigma filter on vertices in shorelines
+    Will filter out shorelines that have too many or too few
+    vertices for their length until all of the shorelines left are within
+    Mean+/-n_sigma*std of length:vtx
+
+    inputs:
+    shorelines (str or geopandas dataframe): path to the extracted shorelines geojson, or the shorelines in wgs84
+    n_sigma (float): number of standard deviations
+    outputs:
+    filter_gdf (geopandas dataframe): shorelines that pass the filter, in UTM, with vtx, length and length:vtx columns
+    """
+    if isinstance(shorelines, str):
+        gdf = gpd.read_file(shorelines)
+    else:
+        gdf = shorelines
+    gdf = wgs84_to_utm_df(gdf)
+
+    gdf['vtx'] = shapely.get_num_coordinates(gdf['geometry'].values)
+    gdf['length'] = gdf['geometry'].length
+    gdf['length:vtx'] = gdf['length']/gdf['vtx']
+    keep, limits = sigma_clip_mask(gdf['length:vtx'].values, n_sigma)
+
+    filter_gdf = gdf[keep].reset_index(drop=True)
     return filter_gdf
@@ -0,0 +1,74 @@
+"""
+Tiled DEM sampling against sampling the whole raster with get_elevations
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+pytest.importorskip('rasterio')
+pytest.importorskip('kneed')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'sdstools'))
+import dem_to_beach_slope
+
+NO_DATA = -1.0
+TILE_NODATA = -9999.0
+
+def write_tile(path, values, left, top):
+    """
+    Writes a 1 m float32 GeoTIFF with 16 x 16 blocks
+    """
+    ds = gdal.GetDriverByName('GTiff').Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32,
+                                              options=['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16'])
+    ds.SetGeoTransform((left, 1, 0, top, 0, -1))
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(TILE_NODATA)
+    band.WriteArray(values)
+    ds = None
+    return path
+
+@pytest.fixture
+def mosaic():
+    """
+    Two 40 x 40 tiles side by side and a third tile on top of both, partly nodata
+    """
+    rng = np.random.default_rng(0)
+    overlap = rng.uniform(20, 30, (20, 20))
+    overlap[:, :10] = TILE_NODATA
+    overlap[:3, :] = TILE_NODATA
+    tile_paths = [write_tile('/vsimem/tile_a.tif', rng.uniform(0, 10, (40, 40)), 0, 40),
+                  write_tile('/vsimem/tile_b.tif', rng.uniform(10, 20, (40, 40)), 40, 40),
+                  write_tile('/vsimem/tile_c.tif', overlap, 30, 30)]
+    vrt_path = '/vsimem/mosaic.vrt'
+    gdal.BuildVRT(vrt_path, tile_paths).FlushCache()
+    yield vrt_path, tile_paths
+    for path in [vrt_path] + tile_paths:
+        gdal.Unlink(path)
+
+def sample_points():
+    """
+    Random points over and around the mosaic, plus points on tile edges and just left of the mosaic
+    """
+    rng = np.random.default_rng(1)
+    x = np.r_[rng.uniform(-3, 83, 2000), 40, 40, 0, 80, -0.5, 10, 45, 30, 50]
+    y = np.r_[rng.uniform(-3, 43, 2000), 20, 0, 40, 20, 20, 0, 40, 15, 10]
+    return x, y
+
+def test_tiled_sampler_matches_get_elevations_on_vrt(mosaic):
+    vrt_path, tile_paths = mosaic
+    x, y = sample_points()
+    raster = gdal.Open(vrt_path)
+    expected = dem_to_beach_slope.get_elevations(x, y, raster, raster.GetGeoTransform(), NO_DATA)
+    sampler = dem_to_beach_slope.TiledRasterSampler(vrt_path, cache_mb=0.001)
+    np.testing.assert_array_equal(sampler.sample(x, y, NO_DATA), expected)
+
+def test_tiled_sampler_matches_get_elevations_on_one_tile(mosaic):
+    vrt_path, tile_paths = mosaic
+    x, y = sample_points()
+    raster = gdal.Open(tile_paths[0])
+    expected = dem_to_beach_slope.get_elevations(x, y, raster, raster.GetGeoTransform(), NO_DATA)
+    sampler = dem_to_beach_slope.TiledRasterSampler(tile_paths[0])
+    np.testing.assert_array_equal(sampler.sample(x, y, NO_DATA), expected)
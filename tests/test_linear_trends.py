@@ -0,0 +1,55 @@
+"""
+Batched OLS trends against scipy.stats.linregress
+"""
+
+import os
+import sys
+import warnings
+import numpy as np
+import pytest
+from scipy import stats
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'sdstools'))
+import linear_trends
+
+def scipy_columns(x, y):
+    """
+    scipy.stats.linregress on the valid samples of each column, nan for columns it can't fit
+    """
+    results = []
+    for column in y.T:
+        valid = ~np.isnan(column)
+        if valid.sum() < 2 or np.ptp(x[valid]) == 0:
+            results.append([np.nan]*6)
+            continue
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            lls_result = stats.linregress(x[valid], column[valid])
+        results.append([getattr(lls_result, field) for field in linear_trends.LinregressResult._fields])
+    return np.array(results, dtype=float).T
+
+@pytest.mark.parametrize('y', [
+    [[2.0], [2.0]],
+    [[2.0], [3.0]],
+    [[2.0], [2.0], [2.0]],
+    [[2.0], [np.nan], [2.0], [2.0]],
+    [[1.0], [np.nan], [np.nan], [np.nan]],
+    [[1.0], [4.0], [2.0], [8.0]],
+])
+def test_special_cases_match_scipy(y):
+    y = np.array(y)
+    x = np.arange(len(y), dtype=float)
+    expected = scipy_columns(x, y)
+    result = np.array(linear_trends.linregress_columns(x, y))
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-12, equal_nan=True)
+
+def test_columns_with_gaps_match_scipy():
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 10, 60))
+    y = rng.normal(0, 1, (60, 25)) + x[:,None]*rng.normal(0, 1, 25)
+    y[rng.uniform(size=y.shape) < 0.3] = np.nan
+    y[:, 0] = 5.0
+    y[2:, 1] = np.nan
+    expected = scipy_columns(x, y)
+    result = np.array(linear_trends.linregress_columns(x, y))
+    np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-12, equal_nan=True)
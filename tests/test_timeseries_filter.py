@@ -0,0 +1,39 @@
+"""
+Recursive Hampel filtering of a single transect timeseries
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'sdstools'))
+import timeseries_filter
+from HampelFilter import hampel_filter
+
+def drop_and_refilter(df, hampel_window=5, hampel_sigma=3):
+    """
+    The loop as it was before it ran in place: filter, drop the nans and filter again until nothing changes
+    """
+    num_nans = df['cross_distance'].isna().sum()
+    new_num_nans = None
+    while (num_nans != new_num_nans) and (len(df) > hampel_window):
+        num_nans = df['cross_distance'].isna().sum()
+        vals = df['cross_distance'].values.copy()
+        vals[hampel_filter(vals, hampel_window, hampel_sigma)] = np.nan
+        df = df.assign(cross_distance=vals)
+        new_num_nans = df['cross_distance'].isna().sum()
+        df = df.dropna()
+    return df
+
+def test_default_matches_dropping_nans_every_pass():
+    rng = np.random.default_rng(0)
+    for trial in range(100):
+        n = rng.integers(8, 200)
+        vals = rng.normal(0, 1, n)
+        vals[rng.uniform(size=n) < 0.1] += rng.choice([-20, 20])
+        vals[rng.uniform(size=n) < 0.15] = np.nan
+        df = pd.DataFrame({'cross_distance':vals}, index=pd.date_range('2000-01-01', periods=n))
+        expected = drop_and_refilter(df.copy())
+        result = timeseries_filter.hampel_filter_loop(df.copy())
+        assert list(result.index) == list(expected.index)